@@ -6,6 +6,7 @@ import toast from 'react-hot-toast';
 import SpeechTypeInput from './SpeechTypeInput';
 import AudioPlayer from './AudioPlayer';
 import ProsodyModifier from './ProsodyModifier';
+import { streamMultistyleSpeech } from '../services/apiService';
 
 const MAX_SPEECH_TYPES = 100;
 const GUIDE_TEXT = `La Revolución Científica del siglo 17 transformó nuestra comprensión del universo. Figuras como Galileo Galilei, nacido en 1564, demostraron que la Tierra orbita alrededor del Sol, 
@@ -382,23 +383,37 @@ const writeString = (view, offset, string) => {
         }
       });
 
-      const response = await axios.post('http://localhost:5000/api/generate_multistyle_speech', {
+      const payload = {
         speech_types: speechTypesData,
         gen_text: generationText,
         remove_silence: removeSilence,
         cross_fade_duration: crossFadeDuration,
         speed_change: speedChange
-      });
-
-      if (response.data.success && response.data.audio_path) {
-        setGeneratedAudio(response.data.audio_path);
-        setGeneratedAudios(prev => [...prev, response.data.audio_path]); // Añadir a la lista de audios generados
-        setTranscriptionData(null);
-        setAnalyzeDone(false);
-        toast.success('Audio generado correctamente');
+      };
+
+      let audioPath;
+      if (removeSilence) {
+        // El streaming no elimina silencios: en ese caso se espera al archivo completo
+        const response = await axios.post('http://localhost:5000/api/generate_multistyle_speech', payload);
+        if (!(response.data.success && response.data.audio_path)) {
+          toast.error(response.data.message || 'Error al generar el audio');
+          return;
+        }
+        audioPath = response.data.audio_path;
       } else {
-        toast.error(response.data.message || 'Error al generar el audio');
+        // Cada bloque suena en cuanto llega; al terminar queda el archivo completo en el servidor
+        audioPath = await streamMultistyleSpeech(payload);
+        if (!audioPath) {
+          toast.error('Error al generar el audio');
+          return;
+        }
       }
+
+      setGeneratedAudio(audioPath);
+      setGeneratedAudios(prev => [...prev, audioPath]); // Añadir a la lista de audios generados
+      setTranscriptionData(null);
+      setAnalyzeDone(false);
+      toast.success('Audio generado correctamente');
     } catch (error) {
       toast.error('Error al generar el audio');
       console.error('Error:', error);
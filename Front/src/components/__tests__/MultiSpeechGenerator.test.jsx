@@ -5,6 +5,7 @@ import { render, screen, fireEvent, waitFor } from '@testing-library/react';
 import '@testing-library/jest-dom';
 import axios from 'axios';
 import MultiSpeechGenerator from '../MultiSpeechGenerator';
+import { streamMultistyleSpeech } from '../../services/apiService';
 
 // Mock de react-hot-toast
 jest.mock('react-hot-toast', () => ({
@@ -20,6 +21,11 @@ jest.mock('react-hot-toast', () => ({
 // Mock de axios
 jest.mock('axios');
 
+// Mock del streaming (fetch + AudioContext no existen en jsdom)
+jest.mock('../../services/apiService', () => ({
+  streamMultistyleSpeech: jest.fn(),
+}));
+
 // Confirm para “¿Estás seguro?” (si quisieras seguir usándolo en algún sitio)
 window.confirm = jest.fn().mockReturnValue(true);
 
@@ -61,14 +67,9 @@ describe('MultiSpeechGenerator Component (SIN probar delete)', () => {
     expect(screen.getAllByText(/Nombre del Tipo de Habla/i)).toHaveLength(1);
   });
 
-  test('genera audio y lo muestra en la lista (sin {Regular} para no exigir audio subido)', async () => {
-    // 1) Al generar
-    axios.post.mockResolvedValueOnce({
-      data: {
-        success: true,
-        audio_path: 'path/to/generatedAudio.wav'
-      }
-    });
+  test('genera audio en streaming y lo muestra en la lista (sin {Regular} para no exigir audio subido)', async () => {
+    // 1) Al generar, el streaming devuelve la ruta del archivo final
+    streamMultistyleSpeech.mockResolvedValueOnce('path/to/generatedAudio.wav');
 
     render(<MultiSpeechGenerator />);
     // Cambiamos el texto (sin {Regular})
@@ -79,20 +80,19 @@ describe('MultiSpeechGenerator Component (SIN probar delete)', () => {
     // Click en “Generar Habla”
     fireEvent.click(screen.getByRole('button', { name: /Generar Habla Multi-Estilo/i }));
 
-    // Esperamos la llamada a generate_multistyle_speech
+    // Esperamos la llamada al endpoint en streaming (no al bloqueante)
     await waitFor(() => {
-      expect(axios.post).toHaveBeenCalledWith(
-        'http://localhost:5000/api/generate_multistyle_speech',
-        expect.any(Object)
+      expect(streamMultistyleSpeech).toHaveBeenCalledWith(
+        expect.objectContaining({ gen_text: 'Texto sin llaves' })
       );
     });
+    expect(axios.post).not.toHaveBeenCalled();
 
     // Debe aparecer "generatedAudio.wav" en la lista
-    expect(screen.getByText('generatedAudio.wav')).toBeInTheDocument();
+    expect(await screen.findByText('generatedAudio.wav')).toBeInTheDocument();
   });
 
-  test('analiza el audio (analyze_audio)', async () => {
-    // 1) Generar
+  test('con "Eliminar silencios" usa el endpoint completo', async () => {
     axios.post.mockResolvedValueOnce({
       data: {
         success: true,
@@ -100,6 +100,28 @@ describe('MultiSpeechGenerator Component (SIN probar delete)', () => {
       }
     });
 
+    render(<MultiSpeechGenerator />);
+    fireEvent.change(
+      screen.getByPlaceholderText(/Ingresa el guion/i),
+      { target: { value: 'Texto sin llaves' } }
+    );
+    fireEvent.click(screen.getByLabelText(/Eliminar silencios/i));
+    fireEvent.click(screen.getByRole('button', { name: /Generar Habla Multi-Estilo/i }));
+
+    await waitFor(() => {
+      expect(axios.post).toHaveBeenCalledWith(
+        'http://localhost:5000/api/generate_multistyle_speech',
+        expect.objectContaining({ remove_silence: true })
+      );
+    });
+    expect(streamMultistyleSpeech).not.toHaveBeenCalled();
+    expect(await screen.findByText('generatedAudio.wav')).toBeInTheDocument();
+  });
+
+  test('analiza el audio (analyze_audio)', async () => {
+    // 1) Generar
+    streamMultistyleSpeech.mockResolvedValueOnce('path/to/generatedAudio.wav');
+
     render(<MultiSpeechGenerator />);
     fireEvent.change(
       screen.getByPlaceholderText(/Ingresa el guion/i),
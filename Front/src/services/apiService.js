@@ -17,3 +17,66 @@ export const modifyAudio = async (audio, modifications) => {
 
   return response.json();
 };
+
+// Reproduce el audio multi-estilo mientras se genera y devuelve la ruta del archivo final.
+// El servidor envía un WAV PCM 16 bits mono (cabecera de 44 bytes) por transferencia chunked.
+export const streamMultistyleSpeech = async (payload, sampleRate = 24000) => {
+  // Se crea antes del primer await, dentro del clic del usuario, para que el navegador permita el audio
+  const audioContext = new AudioContext({ sampleRate });
+  const response = await fetch(`${config.API_URL}/api/generate_multistyle_speech_stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(payload),
+  });
+
+  if (!response.ok) {
+    audioContext.close();
+    throw new Error('Error al generar el audio');
+  }
+
+  const reader = response.body.getReader();
+  let header = 44;
+  let pending = new Uint8Array(0);
+  let playAt = audioContext.currentTime + 0.1;
+
+  try {
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      let bytes = new Uint8Array(pending.length + value.length);
+      bytes.set(pending);
+      bytes.set(value, pending.length);
+      const skip = Math.min(header, bytes.length);
+      bytes = bytes.subarray(skip);
+      header -= skip;
+
+      // Muestras de 2 bytes: se guarda el byte sobrante para el siguiente bloque
+      const usable = bytes.length - (bytes.length % 2);
+      pending = bytes.slice(usable);
+      if (usable === 0) continue;
+
+      const samples = new Int16Array(bytes.slice(0, usable).buffer);
+      const buffer = audioContext.createBuffer(1, samples.length, sampleRate);
+      const channel = buffer.getChannelData(0);
+      for (let i = 0; i < samples.length; i++) {
+        channel[i] = samples[i] / 32768;
+      }
+      const source = audioContext.createBufferSource();
+      source.buffer = buffer;
+      source.connect(audioContext.destination);
+      playAt = Math.max(playAt, audioContext.currentTime);
+      source.start(playAt);
+      playAt += buffer.duration;
+    }
+  } catch (error) {
+    audioContext.close();
+    throw error;
+  }
+
+  // Se libera el contexto cuando termina de sonar lo que ya está programado
+  setTimeout(() => audioContext.close(), Math.max(playAt - audioContext.currentTime, 0) * 1000 + 100);
+  return response.headers.get('X-Audio-Path');
+};
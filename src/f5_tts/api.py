@@ -8,8 +8,10 @@ import tqdm
 from cached_path import cached_path
 
 from f5_tts.infer.utils_infer import (
+    ChunkCache,
     hop_length,
     infer_process,
+    infer_process_stream,
     load_model,
     load_vocoder,
     preprocess_ref_audio_text,
@@ -32,6 +34,8 @@ class F5TTS:
         vocoder_name="vocos",
         local_path=None,
         device=None,
+        chunk_cache_dir=None,
+        chunk_cache_max_bytes=2 * 1024**3,
     ):
         # Initialize parameters
         self.final_wave = None
@@ -39,6 +43,8 @@ class F5TTS:
         self.hop_length = hop_length
         self.seed = -1
         self.mel_spec_type = vocoder_name
+        # Generated chunks are reused across calls with the same text, voice, settings and seed
+        self.chunk_cache = ChunkCache(chunk_cache_dir, chunk_cache_max_bytes) if chunk_cache_dir else None
 
         # Set device
         self.device = device or (
@@ -96,11 +102,14 @@ class F5TTS:
         nfe_step=32,
         speed=1.0,
         fix_duration=None,
+        rolling_context=False,
         remove_silence=False,
         file_wave=None,
         file_spect=None,
         seed=-1,
     ):
+        # only an explicit seed can be asked for again: a random one would just fill the chunk cache
+        cache_seed = seed if seed != -1 and self.chunk_cache is not None else None
         if seed == -1:
             seed = random.randint(0, sys.maxsize)
         seed_everything(seed)
@@ -124,6 +133,9 @@ class F5TTS:
             sway_sampling_coef=sway_sampling_coef,
             speed=speed,
             fix_duration=fix_duration,
+            rolling_context=rolling_context,
+            seed=cache_seed,
+            chunk_cache=self.chunk_cache,
             device=self.device,
         )
 
@@ -135,6 +147,59 @@ class F5TTS:
 
         return wav, sr, spect
 
+    def infer_stream(
+        self,
+        ref_file,
+        ref_text,
+        gen_text,
+        show_info=print,
+        progress=tqdm,
+        target_rms=0.1,
+        cross_fade_duration=0.15,
+        sway_sampling_coef=-1,
+        cfg_strength=2,
+        nfe_step=32,
+        speed=1.0,
+        fix_duration=None,
+        rolling_context=False,
+        lead_max_chars=40,
+        vocoder_block_frames=None,
+        seed=-1,
+    ):
+        """Like infer, but yields float32 audio blocks at target_sample_rate as each chunk finishes."""
+        # only an explicit seed can be asked for again: a random one would just fill the chunk cache
+        cache_seed = seed if seed != -1 and self.chunk_cache is not None else None
+        if seed == -1:
+            seed = random.randint(0, sys.maxsize)
+        seed_everything(seed)
+        self.seed = seed
+
+        ref_file, ref_text = preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
+
+        yield from infer_process_stream(
+            ref_file,
+            ref_text,
+            gen_text,
+            self.ema_model,
+            self.vocoder,
+            show_info=show_info,
+            lead_max_chars=lead_max_chars,
+            cross_fade_duration=cross_fade_duration,
+            vocoder_block_frames=vocoder_block_frames,
+            mel_spec_type=self.mel_spec_type,
+            progress=progress,
+            target_rms=target_rms,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            rolling_context=rolling_context,
+            seed=cache_seed,
+            chunk_cache=self.chunk_cache,
+            device=self.device,
+        )
+
 
 if __name__ == "__main__":
     f5tts = F5TTS()
@@ -0,0 +1,276 @@
+"""
+Process-wide ASR models and transcript cache.
+
+Every transcription in the package (reference texts for voice prompts, word timestamps for
+prosody editing) goes through one ASRRegistry: each model is loaded lazily, once per process,
+and shared by the plain and the word-timestamped paths. Transcripts are cached on disk by the
+content hash of the audio, so analyzing the same file again costs a file read.
+
+Models run on a pluggable backend (ASR_BACKENDS): whisper_timestamped, the transformers
+pipeline, or faster_whisper, whose int8 CTranslate2 models are the fast option on CPU.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from f5_tts.metrics import cache_event, stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASR_BACKEND = "whisper_timestamped"
+DEFAULT_ASR_MODEL = "openai/whisper-large-v2"
+
+
+def audio_content_hash(audio_path):
+    """sha256 of the audio file bytes."""
+    h = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Transcripts on disk, one JSON file per (audio content, model, language, mode).
+
+    Args:
+        cache_dir (str): Directory for the cache files; created if missing.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, audio_hash, model_name, language, mode):
+        key = hashlib.sha256(json.dumps([audio_hash, model_name, language, mode]).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, audio_hash, model_name, language, mode):
+        try:
+            with open(self._path(audio_hash, model_name, language, mode), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, audio_hash, model_name, language, mode, result):
+        path = self._path(audio_hash, model_name, language, mode)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# backends
+
+
+class ASRBackend:
+    """
+    One loaded ASR model. `transcribe` returns {"text": str, "words": [{"text", "start", "end"}]}.
+
+    Subclasses load their model in __init__; the registry serializes calls on a backend.
+    """
+
+    name = None
+
+    def __init__(self, model_name, device, **options):
+        self.model_name = model_name
+        self.device = device
+
+    def transcribe(self, audio_path, language=None):
+        raise NotImplementedError
+
+
+class WhisperTimestampedBackend(ASRBackend):
+    """openai-whisper through whisper_timestamped (any size: "large-v2", "small", "openai/whisper-large-v2"...)."""
+
+    name = "whisper_timestamped"
+
+    def __init__(self, model_name, device, **options):
+        import whisper_timestamped
+
+        super().__init__(model_name, device)
+        self.model = whisper_timestamped.load_model(model_name, device=device)
+
+    def transcribe(self, audio_path, language=None):
+        import whisper_timestamped
+
+        audio = whisper_timestamped.load_audio(audio_path)
+        result = whisper_timestamped.transcribe(self.model, audio, language=language)
+        return {
+            "text": result["text"].strip(),
+            "words": [
+                {"text": word["text"], "start": word["start"], "end": word["end"]}
+                for segment in result["segments"]
+                for word in segment["words"]
+            ],
+        }
+
+
+class HFPipelineBackend(ASRBackend):
+    """transformers automatic-speech-recognition pipeline (fp16 on CUDA)."""
+
+    name = "hf_pipeline"
+
+    def __init__(self, model_name, device, batch_size=16, **options):
+        import torch
+        from transformers import pipeline
+
+        super().__init__(model_name, device)
+        dtype = (
+            torch.float16 if device == "cuda" and torch.cuda.get_device_properties(device).major >= 6 else torch.float32
+        )
+        self.batch_size = batch_size
+        self.pipe = pipeline("automatic-speech-recognition", model=model_name, torch_dtype=dtype, device=device)
+
+    def transcribe(self, audio_path, language=None):
+        generate_kwargs = {"task": "transcribe"}
+        if language:
+            generate_kwargs["language"] = language
+        result = self.pipe(
+            audio_path,
+            chunk_length_s=30,
+            batch_size=self.batch_size,
+            generate_kwargs=generate_kwargs,
+            return_timestamps="word",
+        )
+        return {
+            "text": result["text"].strip(),
+            "words": [
+                {"text": chunk["text"].strip(), "start": chunk["timestamp"][0], "end": chunk["timestamp"][1]}
+                for chunk in result["chunks"]
+            ],
+        }
+
+
+class FasterWhisperBackend(ASRBackend):
+    """CTranslate2 Whisper (faster_whisper), int8-quantized by default: the fast path on CPU."""
+
+    name = "faster_whisper"
+
+    def __init__(self, model_name, device, compute_type="int8", num_threads=0, **options):
+        from faster_whisper import WhisperModel
+
+        super().__init__(model_name, device)
+        self.model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=num_threads)
+
+    def transcribe(self, audio_path, language=None):
+        segments, _ = self.model.transcribe(audio_path, language=language, word_timestamps=True, beam_size=5)
+        segments = list(segments)  # the generator runs the decoding
+        return {
+            "text": "".join(segment.text for segment in segments).strip(),
+            "words": [
+                {"text": word.word.strip(), "start": word.start, "end": word.end}
+                for segment in segments
+                for word in segment.words
+            ],
+        }
+
+
+ASR_BACKENDS = {
+    backend.name: backend for backend in (WhisperTimestampedBackend, HFPipelineBackend, FasterWhisperBackend)
+}
+
+
+# registry
+
+
+class ASRRegistry:
+    """
+    Lazily loaded ASR backends shared by all transcription paths of the process.
+
+    One backend serves both `transcribe` and `transcribe_words`; calls on the same backend
+    are serialized.
+
+    Args:
+        cache_dir (str | None): Directory of the transcript cache (no disk cache if None).
+        backend (str): Default backend, a key of ASR_BACKENDS.
+        model_name (str): Default model of that backend.
+        language (str | None): Default language ("es"...); detected per file when None.
+        device (str | None): Device backends are loaded on (CUDA when available if None).
+        **options: Backend options (compute_type, batch_size, num_threads).
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        backend=DEFAULT_ASR_BACKEND,
+        model_name=DEFAULT_ASR_MODEL,
+        language=None,
+        device=None,
+        **options,
+    ):
+        if backend not in ASR_BACKENDS:
+            raise ValueError(f"Unknown ASR backend: {backend} (available: {', '.join(ASR_BACKENDS)})")
+        self.cache = TranscriptCache(cache_dir) if cache_dir else None
+        self.backend = backend
+        self.model_name = model_name
+        self.language = language
+        self.device = device
+        self.options = options
+        self._backends = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_backend(self, backend=None, model_name=None):
+        """Returns (backend, lock), loading the backend on first use."""
+        key = (backend or self.backend, model_name or self.model_name)
+        with self._lock:
+            if key not in self._backends:
+                if self.device is None:
+                    import torch
+
+                    self.device = "cuda" if torch.cuda.is_available() else "cpu"
+                logger.info(f"Loading ASR backend {key[0]} ({key[1]}) on {self.device}")
+                self._backends[key] = ASR_BACKENDS[key[0]](key[1], self.device, **self.options)
+                self._locks[key] = threading.Lock()
+            return self._backends[key], self._locks[key]
+
+    def _transcribe(self, audio_path, language, backend, model_name, mode):
+        backend, model_name = backend or self.backend, model_name or self.model_name
+        language = language or self.language
+        # backend options (compute_type...) change the transcript too
+        model_id = f"{backend}:{model_name}:{json.dumps(self.options, sort_keys=True, default=str)}"
+        audio_hash = audio_content_hash(audio_path) if self.cache is not None else None
+        if self.cache is not None:
+            cached = self.cache.get(audio_hash, model_id, language, mode)
+            cache_event("transcript", cached is not None)
+            if cached is not None:
+                return cached
+        asr, lock = self.get_backend(backend, model_name)
+        with lock, stage("asr"):
+            results = asr.transcribe(audio_path, language=language)
+        if self.cache is not None:
+            # one decode gives both results: cache them together
+            for result_mode, result in results.items():
+                self.cache.put(audio_hash, model_id, language, result_mode, result)
+        return results[mode]
+
+    def transcribe(self, audio_path, language=None, backend=None, model_name=None):
+        """Returns the transcript of `audio_path`."""
+        return self._transcribe(audio_path, language, backend, model_name, "text")
+
+    def transcribe_words(self, audio_path, language=None, backend=None, model_name=None):
+        """Returns the words of `audio_path` as dicts with "text", "start" and "end" (seconds)."""
+        return self._transcribe(audio_path, language, backend, model_name, "words")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_asr_registry(cache_dir=None, **kwargs):
+    """
+    Returns the process-wide ASRRegistry, creating it on the first call.
+
+    Arguments only apply to that first call; configure the registry at startup.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ASRRegistry(cache_dir=cache_dir, **kwargs)
+        return _registry
@@ -0,0 +1,404 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from importlib.resources import files
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+from cached_path import cached_path
+
+from f5_tts.infer.asr import ASRRegistry
+from f5_tts.infer.utils_infer import (
+    StreamingVocoder,
+    assemble_chunks,
+    chunk_text_for_prompt,
+    device,
+    edit_regions,
+    infer_batch_process,
+    infer_process,
+    infer_process_stream,
+    infer_segments,
+    load_model,
+    load_vocoder,
+    load_voice_prompt,
+    mel_spec_type,
+    target_sample_rate,
+    vocode,
+)
+from f5_tts.model import DiT
+
+
+parser = argparse.ArgumentParser(
+    prog="python3 benchmark.py",
+    description="Latency benchmarks for the F5-TTS inference pipeline.",
+)
+parser.add_argument(
+    "-b",
+    "--bench",
+    nargs="+",
+    default=None,
+    help="Benchmarks to run (default: all).",
+)
+parser.add_argument("-p", "--ckpt_file", default="", help="The checkpoint .pt/.safetensors (default: F5TTS_Base)")
+parser.add_argument("-v", "--vocab_file", default="", help="The vocab .txt")
+parser.add_argument(
+    "-r",
+    "--ref_audio",
+    default=str(files("f5_tts").joinpath("infer/examples/basic/basic_ref_en.wav")),
+    help="Reference audio used as voice prompt.",
+)
+parser.add_argument(
+    "-s", "--ref_text", default="Some call me nature, others call me mother nature.", help="Reference transcript."
+)
+parser.add_argument(
+    "-t",
+    "--gen_text",
+    default="I don't really care what you call me. I've been a silent spectator, watching species evolve.",
+    help="Text to generate in each run.",
+)
+parser.add_argument("--nfe_step", type=int, default=32, help="ODE steps per generation.")
+parser.add_argument("--repeat", type=int, default=3, help="Timed runs per configuration.")
+parser.add_argument(
+    "--prompt_lengths",
+    type=float,
+    nargs="+",
+    default=[3.0, 5.0, 8.0, 10.0, 15.0],
+    help="Prompt lengths in seconds for the prompt_length benchmark.",
+)
+parser.add_argument(
+    "--long_text",
+    default=(
+        "Today we are going to talk about photosynthesis. Plants use the energy of sunlight to turn water "
+        "and carbon dioxide into sugar and oxygen. This process happens inside the chloroplasts, small "
+        "organelles that contain a green pigment called chlorophyll. Without it, most life on Earth would "
+        "not be possible, because almost every food chain starts with a plant."
+    ),
+    help="Multi-chunk text for the streaming benchmarks.",
+)
+parser.add_argument(
+    "--block_frames",
+    type=int,
+    nargs="+",
+    default=[16, 32, 64, 128],
+    help="Window sizes in mel frames for the vocoder_stream benchmark.",
+)
+parser.add_argument(
+    "--script_seconds",
+    type=float,
+    default=60.0,
+    help="Approximate length of the script for the edit_region benchmark (long_text repeated).",
+)
+parser.add_argument("--edit_word", default="lemonade", help="Replacement word for the edit_region benchmark.")
+parser.add_argument(
+    "--asr_backends",
+    nargs="+",
+    default=["hf_pipeline:openai/whisper-large-v2", "whisper_timestamped:small", "faster_whisper:small"],
+    help="backend:model pairs for the asr benchmark (faster_whisper runs int8).",
+)
+parser.add_argument(
+    "--asr_clips",
+    nargs="+",
+    default=None,
+    help="audio|transcript pairs for the asr benchmark (default: the reference audio and text).",
+)
+parser.add_argument("--asr_language", default=None, help="Language for the asr benchmark, e.g. es (default: detect).")
+
+
+class NoProgress:
+    @staticmethod
+    def tqdm(iterable):
+        return iterable
+
+
+def sync():
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def timed(fn, repeat):
+    """Runs `fn` once to warm up, then `repeat` times; returns (mean, std) seconds and the last result."""
+    result = fn()
+    times = []
+    for _ in range(repeat):
+        sync()
+        start = time.perf_counter()
+        result = fn()
+        sync()
+        times.append(time.perf_counter() - start)
+    return float(np.mean(times)), float(np.std(times)), result
+
+
+@contextmanager
+def reference_wav(audio):
+    """Writes the reference audio to a temporary WAV for the functions that take a file; removed afterwards."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "ref.wav")
+        sf.write(path, audio.squeeze(0).numpy(), target_sample_rate)
+        yield path
+
+
+def tile_prompt(audio, ref_text, seconds):
+    """Builds a prompt of `seconds` by cropping or repeating the reference, with text scaled to match."""
+    ref_seconds = audio.shape[-1] / target_sample_rate
+    reps = int(np.ceil(seconds / ref_seconds))
+    tiled = audio.repeat(1, reps)[:, : int(seconds * target_sample_rate)]
+    text = " ".join([ref_text.strip()] * reps)
+    text = text[: max(1, int(len(text) * seconds / (ref_seconds * reps)))]
+    return tiled, text
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance after lowercasing and dropping punctuation; returns (errors, reference words)."""
+    ref, hyp = (re.sub(r"[^\w\s']", " ", text.lower()).split() for text in (reference, hypothesis))
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ref_word != hyp_word))
+    return row[len(hyp)], len(ref)
+
+
+# benchmarks
+
+
+def bench_prompt_length(args, model, vocoder, audio, sr):
+    """Latency of a single-chunk generation as the voice prompt grows."""
+    print(f"\n[prompt_length] gen_text: {len(args.gen_text)} chars, nfe_step={args.nfe_step}")
+    print(f"{'prompt (s)':>10} {'latency (s)':>12} {'std':>8} {'audio (s)':>10} {'RTF':>8}")
+    for seconds in args.prompt_lengths:
+        prompt, prompt_text = tile_prompt(audio, args.ref_text, seconds)
+        mean, std, (wave, _, _) = timed(
+            lambda: infer_batch_process(
+                (prompt, target_sample_rate),
+                prompt_text,
+                [args.gen_text],
+                model,
+                vocoder,
+                progress=NoProgress,
+                nfe_step=args.nfe_step,
+                device=device,
+            ),
+            args.repeat,
+        )
+        audio_seconds = len(wave) / target_sample_rate
+        print(f"{seconds:>10.1f} {mean:>12.3f} {std:>8.3f} {audio_seconds:>10.2f} {mean / audio_seconds:>8.3f}")
+
+
+def bench_ttfb(args, model, vocoder, audio, sr):
+    """Time to first audio of infer_process_stream against the blocking infer_process."""
+    with reference_wav(audio) as ref_file:
+
+        def run_blocking():
+            return infer_process(
+                ref_file,
+                args.ref_text,
+                args.long_text,
+                model,
+                vocoder,
+                show_info=lambda _: None,
+                progress=NoProgress,
+                nfe_step=args.nfe_step,
+            )
+
+        def run_stream():
+            sync()
+            start = time.perf_counter()
+            first, samples = None, 0
+            for block in infer_process_stream(
+                ref_file,
+                args.ref_text,
+                args.long_text,
+                model,
+                vocoder,
+                show_info=lambda _: None,
+                progress=NoProgress,
+                nfe_step=args.nfe_step,
+            ):
+                if first is None:
+                    sync()
+                    first = time.perf_counter() - start
+                samples += len(block)
+            return first, time.perf_counter() - start, samples
+
+        print(f"\n[ttfb] long_text: {len(args.long_text)} chars, nfe_step={args.nfe_step}")
+        blocking, _, _ = timed(run_blocking, args.repeat)
+        run_stream()  # warm up
+        runs = [run_stream() for _ in range(args.repeat)]
+        ttfb = float(np.mean([r[0] for r in runs]))
+        total = float(np.mean([r[1] for r in runs]))
+        audio_seconds = runs[-1][2] / target_sample_rate
+        print(f"{'mode':>10} {'first audio (s)':>16} {'total (s)':>10} {'audio (s)':>10}")
+        print(f"{'blocking':>10} {blocking:>16.3f} {blocking:>10.3f} {audio_seconds:>10.2f}")
+        print(f"{'stream':>10} {ttfb:>16.3f} {total:>10.3f} {audio_seconds:>10.2f}")
+
+
+def bench_vocoder_stream(args, model, vocoder, audio, sr):
+    """Windowed vocoder decoding: first-block latency, total time and error against full decoding."""
+    with torch.inference_mode():
+        mel = model.mel_spec(audio.to(device)).to(torch.float32)
+    print(f"\n[vocoder_stream] mel: {mel.shape[-1]} frames ({audio.shape[-1] / target_sample_rate:.2f}s)")
+    full_mean, _, full = timed(lambda: vocode(vocoder, mel, mel_spec_type), args.repeat)
+    print(f"{'block':>6} {'first block (s)':>16} {'total (s)':>10} {'max abs err':>12}")
+    print(f"{'full':>6} {full_mean:>16.4f} {full_mean:>10.4f} {0.0:>12.2e}")
+    for block_frames in args.block_frames:
+        streaming_vocoder = StreamingVocoder(vocoder, mel_spec_type, block_frames=block_frames)
+
+        def run():
+            sync()
+            start = time.perf_counter()
+            blocks = streaming_vocoder.decode_stream(mel)
+            first = next(blocks)
+            sync()
+            first_time = time.perf_counter() - start
+            wave = torch.cat([first, *blocks], dim=-1)
+            sync()
+            return first_time, time.perf_counter() - start, wave
+
+        run()  # warm up
+        runs = [run() for _ in range(args.repeat)]
+        error = (runs[-1][2] - full).abs().max().item()
+        first = float(np.mean([r[0] for r in runs]))
+        total = float(np.mean([r[1] for r in runs]))
+        print(f"{block_frames:>6} {first:>16.4f} {total:>10.4f} {error:>12.2e}")
+
+
+def bench_pipeline(args, model, vocoder, audio, sr):
+    """Multi-chunk latency with sampling and vocoding run back to back vs. pipelined."""
+    with reference_wav(audio) as ref_file:
+        print(f"\n[pipeline] long_text: {len(args.long_text)} chars, nfe_step={args.nfe_step}")
+        print(f"{'pipeline':>10} {'latency (s)':>12} {'std':>8}")
+        for pipeline in (False, True):
+            mean, std, _ = timed(
+                lambda: infer_process(
+                    ref_file,
+                    args.ref_text,
+                    args.long_text,
+                    model,
+                    vocoder,
+                    show_info=lambda _: None,
+                    progress=NoProgress,
+                    nfe_step=args.nfe_step,
+                    pipeline=pipeline,
+                ),
+                args.repeat,
+            )
+            print(f"{str(pipeline):>10} {mean:>12.3f} {std:>8.3f}")
+
+
+def bench_edit_region(args, model, vocoder, audio, sr):
+    """One-word fix in a long script: editing the region in its chunk vs. regenerating the script."""
+    with reference_wav(audio) as ref_file:
+        prompt = load_voice_prompt(ref_file, args.ref_text, model, show_info=lambda _: None)
+    seconds_per_byte = prompt.duration / len(args.ref_text.encode("utf-8"))
+    reps = int(np.ceil(args.script_seconds / (len(args.long_text.encode("utf-8")) * seconds_per_byte)))
+    chunks = chunk_text_for_prompt(" ".join([args.long_text] * reps), prompt)
+
+    def run_full():
+        return infer_segments(
+            [(prompt, chunk) for chunk in chunks],
+            model,
+            vocoder,
+            show_info=lambda _: None,
+            nfe_step=args.nfe_step,
+            seed=0,
+        )
+
+    full_mean, full_std, waves = timed(run_full, args.repeat)
+    script, _ = assemble_chunks(waves, [0] * len(waves))
+
+    # replace the middle word of the middle chunk; its span is estimated from its byte offset
+    index = len(chunks) // 2
+    words = chunks[index].split()
+    w = len(words) // 2
+    target_text = " ".join(words[:w] + [args.edit_word] + words[w + 1 :])
+    chunk_bytes = len(chunks[index].encode("utf-8"))
+    word_start = len(" ".join(words[:w] + [""]).encode("utf-8"))
+    word_end = word_start + len(words[w].encode("utf-8"))
+    chunk_seconds = len(waves[index]) / target_sample_rate
+    span = (word_start / chunk_bytes * chunk_seconds, word_end / chunk_bytes * chunk_seconds)
+
+    edit_mean, edit_std, _ = timed(
+        lambda: edit_regions(
+            (waves[index], target_sample_rate),
+            chunks[index],
+            target_text,
+            [span],
+            model,
+            vocoder,
+            nfe_step=args.nfe_step,
+            seed=0,
+        ),
+        args.repeat,
+    )
+    print(
+        f"\n[edit_region] script: {len(script) / target_sample_rate:.1f}s in {len(chunks)} chunks, "
+        f"edit: '{words[w]}' -> '{args.edit_word}' in a {chunk_seconds:.1f}s chunk, nfe_step={args.nfe_step}"
+    )
+    print(f"{'mode':>12} {'latency (s)':>12} {'std':>8}")
+    print(f"{'regenerate':>12} {full_mean:>12.3f} {full_std:>8.3f}")
+    print(f"{'edit region':>12} {edit_mean:>12.3f} {edit_std:>8.3f}")
+
+
+def bench_asr(args, model, vocoder, audio, sr):
+    """Reference transcription per ASR backend: load time, latency per clip and WER."""
+    clips = [clip.split("|", 1) for clip in args.asr_clips] if args.asr_clips else [(args.ref_audio, args.ref_text)]
+    clip_seconds = sum(sf.info(path).duration for path, _ in clips)
+    print(f"\n[asr] {len(clips)} clips, {clip_seconds:.1f}s of audio, language={args.asr_language or 'detect'}")
+    print(f"{'backend':>40} {'load (s)':>9} {'latency (s)':>12} {'RTF':>7} {'WER':>7}")
+    for spec in args.asr_backends:
+        backend, model_name = spec.split(":", 1)
+        registry = ASRRegistry(backend=backend, model_name=model_name, language=args.asr_language)
+        sync()
+        start = time.perf_counter()
+        registry.get_backend()
+        load_seconds = time.perf_counter() - start
+
+        def run():
+            return [registry.transcribe(path) for path, _ in clips]
+
+        mean, _, transcripts = timed(run, args.repeat)
+        errors = [word_errors(text, transcript) for (_, text), transcript in zip(clips, transcripts)]
+        wer = sum(e for e, _ in errors) / max(sum(n for _, n in errors), 1)
+        print(f"{spec:>40} {load_seconds:>9.2f} {mean / len(clips):>12.3f} {mean / clip_seconds:>7.3f} {wer:>7.2%}")
+
+
+BENCHMARKS = {
+    "prompt_length": bench_prompt_length,
+    "ttfb": bench_ttfb,
+    "vocoder_stream": bench_vocoder_stream,
+    "pipeline": bench_pipeline,
+    "edit_region": bench_edit_region,
+    "asr": bench_asr,
+}
+
+
+def main():
+    args = parser.parse_args()
+    names = args.bench or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+
+    ckpt_file = args.ckpt_file or str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"))
+    model_cfg = dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)
+    vocoder = load_vocoder()
+    model = load_model(DiT, model_cfg, ckpt_file, vocab_file=args.vocab_file)
+
+    audio, sr = torchaudio.load(args.ref_audio)
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    if sr != target_sample_rate:
+        audio = torchaudio.transforms.Resample(sr, target_sample_rate)(audio)
+
+    print(f"device: {device}")
+    for name in names:
+        BENCHMARKS[name](args, model, vocoder, audio, target_sample_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,12 @@ import tomli
 from cached_path import cached_path
 
 from f5_tts.infer.utils_infer import (
-    infer_process,
+    infer_segments,
     load_model,
     load_vocoder,
-    preprocess_ref_audio_text,
+    load_voice_prompt,
     remove_silence_for_generated_wav,
+    target_sample_rate,
 )
 from f5_tts.model import DiT, UNetT
 
@@ -164,15 +165,14 @@ def main_process(ref_audio, ref_text, text_gen, model_obj, mel_spec_type, remove
     else:
         voices = config["voices"]
         voices["main"] = main_voice
+    prompts = {}
     for voice in voices:
-        voices[voice]["ref_audio"], voices[voice]["ref_text"] = preprocess_ref_audio_text(
-            voices[voice]["ref_audio"], voices[voice]["ref_text"]
-        )
+        prompts[voice] = load_voice_prompt(voices[voice]["ref_audio"], voices[voice]["ref_text"], model_obj)
         print("Voice:", voice)
         print("Ref_audio:", voices[voice]["ref_audio"])
-        print("Ref_text:", voices[voice]["ref_text"])
+        print("Ref_text:", prompts[voice].ref_text)
 
-    generated_audio_segments = []
+    segments = []
     reg1 = r"(?=\[\w+\])"
     chunks = re.split(reg1, text_gen)
     reg2 = r"\[(\w+)\]"
@@ -190,13 +190,12 @@ def main_process(ref_audio, ref_text, text_gen, model_obj, mel_spec_type, remove
             voice = "main"
         text = re.sub(reg2, "", text)
         gen_text = text.strip()
-        ref_audio = voices[voice]["ref_audio"]
-        ref_text = voices[voice]["ref_text"]
         print(f"Voice: {voice}")
-        audio, final_sample_rate, spectragram = infer_process(
-            ref_audio, ref_text, gen_text, model_obj, vocoder, mel_spec_type=mel_spec_type, speed=speed
-        )
-        generated_audio_segments.append(audio)
+        segments.append((prompts[voice], gen_text))
+
+    # chunks of all segments are sampled in batches, grouped by voice
+    generated_audio_segments = infer_segments(segments, model_obj, vocoder, mel_spec_type=mel_spec_type, speed=speed)
+    final_sample_rate = target_sample_rate
 
     if generated_audio_segments:
         final_wave = np.concatenate(generated_audio_segments)
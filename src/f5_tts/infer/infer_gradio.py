@@ -1,11 +1,12 @@
 import re 
+import hashlib
 import tempfile
 import os
 import json
 import time
-import glob
 import logging
-from flask import Flask, request, jsonify, send_file
+import struct
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from num2words import num2words
@@ -14,18 +15,44 @@ import numpy as np
 import soundfile as sf
 import torchaudio
 from pydub import AudioSegment
-import whisper_timestamped
 import datetime
+import shutil
+import difflib
 from f5_tts.infer.prosody import modify_prosody
+from f5_tts.infer.jobs import JobStore, JobQueue, DONE
+from f5_tts.infer.asr import get_asr_registry
+from f5_tts.infer.voices import VoiceStore, PROCESSING, READY
+from f5_tts.infer.storage import StorageManager, set_storage_manager, TEMP
+from f5_tts.metrics import registry as metrics_registry, start_trace, finish_trace, stage
+from f5_tts.profiling import Profiler, set_profiler
 
 from f5_tts.model import DiT, UNetT
 from f5_tts.infer.utils_infer import (
     load_vocoder,
     load_model,
+    VocoderBatcher,
+    ChunkCache,
     preprocess_ref_audio_text,
+    compact_ref_audio_text,
     infer_process,
+    infer_process_stream,
+    infer_segments,
+    assemble_chunks,
+    chunk_text_for_prompt,
+    edit_region_targets,
+    edit_regions_batch,
+    script_word_timings,
+    canonicalize_ref_audio,
+    VoicePrompt,
+    VoicePromptCache,
+    transcribe_ref_audio,
+    write_canonical_metadata,
+    read_canonical_metadata,
+    load_voice_prompt,
     remove_silence_for_generated_wav,
+    mel_spectrogram,
     save_spectrogram,
+    target_sample_rate,
 )
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
@@ -42,25 +69,141 @@ except ImportError:
     USING_SPACES = False
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Audio-Path', 'X-Request-ID', 'ETag', 'Content-Range', 'Accept-Ranges'])
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def profile_requested():
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    return flag is not None and flag.lower() not in ('', '0', 'false')
+
+# Instrumentación: cada petición lleva un ID (el X-Request-ID del cliente, si lo trae) y una traza
+# de sus etapas que se escribe en el log como una línea JSON al responder
+
+@app.before_request
+def start_request_trace():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+    g.trace = start_trace(g.request_id, route=request.endpoint, method=request.method)
+    # Solo las peticiones elegidas pagan el perfilado; las que no generan audio no gastan las armadas
+    if (
+        request.method != 'OPTIONS'
+        and request.endpoint in PROFILED_ENDPOINTS
+        and (profile_requested() or profiler.take_armed())
+    ):
+        g.profile = profiler.activate(g.request_id)
+        logger.info(f"Perfilando la petición {g.request_id} ({request.endpoint})")
+
+@app.after_request
+def finish_request_trace(response):
+    if 'trace' not in g:
+        return response
+    # En las respuestas en streaming esto mide hasta la cabecera; las etapas del cuerpo no entran
+    elapsed = time.perf_counter() - g.request_start
+    route = request.endpoint or 'unknown'
+    metrics_registry.observe('f5tts_http_request_seconds', elapsed, route=route)
+    metrics_registry.inc('f5tts_http_requests_total', route=route, status=response.status_code)
+    response.headers['X-Request-ID'] = g.request_id
+    if 'profile' in g:
+        profiler.deactivate(g.pop('profile'))
+    if route == 'metrics':
+        finish_trace(g.trace, log=False)
+    else:
+        finish_trace(g.trace, status=response.status_code)
+    g.pop('trace')
+    return response
+
 UPLOAD_FOLDER = 'temp_uploads'
 GENERATED_AUDIO_FOLDER = 'generated_audios'
-SPEECH_TYPES_FILE = 'speech_types.json'
+SPEECH_TYPES_FILE = 'speech_types.json'  # formato antiguo, se importa al registro de voces
+VOICES_DB = 'voices.db'
+VOICES_FOLDER = 'voices'
+JOBS_DB = 'jobs.db'
+JOBS_FOLDER = os.path.join(GENERATED_AUDIO_FOLDER, 'jobs')
+CHUNK_CACHE_FOLDER = 'chunk_cache'
+CHUNK_CACHE_MAX_BYTES = 2 * 1024**3
+ASR_CACHE_FOLDER = 'asr_cache'
+
+# Almacenamiento acotado: audios generados, sus versiones de guion y temporales (WAV de referencia,
+# espectrogramas) comparten una cuota; al pasarla se borran los menos usados recientemente
+STORAGE_DB = 'storage.db'
+STORAGE_MAX_BYTES = 5 * 1024**3
+TEMP_FOLDER = 'temp_artifacts'
+TEMP_MAX_AGE = 3600  # los temporales sin uso en este tiempo se borran aunque sobre cuota
+
+# Perfilado bajo demanda (cabecera X-Profile, parámetro ?profile=1 o /api/admin/profile para las
+# próximas N peticiones): trazas de torch.profiler y pilas de Python por ID de petición
+PROFILE_FOLDER = 'profiles'
+PROFILE_MAX_BYTES = 512 * 1024**2
+# Rutas que ejecutan funciones perfiladas (síntesis, edición, prosodia y trabajos que las encolan)
+PROFILED_ENDPOINTS = (
+    'generate_multistyle_speech',
+    'generate_multistyle_speech_stream',
+    'modify_prosody_route',
+    'edit_regions_route',
+    'submit_job',
+)
+
+# Formatos de salida: el WAV PCM 16 bits es el original; los demás se codifican una sola vez, al
+# pedirlos, y se guardan junto a él (extensión, tipo MIME, formato y subtipo de soundfile)
+AUDIO_FORMATS = {
+    'wav': ('.wav', 'audio/wav', 'WAV', 'PCM_16'),
+    'flac': ('.flac', 'audio/flac', 'FLAC', 'PCM_16'),
+    'opus': ('.opus', 'audio/ogg', 'OGG', 'OPUS'),
+    'mp3': ('.mp3', 'audio/mpeg', None, None),  # con ffmpeg (pydub): libsndfile no siempre trae MP3
+}
+MP3_BITRATE = '128k'
+# Los audios generados no cambian (nombre único): el navegador puede reutilizarlos
+AUDIO_MAX_AGE = 3600
+
+# Reconocimiento de voz (transcripción de referencias y marcas de tiempo). Todo el contenido es
+# en español; faster_whisper con un modelo int8 es la opción rápida en CPU. Otras opciones:
+# 'whisper_timestamped' u 'hf_pipeline' con 'openai/whisper-large-v2'
+ASR_BACKEND = 'faster_whisper'
+ASR_MODEL = 'small'
+ASR_LANGUAGE = 'es'
+ASR_COMPUTE_TYPE = 'int8'
+
+# Los trabajos multi-estilo guardan su avance cada tantos segmentos (lo que se rehace al retomar)
+JOB_SEGMENTS_PER_STEP = 8
+
+# Compactación del audio de referencia al registrar una voz (segundos)
+PROMPT_TARGET_DURATION = 6.5
+PROMPT_MIN_DURATION = 5.0
+PROMPT_MAX_DURATION = 8.0
 
 # Crear las carpetas si no existen
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_AUDIO_FOLDER, exist_ok=True)
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+
+# Índice de archivos generados y temporales; los archivos de antes del índice entran en la cuota
+storage = StorageManager(STORAGE_DB, STORAGE_MAX_BYTES, TEMP_FOLDER)
+set_storage_manager(storage)
+storage.adopt_folder(GENERATED_AUDIO_FOLDER)
+storage.adopt_folder(UPLOAD_FOLDER, kind=TEMP)
+
+# Perfilador de las peticiones elegidas (ver profile_requested)
+profiler = Profiler(PROFILE_FOLDER, PROFILE_MAX_BYTES)
+set_profiler(profiler)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['GENERATED_AUDIO_FOLDER'] = GENERATED_AUDIO_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = None
 
+# Un solo modelo ASR por proceso (se carga al primer uso) y transcripciones cacheadas en disco
+asr_registry = get_asr_registry(
+    cache_dir=ASR_CACHE_FOLDER,
+    backend=ASR_BACKEND,
+    model_name=ASR_MODEL,
+    language=ASR_LANGUAGE,
+    compute_type=ASR_COMPUTE_TYPE
+)
+
 try:
-    vocoder = load_vocoder()
+    # Las peticiones concurrentes comparten llamadas al vocoder en lotes
+    vocoder = VocoderBatcher(load_vocoder())
     F5TTS_model_cfg = dict(
         dim=1024,
         depth=22,
@@ -76,52 +219,53 @@ try:
         model_path
     )
     logger.info("Modelos cargados exitosamente.")
+    chunk_cache = ChunkCache(CHUNK_CACHE_FOLDER, max_bytes=CHUNK_CACHE_MAX_BYTES)
 except Exception as e:
     logger.exception(f"Error al cargar los modelos: {str(e)}")
     raise
 
-speech_types_dict = {}
+# Registro de voces compartido por todos los workers (SQLite); sus audios no son temporales
+voice_store = VoiceStore(VOICES_DB, VOICES_FOLDER)
+voice_store.import_speech_types(SPEECH_TYPES_FILE)
+# Prompts ya preparados en este proceso; en disco quedan para los demás
+voice_prompts = VoicePromptCache(max_size=32)
 
-def save_speech_types():
-    try:
-        with open(SPEECH_TYPES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(speech_types_dict, f, ensure_ascii=False, indent=4)
-        logger.info(f"Archivo JSON guardado exitosamente: {SPEECH_TYPES_FILE}")
-    except Exception as e:
-        logger.error(f"Error al guardar archivo JSON: {str(e)}")
-        raise
+def transcribe_words(audio_path, language='es'):
+    """Transcribe un audio y devuelve las palabras con sus tiempos de inicio y fin (segundos)."""
+    return asr_registry.transcribe_words(audio_path, language=language)
 
 def transcribe_audio_with_timestamps(audio_path, language='es'):
     try:
-        audio = whisper_timestamped.load_audio(audio_path)
-        # Usamos el modelo openai/whisper-large-v2
-        model = whisper_timestamped.load_model("openai/whisper-large-v2", device="cpu")
-        result = whisper_timestamped.transcribe(model, audio, language=language)
+        words = transcribe_words(audio_path, language=language)
 
         formatted_transcript = ""
-        for segment in result['segments']:
-            for word in segment['words']:
-                formatted_time = f"({word['start']:.2f})"
-                formatted_transcript += f"{formatted_time} {word['text']} "
+        for word in words:
+            formatted_time = f"({word['start']:.2f})"
+            formatted_transcript += f"{formatted_time} {word['text']} "
         
         return formatted_transcript.strip()
     except Exception as e:
         logger.exception(f"Error en la transcripción: {str(e)}")
         return None
 
-def load_speech_types():
-    global speech_types_dict
-    try:
-        if os.path.exists(SPEECH_TYPES_FILE):
-            with open(SPEECH_TYPES_FILE, 'r', encoding='utf-8') as f:
-                speech_types_dict = json.load(f)
-            logger.info(f"Tipos de habla cargados: {speech_types_dict}")
-        else:
-            speech_types_dict = {}
-            logger.info("No existe archivo de tipos de habla, se iniciará uno nuevo")
-    except Exception as e:
-        logger.error(f"Error al cargar tipos de habla: {str(e)}")
-        speech_types_dict = {}
+def format_timestamps(words):
+    """Mismo formato que transcribe_audio_with_timestamps: '(inicio) palabra' por palabra."""
+    return " ".join(f"({word['start_time']:.2f}) {word['word']}" for word in words)
+
+def audio_timestamps(audio_path, language='es'):
+    """
+    Marcas de tiempo por palabra de un audio. Si lo generamos nosotros (tiene versión de guion),
+    se alinean sus textos conocidos con cada chunk en milisegundos; si no, se transcribe con Whisper.
+    Devuelve (transcripción formateada, lista de palabras o None, origen).
+    """
+    version = load_script_version(audio_path)
+    if version is not None:
+        chunks, waves = version
+        words = script_word_timings(
+            (wave, chunk['text'], chunk['start']) for chunk, wave in zip(chunks, waves)
+        )
+        return format_timestamps(words), words, 'synthesis'
+    return transcribe_audio_with_timestamps(audio_path, language=language), None, 'asr'
 
 def gpu_decorator(func):
     if USING_SPACES:
@@ -162,41 +306,50 @@ def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'wav', 'mp3','webm','ogg', 'm4a', 'WAV', 'MP3', 'OGG', 'M4A', 'WEBM'}
     return '.' in filename and filename.rsplit('.', 1)[1].upper() in ALLOWED_EXTENSIONS
 
+def normalize_gen_text(gen_text):
+    if not gen_text.endswith(". "):
+        gen_text += ". "
+
+    gen_text = gen_text.lower()
+    return traducir_numero_a_texto(gen_text)
+
+def remove_silence_from_wave(wave, sample_rate=target_sample_rate):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        sf.write(f.name, wave, sample_rate)
+    try:
+        remove_silence_for_generated_wav(f.name)
+        wave, _ = torchaudio.load(f.name)
+    finally:
+        os.remove(f.name)
+    return wave.squeeze().cpu().numpy()
+
 @gpu_decorator
 def infer(
-    ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15, speed=1
+    ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15, speed=1, long_form=False,
+    seed=None
 ):
     try:
         ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text)
+        gen_text = normalize_gen_text(gen_text)
 
-        if not gen_text.endswith(". "):
-            gen_text += ". "
-
-        gen_text = gen_text.lower()
-        gen_text = traducir_numero_a_texto(gen_text)
-
-        final_wave, final_sample_rate, combined_spectrogram = infer_process(
+        final_wave, final_sample_rate, _ = infer_process(
             ref_audio,
             ref_text,
             gen_text,
             model,
             vocoder,
             cross_fade_duration=cross_fade_duration,
-            speed=speed
+            speed=speed,
+            rolling_context=long_form,
+            seed=seed,
+            chunk_cache=chunk_cache,
+            return_spectrogram=False  # el espectrograma se dibuja solo si se pide (get_spectrogram)
         )
 
         if remove_silence:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-                sf.write(f.name, final_wave, final_sample_rate)
-                remove_silence_for_generated_wav(f.name)
-                final_wave, _ = torchaudio.load(f.name)
-            final_wave = final_wave.squeeze().cpu().numpy()
-
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
-            spectrogram_path = tmp_spectrogram.name
-            save_spectrogram(combined_spectrogram, spectrogram_path)
+            final_wave = remove_silence_from_wave(final_wave, final_sample_rate)
 
-        return (final_sample_rate, final_wave), spectrogram_path
+        return final_sample_rate, final_wave
     except Exception as e:
         logger.exception(f"Error en infer: {str(e)}")
         raise
@@ -209,13 +362,15 @@ def analyze_audio():
         if not audio_path or not os.path.exists(audio_path):
             return jsonify({'success': False, 'error': 'audio_path no válido'}), 400
         
-        transcription = transcribe_audio_with_timestamps(audio_path, language='es')
+        transcription, words, source = audio_timestamps(audio_path, language='es')
         if transcription is None:
             return jsonify({'success': False, 'error': 'Error en transcripción'}), 500
         
         return jsonify({
             'success': True,
-            'transcription': transcription
+            'transcription': transcription,
+            'words': words,
+            'source': source
         }), 200
     except Exception as e:
         return jsonify({
@@ -237,7 +392,155 @@ def parse_speechtypes_text(gen_text):
             current_style = tokens[i].strip()
     return segments
 
+def check_segments(segments):
+    """Devuelve (mensaje, código) si falta el estilo Regular o algún audio de referencia, o None."""
+    if voice_store.get_voice("Regular") is None:
+        return 'No existe tipo de habla Regular configurado.', 400
+
+    for segment in segments:
+        style = segment["style"]
+        voice = voice_store.get_voice(style)
+        if voice is None:
+            logger.error(f'Tipo de habla no encontrado: {style}')
+            return f'Tipo de habla no encontrado: {style}', 400
+        ref_audio = voice['audio']
+        if not os.path.exists(ref_audio):
+            logger.error(f'Archivo de audio no encontrado para {style}: {ref_audio}')
+            return f'Archivo de audio no encontrado para {style}: {ref_audio}', 404
+    return None
+
+def segment_ref_text(style, ref_text_overrides):
+    """Devuelve (audio, texto) de referencia de un estilo, sin procesar."""
+    speech_type_data = voice_store.get_voice(style)
+    ref_audio = speech_type_data['audio']
+    ref_text_original = speech_type_data.get('ref_text', '')
+    # Para estilos que NO sean "Regular", forzamos la transcripción ignorando el texto almacenado.
+    if style != "Regular":
+        ref_text = ""
+    else:
+        ref_text = ref_text_original
+
+    # Si se envía un override en el request, se prioriza.
+    if style in ref_text_overrides and ref_text_overrides[style].strip():
+        ref_text = ref_text_overrides[style].strip()
+    return ref_audio, ref_text
+
+def segment_reference(style, ref_text_overrides):
+    """Procesa el audio de referencia de un estilo y devuelve (audio, texto) listos para infer."""
+    ref_audio, ref_text = segment_ref_text(style, ref_text_overrides)
+    # Procesar el audio de referencia y obtener el texto final (se transcribe si ref_text está vacío)
+    return preprocess_ref_audio_text(
+        ref_audio_orig=ref_audio,
+        ref_text=ref_text,
+        show_info=lambda msg: logger.info(f"[{style}] {msg}")
+    )
+
+def segment_voice_prompts(segments, ref_text_overrides):
+    """Prepara una sola vez el prompt de cada estilo usado en los segmentos."""
+    prompts = {}
+    for segment in segments:
+        style = segment["style"]
+        if style not in prompts:
+            ref_audio, ref_text = segment_ref_text(style, ref_text_overrides)
+            prompts[style] = cached_voice_prompt(style, ref_audio, ref_text)
+    return prompts
+
+def cached_voice_prompt(style, ref_audio, ref_text):
+    """
+    Prompt listo para muestrear: de la caché del proceso, de los tensores guardados en el
+    registro de voces o, si no, preparado ahora y guardado para los demás workers.
+    """
+    key = hashlib.sha256(
+        json.dumps([ref_audio, ref_text, getattr(F5TTS_ema_model, 'checkpoint_id', None)]).encode('utf-8')
+    ).hexdigest()
+
+    def load():
+        path = voice_store.get_prompt(key)
+        if path is not None:
+            return VoicePrompt.load(path)
+        prompt = load_voice_prompt(
+            ref_audio, ref_text, F5TTS_ema_model, show_info=lambda msg: logger.info(f"[{style}] {msg}")
+        )
+        path = voice_store.prompt_path(key)
+        prompt.save(path)
+        voice_store.put_prompt(key, path)
+        return prompt
+
+    return voice_prompts.get(key, load)
+
+def wav_stream_header(sample_rate, channels=1, bits_per_sample=16):
+    """Cabecera WAV PCM con tamaño desconocido (0xFFFFFFFF), para enviar el audio mientras se genera."""
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', 0xFFFFFFFF)
+    )
+
+def output_format(name):
+    """Valida un formato de salida pedido ('wav' por defecto); ValueError si no existe."""
+    name = (name or 'wav').lower()
+    if name not in AUDIO_FORMATS:
+        raise ValueError(f"Formato no soportado: {name} (disponibles: {', '.join(AUDIO_FORMATS)})")
+    return name
+
+def encode_audio(wav_path, fmt):
+    """
+    Devuelve la ruta del audio generado `wav_path` en el formato `fmt`. La codificación se hace
+    una vez y queda junto al WAV; se borra con él al pasar la cuota o al eliminarlo.
+    """
+    extension, _, sf_format, subtype = AUDIO_FORMATS[fmt]
+    if fmt == 'wav':
+        return wav_path
+    encoded_path = os.path.splitext(wav_path)[0] + extension
+    if os.path.exists(encoded_path):
+        return encoded_path
+
+    # Archivo parcial y renombrado: otra petición nunca ve una codificación a medias
+    partial_path = f"{encoded_path}.{uuid.uuid4().hex}.part"
+    try:
+        with stage('encode'):
+            if sf_format is None:
+                AudioSegment.from_wav(wav_path).export(partial_path, format=fmt, bitrate=MP3_BITRATE)
+            else:
+                audio, sr = sf.read(wav_path, dtype='float32')
+                sf.write(partial_path, audio, sr, format=sf_format, subtype=subtype)
+        os.replace(partial_path, encoded_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    storage.register(encoded_path, owner=wav_path)
+    logger.info(f"Audio codificado en {fmt}: {encoded_path}")
+    return encoded_path
 
+def audio_url(audio_path, fmt='wav'):
+    url = f"/api/get_audio/{os.path.basename(audio_path)}"
+    return url if fmt == 'wav' else f"{url}?format={fmt}"
+
+
+
+def compact_voice_prompt(filepath, ref_text):
+    """
+    Recorta una referencia larga al mejor tramo continuo de ~5-8 s.
+    Devuelve la ruta y el texto a usar como prompt de la voz.
+    """
+    duration = len(AudioSegment.from_file(filepath)) / 1000
+    if duration <= PROMPT_MAX_DURATION:
+        return filepath, ref_text
+
+    words = transcribe_words(filepath, language='es')
+    prompt_path, prompt_text = compact_ref_audio_text(
+        filepath,
+        words,
+        target_duration=PROMPT_TARGET_DURATION,
+        min_duration=PROMPT_MIN_DURATION,
+        max_duration=PROMPT_MAX_DURATION,
+    )
+    if prompt_path is None:
+        logger.info(f"Sin tramo adecuado para compactar {filepath} ({duration:.2f}s), se usa completo")
+        return filepath, ref_text
+    return prompt_path, prompt_text
 
 @app.route('/api/upload_audio', methods=['POST'])
 def upload_audio():
@@ -274,35 +577,72 @@ def upload_audio():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
         try:
-            file.save(filepath)
+            # Copiar la subida al disco por bloques, sin cargarla entera en memoria
+            part_path = filepath + '.part'
+            with open(part_path, 'wb') as out:
+                shutil.copyfileobj(file.stream, out, length=1 << 20)
+            os.replace(part_path, filepath)
             logger.info(f"Archivo guardado en: {filepath}")
         except Exception as e:
             logger.error(f"Error al guardar el archivo: {str(e)}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
             return jsonify({'error': f'Error al guardar el archivo: {str(e)}'}), 500
         
         if not os.path.exists(filepath):
             logger.error("El archivo no se guardó correctamente")
             return jsonify({'error': 'Error al guardar el archivo'}), 500
-        
-        try:
-            speech_types_dict[speech_type] = {
-                'audio': filepath,
-                'ref_text': ref_text
-            }
-            logger.info(f"Diccionario actualizado: {speech_types_dict}")
-            
-            with open(SPEECH_TYPES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(speech_types_dict, f, ensure_ascii=False, indent=4)
-            logger.info("Tipos de habla guardados en JSON")
-            
-        except Exception as e:
-            logger.error(f"Error al actualizar tipos de habla: {str(e)}")
-            return jsonify({'error': f'Error al actualizar tipos de habla: {str(e)}'}), 500
+
+        # Guardar la grabación en el registro de voces: una sola copia por contenido
+        audio = voice_store.add_audio(filepath)
+        audio_hash, filepath = audio['hash'], audio['source']
+        compact_prompt = request.form.get('compactPrompt', 'true').lower() != 'false'
+
+        # Decodificar una sola vez a la forma canónica (mono, 24 kHz, float32): las síntesis
+        # posteriores la leen directamente, sin ffmpeg
+        canonical_path = audio['canonical']
+        if canonical_path is None or not os.path.exists(canonical_path):
+            try:
+                canonical_path = canonicalize_ref_audio(
+                    filepath, voice_store.audio_path(audio_hash, '.npy'), ref_text=ref_text, show_info=logger.info
+                )
+            except Exception as e:
+                logger.exception(f"Error al decodificar el audio: {str(e)}")
+                return jsonify({'error': f'No se pudo decodificar el audio: {str(e)}'}), 400
+            voice_store.update_audio(
+                audio_hash, canonical=canonical_path, duration=read_canonical_metadata(canonical_path).get('duration')
+            )
+
+        job_id = None
+        if compact_prompt and audio['prompt'] and os.path.exists(audio['prompt']):
+            # La misma grabación ya pasó por la ingesta: la voz queda lista de inmediato
+            prompt_path = audio['prompt']
+            prompt_text = ref_text if ref_text.strip() and prompt_path == canonical_path else audio['prompt_text']
+            voice_store.set_voice(speech_type, audio_hash, prompt_path, prompt_text, READY)
+            status = READY
+        else:
+            prompt_path, prompt_text = canonical_path, ref_text
+            voice_store.set_voice(speech_type, audio_hash, prompt_path, prompt_text, PROCESSING)
+            # La compactación y la transcripción (si falta el texto) siguen en segundo plano
+            job_id = job_queue.submit('ingest_voice', {
+                'speech_type': speech_type,
+                'audio_hash': audio_hash,
+                'source_audio': filepath,
+                'canonical_audio': canonical_path,
+                'ref_text': ref_text,
+                'compact_prompt': compact_prompt
+            })
+            status = PROCESSING
+        logger.info(f"Tipo de habla {speech_type} registrado ({status}): {prompt_path}")
         
         return jsonify({
             'success': True,
             'filepath': filepath,
+            'promptPath': prompt_path,
+            'promptText': prompt_text,
             'speechType': speech_type,
+            'job_id': job_id,
+            'status': status,
             'message': f'Tipo de habla {speech_type} guardado correctamente'
         })
         
@@ -310,6 +650,131 @@ def upload_audio():
         logger.exception(f"Error general en upload_audio: {str(e)}")
         return jsonify({'error': f'Error al procesar la solicitud: {str(e)}'}), 500
 
+# Versiones de guion: cada audio generado guarda sus chunks (estilo, texto, semilla, tramo) y su
+# audio sin unir, para regenerar solo lo que cambió en una edición
+
+def script_version_paths(audio_path):
+    base = os.path.splitext(audio_path)[0]
+    return base + '.script.json', base + '.chunks.npz'
+
+def chunk_version_key(chunk):
+    return (chunk['style'], chunk['voice'], chunk['text'], chunk['seed'], chunk['speed'])
+
+def save_script_version(audio_path, script):
+    json_path, chunks_path = script_version_paths(audio_path)
+    with stage('file_io'):
+        np.savez(chunks_path, *script['waves'])
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'audio_path': audio_path,
+                'sample_rate': target_sample_rate,
+                'chunks': [
+                    {**chunk, 'start': start, 'end': end}
+                    for chunk, (start, end) in zip(script['chunks'], script['spans'])
+                ]
+            }, f, ensure_ascii=False, indent=2)
+    # La versión se borra junto con su audio
+    for path in (json_path, chunks_path):
+        storage.register(path, owner=audio_path)
+
+def load_script_version(audio_path):
+    """Devuelve (chunks, audios de cada chunk) de un audio generado, o None si no tiene versión."""
+    secure_path = secure_filename(os.path.basename(audio_path))
+    return read_script_version(os.path.join(app.config['GENERATED_AUDIO_FOLDER'], secure_path))
+
+def read_script_version(full_path):
+    json_path, chunks_path = script_version_paths(full_path)
+    if not (os.path.exists(json_path) and os.path.exists(chunks_path)):
+        logger.info(f"Sin versión de guion para {full_path}, se genera completo")
+        return None
+    storage.touch(full_path)
+    with stage('file_io'):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)['chunks']
+        with np.load(chunks_path) as stored:
+            waves = [stored[f'arr_{i}'] for i in range(len(chunks))]
+    return chunks, waves
+
+def synthesize_script(segments, prompts, seed, speed, cross_fade_duration, previous=None):
+    """
+    Genera un guion multi-estilo chunk a chunk. Con una versión previa, los chunks iguales
+    (mismo estilo, voz, texto, semilla y velocidad) se reutilizan según un diff de secuencias
+    y solo se sintetizan los cambiados; luego se une todo con crossfades.
+    """
+    chunks = []
+    for segment_id, segment in enumerate(segments):
+        prompt = prompts[segment["style"]]
+        for text in chunk_text_for_prompt(normalize_gen_text(segment["text"]), prompt):
+            chunks.append({
+                'style': segment["style"],
+                'voice': prompt.hash,
+                'text': text,
+                'seed': seed,
+                'speed': speed,
+                'segment': segment_id,
+            })
+
+    waves = [None] * len(chunks)
+    if previous is not None:
+        previous_chunks, previous_waves = previous
+        matcher = difflib.SequenceMatcher(
+            a=[chunk_version_key(chunk) for chunk in previous_chunks],
+            b=[chunk_version_key(chunk) for chunk in chunks],
+            autojunk=False
+        )
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                waves[j1:j2] = previous_waves[i1:i2]
+
+    missing = [i for i, wave in enumerate(waves) if wave is None]
+    reused = len(chunks) - len(missing)
+    logger.info(f"Guion: {len(chunks)} chunks, {reused} reutilizados, {len(missing)} a generar")
+    if missing:
+        generated = infer_segments(
+            [(prompts[chunks[i]['style']], chunks[i]['text']) for i in missing],
+            F5TTS_ema_model,
+            vocoder,
+            show_info=logger.info,
+            cross_fade_duration=cross_fade_duration,
+            speed=speed,
+            seed=seed,
+            chunk_cache=chunk_cache
+        )
+        for i, wave in zip(missing, generated):
+            waves[i] = wave
+
+    audio, spans = assemble_chunks(waves, [chunk['segment'] for chunk in chunks], cross_fade_duration)
+    return {'audio': audio, 'chunks': chunks, 'waves': waves, 'spans': spans, 'reused': reused}
+
+def save_multistyle_audio(audio, script, fmt):
+    """
+    Guarda el audio final de un guion (y su versión, si la hay) y devuelve los campos de la
+    respuesta: ruta, formato, URL y, con versión, chunks reutilizados y tiempos por palabra.
+    """
+    generated_audio_filename = f"multi_style_{uuid.uuid4().hex}.wav"
+    generated_audio_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], generated_audio_filename)
+    with stage('file_io'):
+        sf.write(generated_audio_path, audio, target_sample_rate, subtype='PCM_16')
+    storage.register(generated_audio_path)
+    logger.info(f"Audio final multi-estilo guardado en: {generated_audio_path}")
+    # audio_path sigue siendo el WAV: es el que aceptan la edición y la prosodia
+    encode_audio(generated_audio_path, fmt)
+    result = {
+        'audio_path': generated_audio_path,
+        'audio_format': fmt,
+        'audio_url': audio_url(generated_audio_path, fmt)
+    }
+    if script is not None:
+        save_script_version(generated_audio_path, script)
+        result['reused_chunks'] = script['reused']
+        result['generated_chunks'] = len(script['chunks']) - script['reused']
+        # Mapa de tiempos por palabra: sale del guion, sin pasar por Whisper
+        result['timestamps'] = script_word_timings(
+            (wave, chunk['text'], start)
+            for chunk, wave, (start, _) in zip(script['chunks'], script['waves'], script['spans'])
+        )
+    return result
+
 @app.route('/api/generate_multistyle_speech', methods=['POST'])
 def generate_multistyle_speech():
     try:
@@ -320,6 +785,15 @@ def generate_multistyle_speech():
         speed = data.get('speed_change', 1.0)
         ref_text_overrides = data.get('ref_text_overrides', {})
         just_audio = data.get('just_audio', False)
+        # Modo largo: cada chunk se condiciona con el final del anterior en vez de la referencia completa
+        long_form = data.get('long_form', False)
+        # Sin semilla cada generación es una toma nueva; con semilla es reproducible y los chunks
+        # ya generados salen de la caché
+        seed = data.get('seed')
+        try:
+            fmt = output_format(data.get('output_format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         if not gen_text:
             logger.error('gen_text es requerido')
@@ -328,81 +802,144 @@ def generate_multistyle_speech():
         segments = parse_speechtypes_text(gen_text)
         logger.info(f"Segmentos obtenidos: {segments}")
 
-        if "Regular" not in speech_types_dict:
-            return jsonify({'error': 'No existe tipo de habla Regular configurado.'}), 400
-
-        # Verificar que para cada estilo exista un audio de referencia
-        for segment in segments:
-            style = segment["style"]
-            if style not in speech_types_dict:
-                logger.error(f'Tipo de habla no encontrado: {style}')
-                return jsonify({'error': f'Tipo de habla no encontrado: {style}'}), 400
-            ref_audio = speech_types_dict[style]['audio']
-            if not os.path.exists(ref_audio):
-                logger.error(f'Archivo de audio no encontrado para {style}: {ref_audio}')
-                return jsonify({'error': f'Archivo de audio no encontrado para {style}: {ref_audio}'}), 404
+        error = check_segments(segments)
+        if error is not None:
+            return jsonify({'error': error[0]}), error[1]
 
         generated_audio_segments = []
-        sample_rate = None
+        script = None
+
+        if long_form:
+            # El modo largo encadena cada chunk con el anterior: se genera segmento a segmento
+            for segment in segments:
+                style = segment["style"]
+                processed_audio, processed_text = segment_reference(style, ref_text_overrides)
+
+                # Generar el segmento de audio
+                audio_output = infer(
+                    ref_audio_orig=processed_audio,
+                    ref_text=processed_text,
+                    gen_text=segment["text"],
+                    model=F5TTS_ema_model,
+                    remove_silence=remove_silence,
+                    cross_fade_duration=cross_fade_duration,
+                    speed=speed,
+                    long_form=long_form,
+                    seed=seed
+                )
+                generated_audio_segments.append(audio_output[1])
+                logger.info(f"Segmento generado para {style} guardado.")
+        else:
+            # Cada estilo se prepara una vez y solo se generan los chunks que cambiaron respecto
+            # a la versión anterior (previous_audio_path), en lotes
+            prompts = segment_voice_prompts(segments, ref_text_overrides)
+            previous_audio_path = data.get('previous_audio_path')
+            previous = load_script_version(previous_audio_path) if previous_audio_path else None
+            script = synthesize_script(segments, prompts, seed, speed, cross_fade_duration, previous)
+            generated_audio_segments = [script['audio']]
+            if remove_silence:
+                # Las marcas de cada chunk dejan de valer: no se guarda versión
+                generated_audio_segments = [remove_silence_from_wave(script['audio'])]
+                script = None
 
-        for segment in segments:
-            style = segment["style"]
-            text = segment["text"]
-
-            speech_type_data = speech_types_dict[style]
-            ref_audio = speech_type_data['audio']
-            ref_text_original = speech_type_data.get('ref_text', '')
-            # Para estilos que NO sean "Regular", forzamos la transcripción ignorando el texto almacenado.
-            if style != "Regular":
-                ref_text = ""
-            else:
-                ref_text = ref_text_original
+        if generated_audio_segments:
+            final_audio_data = np.concatenate(generated_audio_segments).astype(np.float32)
+            return jsonify({'success': True, **save_multistyle_audio(final_audio_data, script, fmt)})
+        else:
+            logger.error('No se generó audio')
+            return jsonify({'error': 'No se generó audio'}), 400
 
-            # Si se envía un override en el request, se prioriza.
-            if style in ref_text_overrides and ref_text_overrides[style].strip():
-                ref_text = ref_text_overrides[style].strip()
+    except Exception as e:
+        logger.exception(f'Error en generación multi-estilo: {str(e)}')
+        return jsonify({'error': f'Error en generación multi-estilo: {str(e)}'}), 500
 
-            # Procesar el audio de referencia y obtener el texto final (se transcribe si ref_text está vacío)
-            processed_audio, processed_text = preprocess_ref_audio_text(
-                ref_audio_orig=ref_audio,
-                ref_text=ref_text,
-                show_info=lambda msg: logger.info(f"[{style}] {msg}")
-            )
+@app.route('/api/generate_multistyle_speech_stream', methods=['POST'])
+def generate_multistyle_speech_stream():
+    """
+    Variante en streaming de generate_multistyle_speech.
+    Responde un WAV PCM 16 bits por transferencia chunked: la cabecera primero y luego el audio
+    de cada chunk en cuanto se genera. El archivo final se guarda igualmente en GENERATED_AUDIO_FOLDER
+    y su ruta va en la cabecera X-Audio-Path. remove_silence no aplica en este modo.
+    """
+    try:
+        data = request.json
+        gen_text = data.get('gen_text', 'Este es un texto por defecto para generar audio.')
+        cross_fade_duration = data.get('cross_fade_duration', 0.15)
+        speed = data.get('speed_change', 1.0)
+        ref_text_overrides = data.get('ref_text_overrides', {})
+        long_form = data.get('long_form', False)
+        seed = data.get('seed')
 
-            # Generar el segmento de audio
-            audio_output, _ = infer(
-                ref_audio_orig=processed_audio,
-                ref_text=processed_text,
-                gen_text=text,
-                model=F5TTS_ema_model,
-                remove_silence=remove_silence,
-                cross_fade_duration=cross_fade_duration,
-                speed=speed
-            )
+        if not gen_text:
+            logger.error('gen_text es requerido')
+            return jsonify({'error': 'gen_text es requerido'}), 400
 
-            if sample_rate is None:
-                sample_rate = audio_output[0]
-            generated_audio_segments.append(audio_output[1])
-            logger.info(f"Segmento generado para {style} guardado.")
+        segments = parse_speechtypes_text(gen_text)
+        logger.info(f"Segmentos obtenidos: {segments}")
 
-        if generated_audio_segments:
-            final_audio_data = np.concatenate(generated_audio_segments)
-            generated_audio_filename = f"multi_style_{uuid.uuid4().hex}.wav"
-            generated_audio_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], generated_audio_filename)
-            sf.write(generated_audio_path, final_audio_data, sample_rate)
-            logger.info(f"Audio final multi-estilo guardado en: {generated_audio_path}")
-            return jsonify({
-                'success': True,
-                'audio_path': generated_audio_path
-            })
-        else:
-            logger.error('No se generó audio')
+        error = check_segments(segments)
+        if error is not None:
+            return jsonify({'error': error[0]}), error[1]
+        if not segments:
             return jsonify({'error': 'No se generó audio'}), 400
-
     except Exception as e:
         logger.exception(f'Error en generación multi-estilo: {str(e)}')
         return jsonify({'error': f'Error en generación multi-estilo: {str(e)}'}), 500
 
+    generated_audio_filename = f"multi_style_{uuid.uuid4().hex}.wav"
+    generated_audio_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], generated_audio_filename)
+
+    # El cuerpo corre después de after_request (que ya cerró el perfil de la petición): se perfila aquí
+    profile_id = g.request_id if 'profile' in g else None
+
+    def generate():
+        profile_token = profiler.activate(profile_id) if profile_id is not None else None
+        # Se escribe a un archivo parcial y se renombra al terminar, para no servir audios incompletos
+        partial_path = generated_audio_path + '.part'
+        try:
+            yield wav_stream_header(target_sample_rate)
+            with sf.SoundFile(
+                partial_path, 'w', samplerate=target_sample_rate, channels=1, subtype='PCM_16', format='WAV'
+            ) as output:
+                for segment in segments:
+                    style = segment["style"]
+                    processed_audio, processed_text = segment_reference(style, ref_text_overrides)
+                    for block in infer_process_stream(
+                        processed_audio,
+                        processed_text,
+                        normalize_gen_text(segment["text"]),
+                        F5TTS_ema_model,
+                        vocoder,
+                        show_info=lambda msg: logger.info(f"[{style}] {msg}"),
+                        cross_fade_duration=cross_fade_duration,
+                        speed=speed,
+                        rolling_context=long_form,
+                        seed=seed,
+                        chunk_cache=chunk_cache
+                    ):
+                        pcm = (np.clip(block, -1.0, 1.0) * 32767).astype('<i2')
+                        output.write(pcm)
+                        yield pcm.tobytes()
+                    logger.info(f"Segmento generado para {style} enviado.")
+            os.replace(partial_path, generated_audio_path)
+            storage.register(generated_audio_path)
+            logger.info(f"Audio final multi-estilo guardado en: {generated_audio_path}")
+        except Exception as e:
+            # La respuesta ya empezó: solo queda cortar el stream
+            logger.exception(f'Error en generación multi-estilo en streaming: {str(e)}')
+        finally:
+            # Error o cliente desconectado (GeneratorExit): el parcial no llegó a renombrarse
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            if profile_token is not None:
+                profiler.deactivate(profile_token)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/wav',
+        headers={'X-Audio-Path': generated_audio_path, 'Cache-Control': 'no-cache'}
+    )
+
 @app.route('/api/generate_timestamps_from_audio', methods=['POST'])
 def generate_timestamps_from_audio():
     try:
@@ -412,8 +949,8 @@ def generate_timestamps_from_audio():
         if not audio_path or not os.path.exists(audio_path):
             return jsonify({'error': 'audio_path no válido'}), 400
 
-        transcription = transcribe_audio_with_timestamps(audio_path)
-        logger.info(f"Transcripción generada: {transcription}")
+        transcription, words, source = audio_timestamps(audio_path)
+        logger.info(f"Transcripción generada ({source}): {transcription}")
 
         final_text = (
             f"INFO:__main__:Audio final multi-estilo guardado en: {audio_path}\n"
@@ -422,7 +959,9 @@ def generate_timestamps_from_audio():
 
         return jsonify({
             'audio_path': audio_path,
-            'transcription': final_text
+            'transcription': final_text,
+            'words': words,
+            'source': source
         })
     except Exception as e:
         logger.exception(f'Error al generar marcas de tiempo desde audio: {str(e)}')
@@ -451,6 +990,8 @@ def modify_prosody_route():
             modifications=modifications,
             output_path=modified_audio_path
         )
+        if os.path.exists(modified_audio_path):
+            storage.register(modified_audio_path)
 
         return jsonify({'success': True, 'output_audio_path': modified_audio_path}), 200
 
@@ -464,6 +1005,8 @@ def modify_prosody_route():
                 output_path=modified_audio_path,
                 cross_fade_duration=0  # Desactivar crossfade
             )
+            if os.path.exists(modified_audio_path):
+                storage.register(modified_audio_path)
             return jsonify({'success': True, 'output_audio_path': modified_audio_path}), 200
         except Exception as e2:
             logger.exception(f'Error al modificar la prosodia sin crossfade: {e2}')
@@ -473,6 +1016,107 @@ def modify_prosody_route():
         logger.exception(f'Error al modificar la prosodia: {e}')
         return jsonify({'success': False, 'message': f'Error al modificar la prosodia: {e}'}), 500
 
+# Longitud máxima de un audio sin versión de guion que se edita de una vez (ventana del modelo)
+MAX_EDIT_DURATION = 25
+
+def replace_in_chunk(chunk_text, old, new, position):
+    """Reemplaza `old` por `new` en el texto del chunk, en la aparición más cercana a `position` (0-1)."""
+    matches = [m.start() for m in re.finditer(re.escape(old), chunk_text)]
+    if not matches:
+        raise ValueError(f"'{old}' no aparece en el texto del chunk: {chunk_text}")
+    index = min(matches, key=lambda i: abs(i - position * len(chunk_text)))
+    return chunk_text[:index] + new + chunk_text[index + len(old):]
+
+@app.route('/api/edit_regions', methods=['POST'])
+def edit_regions_route():
+    """
+    Regenera solo los tramos indicados de un audio generado (p. ej. una palabra mal dicha).
+    Recibe JSON con 'audio_path', 'origin_text', 'target_text' y 'spans' ([inicio, fin] o
+    [inicio, fin, duración] en segundos). Si el audio tiene versión de guion, solo se editan
+    los chunks que contienen algún tramo, todos en un mismo lote.
+    """
+    data = request.json
+    audio_path = data.get('audio_path')
+    origin_text = data.get('origin_text', '')
+    target_text = data.get('target_text', '')
+    spans = data.get('spans', [])
+    seed = data.get('seed')
+
+    if not audio_path or not os.path.exists(audio_path):
+        return jsonify({'error': 'audio_path no válido'}), 400
+    if not spans or not target_text:
+        return jsonify({'error': 'spans y target_text son requeridos'}), 400
+    if not all(isinstance(span, (list, tuple)) and len(span) >= 2 for span in spans):
+        return jsonify({'error': 'Cada tramo debe ser [inicio, fin] o [inicio, fin, duración]'}), 400
+    # Los cambios del diff salen en orden del texto: los tramos se emparejan en orden de inicio
+    spans = sorted(spans, key=lambda span: span[0])
+
+    try:
+        changes = edit_region_targets(origin_text, target_text, len(spans))
+        version = load_script_version(audio_path)
+        edited_audio_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], f"edited_{uuid.uuid4().hex}.wav")
+
+        if version is None:
+            audio_data, sr = sf.read(audio_path, dtype='float32', always_2d=True)
+            audio_data = audio_data.T  # [canales, muestras]
+            if audio_data.shape[1] / sr > MAX_EDIT_DURATION:
+                return jsonify({'error': f'Audio de más de {MAX_EDIT_DURATION} s sin versión de guion: regenérelo primero'}), 400
+            edited = edit_regions_batch(
+                [((audio_data, sr), origin_text, target_text, spans)],
+                F5TTS_ema_model,
+                vocoder,
+                seed=seed
+            )[0]
+            sf.write(edited_audio_path, edited, target_sample_rate)
+            storage.register(edited_audio_path)
+            return jsonify({'success': True, 'audio_path': edited_audio_path, 'edited_chunks': 1})
+
+        chunks, waves = version
+        # Asignar cada tramo al chunk que lo contiene, en tiempo local del chunk
+        edits = {}
+        for span, (old, new) in zip(spans, changes):
+            start, end = span[0] * target_sample_rate, span[1] * target_sample_rate
+            index = next((i for i, c in enumerate(chunks) if c['start'] <= start and end <= c['end']), None)
+            if index is None:
+                return jsonify({'error': f'El tramo {span} cruza el límite entre dos chunks'}), 400
+            if not old:
+                return jsonify({'error': f'El tramo {span} debe reemplazar al menos una palabra'}), 400
+            chunk = chunks[index]
+            local_span = [span[0] - chunk['start'] / target_sample_rate, span[1] - chunk['start'] / target_sample_rate, *span[2:]]
+            position = (start - chunk['start']) / max(chunk['end'] - chunk['start'], 1)
+            edits.setdefault(index, []).append((local_span, old, new, position))
+
+        rows = []
+        for index, chunk_edits in edits.items():
+            chunk_text = chunks[index]['text']
+            # Reemplazar de atrás hacia adelante para no desplazar las posiciones pendientes
+            for _, old, new, position in sorted(chunk_edits, key=lambda edit: -edit[3]):
+                chunk_text = replace_in_chunk(chunk_text, old, new, position)
+            rows.append((
+                (waves[index], target_sample_rate),
+                chunks[index]['text'],
+                chunk_text,
+                [edit[0] for edit in chunk_edits]
+            ))
+            chunks[index]['text'] = chunk_text
+
+        logger.info(f"Editando {len(spans)} tramos en {len(rows)} chunks de {len(chunks)}")
+        edited = edit_regions_batch(rows, F5TTS_ema_model, vocoder, seed=seed)
+        for index, wave in zip(edits, edited):
+            waves[index] = wave
+
+        audio, new_spans = assemble_chunks(waves, [chunk['segment'] for chunk in chunks], data.get('cross_fade_duration', 0.15))
+        sf.write(edited_audio_path, audio, target_sample_rate)
+        storage.register(edited_audio_path)
+        save_script_version(edited_audio_path, {'chunks': chunks, 'waves': waves, 'spans': new_spans})
+        return jsonify({'success': True, 'audio_path': edited_audio_path, 'edited_chunks': len(rows)})
+
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logger.exception(f'Error al editar tramos: {e}')
+        return jsonify({'error': f'Error al editar tramos: {e}'}), 500
+
 @app.route('/api/delete_audio', methods=['POST'])
 def delete_audio():
     """
@@ -493,7 +1137,9 @@ def delete_audio():
         return jsonify({'success': False, 'message': 'El archivo de audio no existe.'}), 404
 
     try:
-        os.remove(full_path)
+        # La versión de guion guardada junto al audio ya no sirve; se borra con él
+        for path in (full_path, *script_version_paths(full_path)):
+            storage.remove(path)
         logger.info(f"Audio eliminado: {full_path}")
         return jsonify({'success': True, 'message': 'Audio eliminado correctamente.'}), 200
     except Exception as e:
@@ -502,6 +1148,15 @@ def delete_audio():
 
 @app.route('/api/get_audio/<path:filename>')
 def get_audio(filename):
+    """
+    Sirve un audio generado, en WAV o en otro formato con ?format=flac|opus|mp3 (codificado la
+    primera vez). Responde a peticiones Range y condicionales (ETag), así que buscar en el
+    reproductor o volver a escucharlo no descarga el archivo entero otra vez.
+    """
+    try:
+        fmt = output_format(request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
         # Verificar que el archivo existe en GENERATED_AUDIO_FOLDER
         secure_path = secure_filename(os.path.basename(filename))
@@ -509,21 +1164,55 @@ def get_audio(filename):
         if not os.path.exists(full_path):
             logger.error(f"Archivo de audio no encontrado: {full_path}")
             return jsonify({'error': 'Archivo de audio no encontrado.'}), 404
-        return send_file(full_path, mimetype='audio/wav')
+        storage.touch(full_path)
+        return send_file(
+            encode_audio(full_path, fmt),
+            mimetype=AUDIO_FORMATS[fmt][1],
+            conditional=True,
+            etag=True,
+            max_age=AUDIO_MAX_AGE
+        )
     except Exception as e:
         logger.exception(f"Error al servir archivo de audio {filename}: {str(e)}")
         return jsonify({'error': str(e)}), 404
 
+def spectrogram_path(audio_path):
+    """
+    Devuelve el PNG del espectrograma de un audio generado, dibujándolo la primera vez. Queda junto
+    al WAV y se borra con él.
+    """
+    png_path = os.path.splitext(audio_path)[0] + '.spectrogram.png'
+    if os.path.exists(png_path):
+        return png_path
+    audio, sr = sf.read(audio_path, dtype='float32', always_2d=True)
+    partial_path = f"{png_path}.{uuid.uuid4().hex}.part"
+    try:
+        save_spectrogram(mel_spectrogram(audio.mean(axis=1), sr, F5TTS_ema_model), partial_path)
+        os.replace(partial_path, png_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    storage.register(png_path, owner=audio_path)
+    return png_path
+
 @app.route('/api/get_spectrogram/<path:filename>')
 def get_spectrogram(filename):
+    """Espectrograma (PNG) de un audio generado, por su nombre; se dibuja al pedirlo y se cachea."""
     try:
-        # Verificar que el archivo existe
+        # Verificar que el audio existe en GENERATED_AUDIO_FOLDER
         secure_path = secure_filename(os.path.basename(filename))
-        full_path = os.path.join(tempfile.gettempdir(), secure_path)
+        full_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], os.path.splitext(secure_path)[0] + '.wav')
         if not os.path.exists(full_path):
-            logger.error(f"Espectrograma no encontrado: {full_path}")
+            logger.error(f"Audio no encontrado para el espectrograma: {full_path}")
             return jsonify({'error': 'Espectrograma no encontrado.'}), 404
-        return send_file(full_path, mimetype='image/png')
+        storage.touch(full_path)
+        return send_file(
+            spectrogram_path(full_path),
+            mimetype='image/png',
+            conditional=True,
+            etag=True,
+            max_age=AUDIO_MAX_AGE
+        )
     except Exception as e:
         logger.exception(f"Error al servir espectrograma {filename}: {str(e)}")
         return jsonify({'error': str(e)}), 404
@@ -531,45 +1220,278 @@ def get_spectrogram(filename):
 @app.route('/api/get_speech_types', methods=['GET'])
 def get_speech_types():
     try:
-        speech_types = list(speech_types_dict.keys())
+        speech_types = voice_store.list_voices()
         logger.info(f"Tipos de habla solicitados: {speech_types}")
         return jsonify(speech_types)
     except Exception as e:
         logger.exception(f"Error al obtener tipos de habla: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def cleanup_temp_files():
+# Trabajos asíncronos: la petición HTTP solo encola y el pool de trabajos (con el modelo) los procesa
+
+def run_multistyle_job(ctx):
+    """
+    Genera un guion multi-estilo como generate_multistyle_speech: chunks en lotes entre estilos,
+    versión de guion y tiempos por palabra. El avance se guarda cada JOB_SEGMENTS_PER_STEP
+    segmentos como versión parcial; al retomar, sus chunks se reutilizan y solo se genera el resto.
+    """
+    params = ctx.params
+    segments = parse_speechtypes_text(params['gen_text'])
+    error = check_segments(segments)
+    if error is not None:
+        raise ValueError(error[0])
+    if not segments:
+        raise ValueError('No se generó audio')
+
+    fmt = output_format(params.get('output_format'))
+    cross_fade_duration = params.get('cross_fade_duration', 0.15)
+    speed = params.get('speed_change', 1.0)
+    seed = params.get('seed')
+    ref_text_overrides = params.get('ref_text_overrides', {})
+    job_folder = os.path.join(JOBS_FOLDER, ctx.job_id)
+    os.makedirs(job_folder, exist_ok=True)
+
+    script = None
+    if params.get('long_form', False):
+        # El modo largo encadena cada chunk con el anterior: segmento a segmento, cada uno una parte
+        for i, segment in enumerate(segments):
+            if i in ctx.parts and os.path.exists(ctx.parts[i]):
+                continue
+            style = segment["style"]
+            processed_audio, processed_text = segment_reference(style, ref_text_overrides)
+            audio_output = infer(
+                ref_audio_orig=processed_audio,
+                ref_text=processed_text,
+                gen_text=segment["text"],
+                model=F5TTS_ema_model,
+                remove_silence=params.get('remove_silence', False),
+                cross_fade_duration=cross_fade_duration,
+                speed=speed,
+                long_form=True,
+                seed=seed
+            )
+            part_path = os.path.join(job_folder, f"{i}.wav")
+            sf.write(part_path, audio_output[1], audio_output[0])
+            ctx.save_part(i, part_path)
+            ctx.set_progress(len(ctx.parts), len(segments))
+            logger.info(f"[{ctx.job_id}] Segmento {i + 1}/{len(segments)} generado para {style}.")
+        audio = np.concatenate([sf.read(ctx.parts[i], dtype='float32')[0] for i in range(len(segments))])
+    else:
+        prompts = segment_voice_prompts(segments, ref_text_overrides)
+        # Las partes son versiones parciales del guion: la clave es el número de segmentos que cubren
+        partial_path = os.path.join(job_folder, 'partial.wav')
+        done = max(ctx.parts, default=0)
+        previous = read_script_version(partial_path) if done else None
+        if previous is not None and previous[0]:
+            seed = previous[0][0]['seed']  # la misma semilla con la que se generó la parte
+        steps = list(range(done + JOB_SEGMENTS_PER_STEP, len(segments), JOB_SEGMENTS_PER_STEP)) + [len(segments)]
+        for end in steps:
+            script = synthesize_script(segments[:end], prompts, seed, speed, cross_fade_duration, previous)
+            if end < len(segments):
+                save_script_version(partial_path, script)
+                ctx.save_part(end, partial_path)
+                previous = (script['chunks'], script['waves'])
+            ctx.set_progress(end, len(segments))
+            logger.info(f"[{ctx.job_id}] {end}/{len(segments)} segmentos generados.")
+        audio = script['audio']
+        if params.get('remove_silence', False):
+            # Las marcas de cada chunk dejan de valer: no se guarda versión
+            audio = remove_silence_from_wave(audio)
+            script = None
+        storage.remove(partial_path)
+
+    result = save_multistyle_audio(audio.astype(np.float32), script, fmt)
+    shutil.rmtree(job_folder, ignore_errors=True)
+    return result
+
+def run_prosody_job(ctx):
+    params = ctx.params
+    if not params.get('audio_path') or not os.path.exists(params['audio_path']):
+        raise ValueError('audio_path no válido')
+
+    modified_audio_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], f"modified_{ctx.job_id}.wav")
     try:
-        # Limpiar archivos en UPLOAD_FOLDER que no se han modificado en la última hora
-        temp_files = glob.glob(os.path.join(UPLOAD_FOLDER, '*'))
-        for f in temp_files:
-            try:
-                if os.path.isfile(f) and os.path.getmtime(f) < time.time() - 3600:
-                    os.remove(f)
-                    logger.info(f"Archivo temporal eliminado: {f}")
-            except Exception as e:
-                logger.error(f"Error al limpiar el archivo {f}: {e}")
+        modify_prosody(
+            audio_path=params['audio_path'],
+            modifications=params.get('modifications', []),
+            output_path=modified_audio_path
+        )
+    except ValueError as ve:
+        logger.warning(f"Crossfade issue encountered: {ve}, trying without crossfade restrictions.")
+        modify_prosody(
+            audio_path=params['audio_path'],
+            modifications=params.get('modifications', []),
+            output_path=modified_audio_path,
+            cross_fade_duration=0  # Desactivar crossfade
+        )
+    if os.path.exists(modified_audio_path):
+        storage.register(modified_audio_path)
+    ctx.set_progress(1, 1)
+    return {'output_audio_path': modified_audio_path}
 
-        # Limpiar audios generados que no se han modificado en la última hora
-        generated_audio_files = glob.glob(os.path.join(GENERATED_AUDIO_FOLDER, '*.wav'))
-        for f in generated_audio_files:
-            try:
-                if os.path.isfile(f) and os.path.getmtime(f) < time.time() - 3600:
-                    os.remove(f)
-                    logger.info(f"Archivo generado eliminado: {f}")
-            except Exception as e:
-                logger.error(f"Error al limpiar el archivo {f}: {e}")
+def run_ingest_job(ctx):
+    """
+    Termina de registrar una voz subida: compacta la referencia y la transcribe si no trae texto.
+    El resultado (canónico) reemplaza al prompt provisional del tipo de habla.
+    """
+    params = ctx.params
+    speech_type = params['speech_type']
+    source_audio = params['source_audio']
+    prompt_path, prompt_text = params['canonical_audio'], params.get('ref_text', '')
+
+    if params.get('compact_prompt', True):
+        try:
+            compact_path, compact_text = compact_voice_prompt(source_audio, prompt_text)
+            if compact_path != source_audio:
+                prompt_path = canonicalize_ref_audio(
+                    compact_path, os.path.splitext(compact_path)[0] + '.npy', ref_text=compact_text, clip_short=False
+                )
+                prompt_text = compact_text
+        except Exception as e:
+            logger.warning(f"No se pudo compactar el audio de referencia, se usa completo: {str(e)}")
+
+    if not prompt_text.strip():
+        prompt_text = transcribe_ref_audio(prompt_path, language=ASR_LANGUAGE)
+        write_canonical_metadata(prompt_path, ref_text=prompt_text)
+
+    if params.get('compact_prompt', True):
+        # Una nueva subida de la misma grabación reutiliza este prompt sin repetir la ingesta
+        voice_store.update_audio(params['audio_hash'], prompt=prompt_path, prompt_text=prompt_text)
+    # Solo si la voz no se volvió a subir con otra grabación mientras tanto
+    if not voice_store.update_voice(
+        speech_type, params['audio_hash'], audio=prompt_path, ref_text=prompt_text, status=READY
+    ):
+        logger.info(f"{speech_type} se volvió a subir durante la ingesta; se descarta {source_audio}")
+        return {'speech_type': speech_type, 'superseded': True}
+    ctx.set_progress(1, 1)
+    logger.info(f"Voz {speech_type} lista: {prompt_path}")
+    return {'speech_type': speech_type, 'prompt_path': prompt_path, 'prompt_text': prompt_text}
+
+job_queue = JobQueue(
+    JobStore(JOBS_DB),
+    handlers={
+        'generate_multistyle_speech': run_multistyle_job,
+        'modify_prosody': run_prosody_job,
+        'ingest_voice': run_ingest_job,
+    },
+    num_workers=1
+)
+job_queue.start()
+
+# Trabajos que se pueden encolar por HTTP; la ingesta de voces solo la lanza upload_audio
+PUBLIC_JOB_KINDS = ('generate_multistyle_speech', 'modify_prosody')
+
+# Profundidad de colas y uso de disco, leídos al pedir /metrics
+metrics_registry.gauge_callback('f5tts_jobs', job_queue.store.counts, label='status')
+metrics_registry.gauge_callback('f5tts_vocoder_queue_depth', vocoder.pending)
+metrics_registry.gauge_callback('f5tts_storage_bytes', storage.total_bytes)
+
+@app.route('/metrics')
+def metrics():
+    """
+    Métricas de este proceso en formato de texto de Prometheus: histogramas de latencia por etapa
+    y por ruta, factor de tiempo real, profundidad de colas y tasas de acierto de las cachés.
+    """
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def profile_admin():
+    """
+    POST con JSON {'requests': N}: perfila las próximas N peticiones de PROFILED_ENDPOINTS (de cualquier
+    worker; 0 desarma).
+    GET: peticiones pendientes de perfilar y archivos de perfil guardados en PROFILE_FOLDER.
+    """
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        try:
+            num_requests = int(data.get('requests', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'requests debe ser un entero'}), 400
+        profiler.arm(num_requests)
+        logger.info(f"Perfilado armado para las próximas {num_requests} peticiones")
+    return jsonify({'armed': profiler.armed(), 'profiles': profiler.list_profiles()})
+
+@app.route('/api/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    if kind not in PUBLIC_JOB_KINDS:
+        return jsonify({'error': f"Tipo de trabajo desconocido: {kind}"}), 404
+    try:
+        data = request.get_json() or {}
+        if kind == 'generate_multistyle_speech' and not data.get('gen_text'):
+            return jsonify({'error': 'gen_text es requerido'}), 400
+        if kind == 'modify_prosody' and not data.get('audio_path'):
+            return jsonify({'error': 'audio_path no válido'}), 400
+        if kind == 'generate_multistyle_speech' and (data.get('output_format') or 'wav').lower() not in AUDIO_FORMATS:
+            return jsonify({'error': f"Formato no soportado: {data['output_format']}"}), 400
+        if 'profile' in g:
+            # el trabajo corre en otro hilo: se perfila allí, con su propio ID
+            data['profile'] = True
+        job_id = job_queue.submit(kind, data)
+        logger.info(f"Trabajo {kind} encolado: {job_id}")
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        logger.error(f"Error en cleanup_temp_files: {e}")
+        logger.exception(f"Error al encolar trabajo {kind}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado.'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['done'] / job['total'] if job['total'] else 0.0,
+        'done': job['done'],
+        'total': job['total'],
+        'error': job['error'],
+    })
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado.'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': f"El trabajo no ha terminado ({job['status']})", 'status': job['status']}), 409
+    return jsonify({'success': True, **job['result']})
+
+@app.route('/api/pin_audio', methods=['POST'])
+def pin_audio():
+    """
+    Fija (o suelta) un audio generado: los audios fijados no se borran al pasar la cuota.
+    Recibe JSON con 'audio_path' y 'pinned' (por defecto true).
+    """
+    data = request.get_json()
+    audio_path = data.get('audio_path', '')
+    secure_path = secure_filename(os.path.basename(audio_path))
+    full_path = os.path.join(app.config['GENERATED_AUDIO_FOLDER'], secure_path)
+    if not audio_path or not os.path.exists(full_path):
+        return jsonify({'success': False, 'message': 'El archivo de audio no existe.'}), 404
+    pinned = bool(data.get('pinned', True))
+    if not storage.pin(full_path, pinned):
+        storage.register(full_path, pinned=pinned)
+    return jsonify({'success': True, 'pinned': pinned}), 200
+
+def cleanup_temp_files():
+    """
+    Pasada periódica sobre el índice de almacenamiento (sin recorrer carpetas): borra los temporales
+    sin uso en TEMP_MAX_AGE y, si hace falta, los audios menos usados hasta volver a la cuota.
+    Cada audio nuevo ya aplica la cuota al registrarse; esto cubre a los workers inactivos.
+    """
     try:
-        load_speech_types()
+        freed = storage.cleanup(temp_max_age=TEMP_MAX_AGE)
+        if freed:
+            logger.info(f"Limpieza: {freed / 1024**2:.1f} MB liberados, {storage.total_bytes() / 1024**2:.1f} MB en uso")
     except Exception as e:
-        logger.exception(f"Error al cargar tipos de habla: {str(e)}")
+        logger.error(f"Error en cleanup_temp_files: {e}")
 
+if __name__ == '__main__':
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=cleanup_temp_files, trigger="interval", hours=1)
+    scheduler.add_job(func=cleanup_temp_files, trigger="interval", minutes=10)
     scheduler.start()
     logger.info("Scheduler de limpieza iniciado.")
 
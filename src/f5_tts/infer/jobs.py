@@ -0,0 +1,254 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+from f5_tts.metrics import start_trace, finish_trace
+from f5_tts.profiling import get_profiler
+
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobStore:
+    """
+    Estado de los trabajos en SQLite, compartido por todos los procesos (workers de gunicorn).
+
+    Cada trabajo guarda sus parámetros, progreso, resultado y las partes ya generadas,
+    de modo que un reinicio retoma el trabajo donde quedó.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+                CREATE TABLE IF NOT EXISTS job_parts (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # Modo autocommit: cada sentencia es su propia transacción salvo BEGIN explícito
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind, params):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), QUEUED, now, now),
+            )
+        return job_id
+
+    def claim(self, lease):
+        """
+        Toma el trabajo más antiguo pendiente, o uno en curso cuyo proceso dejó de renovar su
+        lease (murió o se reinició). Devuelve el trabajo como dict, o None.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE bloquea la escritura: dos procesos no pueden tomar el mismo trabajo
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, lease_until = ?, updated = ? WHERE id = ?",
+                        (RUNNING, now + lease, now, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        if row["status"] == RUNNING:
+            logger.info(f"Retomando trabajo {row['id']} ({row['done']}/{row['total']})")
+        return self.get(row["id"])
+
+    def renew(self, job_id, lease):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?", (time.time() + lease, job_id, RUNNING)
+            )
+
+    def set_progress(self, job_id, done, total):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET done = ?, total = ?, updated = ? WHERE id = ?", (done, total, time.time(), job_id)
+            )
+
+    def save_part(self, job_id, idx, path):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO job_parts (job_id, idx, path) VALUES (?, ?, ?)", (job_id, idx, path))
+
+    def parts(self, job_id):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT idx, path FROM job_parts WHERE job_id = ?", (job_id,)).fetchall()
+        return {row["idx"]: row["path"] for row in rows}
+
+    def finish(self, job_id, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                (
+                    FAILED if error is not None else DONE,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def counts(self):
+        """Número de trabajos por estado (profundidad de la cola)."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "params": json.loads(row["params"]),
+            "status": row["status"],
+            "done": row["done"],
+            "total": row["total"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+
+
+class JobContext:
+    """Lo que recibe un handler: parámetros del trabajo, partes ya hechas y cómo reportar avance."""
+
+    def __init__(self, store, job, lease):
+        self.store = store
+        self.job_id = job["id"]
+        self.params = job["params"]
+        self.lease = lease
+        self.parts = store.parts(self.job_id)
+
+    def set_progress(self, done, total):
+        self.store.set_progress(self.job_id, done, total)
+        self.store.renew(self.job_id, self.lease)
+
+    def save_part(self, idx, path):
+        """Registra una parte terminada; al retomar el trabajo aparece en `parts` y no se rehace."""
+        self.store.save_part(self.job_id, idx, path)
+        self.parts[idx] = path
+
+
+class JobQueue:
+    """
+    Pool de hilos que ejecuta los trabajos de un JobStore.
+
+    `handlers` asocia cada tipo de trabajo a una función handler(ctx) que devuelve el resultado
+    (serializable en JSON). Mientras un trabajo corre, su lease se renueva; si el proceso muere,
+    otro proceso (o este mismo al reiniciar) lo retoma cuando el lease vence.
+    """
+
+    def __init__(self, store, handlers, num_workers=1, lease=60, poll_interval=1.0):
+        self.store = store
+        self.handlers = handlers
+        self.num_workers = num_workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        job_id = self.store.submit(kind, params)
+        self._wakeup.set()
+        return job_id
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.lease / 3):
+            self.store.renew(job_id, self.lease)
+
+    def _run(self):
+        while True:
+            try:
+                job = self.store.claim(self.lease)
+            except Exception as e:
+                logger.error(f"Error al tomar un trabajo: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], stop), daemon=True)
+            heartbeat.start()
+            # Traza del trabajo: tiempos por etapa, en una línea JSON al terminar
+            trace = start_trace(job["id"], job=job["kind"])
+            # Perfilado: si se pidió al encolar el trabajo (ver profiling)
+            profiler = get_profiler()
+            profile = profiler.activate(job["id"]) if profiler is not None and job["params"].get("profile") else None
+            status = FAILED
+            try:
+                logger.info(f"Ejecutando trabajo {job['id']} ({job['kind']})")
+                result = self.handlers[job["kind"]](JobContext(self.store, job, self.lease))
+                self.store.finish(job["id"], result=result)
+                status = DONE
+                logger.info(f"Trabajo {job['id']} terminado")
+            except Exception as e:
+                logger.exception(f"Error en el trabajo {job['id']}: {e}")
+                self.store.finish(job["id"], error=str(e))
+            finally:
+                if profile is not None:
+                    profiler.deactivate(profile)
+                finish_trace(trace, status=status)
+                stop.set()
@@ -6,6 +6,8 @@ import logging
 import subprocess
 from pysoundtouch import SoundTouch  # Para velocidad y volumen
 import librosa  # Importación añadida para pitch_shift
+from f5_tts.metrics import stage, timed
+from f5_tts.profiling import profiled
 
 
 # Configuración básica del logger
@@ -89,6 +91,8 @@ def process_segment(y, sr, speed_change, pitch_shift, volume_change):
     
     return y_processed
 
+@profiled("prosody")
+@timed("prosody")
 def modify_prosody(
     audio_path,
     modifications,
@@ -110,7 +114,8 @@ def modify_prosody(
 
     try:
         # Cargar audio usando soundfile en lugar de librosa
-        y, sr = sf.read(audio_path)
+        with stage("file_io"):
+            y, sr = sf.read(audio_path)
         # Convertir a mono si es necesario
         if len(y.shape) > 1:
             y = np.mean(y, axis=1)
@@ -259,7 +264,8 @@ def modify_prosody(
             return {'success': False, 'message': f"Error al crear archivo temporal: {e}"}
 
     try:
-        sf.write(output_path, final_audio_int16, sr)
+        with stage("file_io"):
+            sf.write(output_path, final_audio_int16, sr)
         logger.info(f"Audio modificado guardado en: {output_path}")
     except Exception as e:
         logger.error(f"Error al guardar el audio modificado: {e}")
@@ -0,0 +1,253 @@
+"""
+Bounded storage for generated audio and temporary artifacts.
+
+Every file the service writes and does not keep for good (generated audio and its sidecars,
+temporary WAVs, spectrograms, leftover uploads) is recorded in a SQLite index with its size,
+last access and a pin flag. Registering a file enforces the disk quota right away, evicting the
+least recently used unpinned artifacts; cleanup never lists directories, it only queries the index.
+
+Artifacts can own others (a generated WAV owns its script version): owned artifacts are evicted
+and deleted together with their owner.
+
+Library code asks for temporary files through `temp_artifact`, which uses the process-wide
+manager set with `set_storage_manager`, or falls back to the system temp dir.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Artifact kinds
+GENERATED = "generated"
+TEMP = "temp"
+
+EVICT_BATCH = 64
+
+
+class StorageManager:
+    """
+    Index of artifacts on disk with an LRU-enforced quota, shared by all processes (SQLite, WAL).
+
+    Args:
+        path (str): SQLite database of the index.
+        max_bytes (int): Quota for all indexed artifacts.
+        temp_folder (str): Directory for temporary artifacts; created if missing.
+        grace_period (float): Artifacts accessed this recently (seconds) are never evicted, so
+            files still being written or served survive a burst over the quota.
+    """
+
+    def __init__(self, path, max_bytes, temp_folder, grace_period=60):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.temp_folder = temp_folder
+        self.grace_period = grace_period
+        os.makedirs(temp_folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    owner TEXT,
+                    pinned INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS artifacts_lru ON artifacts (pinned, last_access);
+                CREATE INDEX IF NOT EXISTS artifacts_owner ON artifacts (owner);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit mode: every statement is its own transaction
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def register(self, path, kind=GENERATED, owner=None, pinned=False):
+        """
+        Records a file that was just written (or rewritten) and enforces the quota.
+
+        Re-registering a path updates its size and access time and keeps its pin.
+        """
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO artifacts (path, size, kind, owner, pinned, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, owner = excluded.owner, "
+                "last_access = excluded.last_access",
+                (self._key(path), size, kind, self._key(owner) if owner else None, int(pinned), now, now),
+            )
+        self.enforce_quota()
+
+    def touch(self, path):
+        """Marks an artifact as just used; returns whether it is indexed."""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE artifacts SET last_access = ? WHERE path = ?", (time.time(), self._key(path)))
+        return cursor.rowcount > 0
+
+    def pin(self, path, pinned=True):
+        """Pinned artifacts are never evicted nor expired; returns whether the artifact is indexed."""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE artifacts SET pinned = ? WHERE path = ?", (int(pinned), self._key(path)))
+        return cursor.rowcount > 0
+
+    def get(self, path):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM artifacts WHERE path = ?", (self._key(path),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def remove(self, path):
+        """Deletes an artifact and the artifacts it owns, on disk and in the index; returns the bytes freed."""
+        key = self._key(path)
+        with self._connect() as conn:
+            rows = conn.execute("SELECT path, size FROM artifacts WHERE path = ? OR owner = ?", (key, key)).fetchall()
+            freed = 0
+            for row in rows:
+                try:
+                    os.remove(row["path"])
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Could not delete {row['path']}: {e}")
+                    continue
+                conn.execute("DELETE FROM artifacts WHERE path = ?", (row["path"],))
+                freed += row["size"]
+            if not rows and os.path.exists(key):
+                # not indexed (e.g. written before the index existed)
+                freed = os.path.getsize(key)
+                os.remove(key)
+        return freed
+
+    def total_bytes(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+    def enforce_quota(self):
+        """Evicts least recently used artifacts until the index fits the quota; returns the bytes freed."""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+        return self._evict(excess)
+
+    def _evict(self, excess, kind=None, before=None):
+        """Removes unpinned top-level artifacts, oldest access first, until `excess` bytes are freed."""
+        cutoff = min(time.time() - self.grace_period, before if before is not None else float("inf"))
+        query = "SELECT path FROM artifacts WHERE pinned = 0 AND owner IS NULL AND last_access < ?"
+        params = [cutoff]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        query += " ORDER BY last_access LIMIT ?"
+
+        freed = evicted = 0
+        attempted = set()
+        while freed < excess:
+            with self._connect() as conn:
+                rows = conn.execute(query, (*params, EVICT_BATCH)).fetchall()
+            # files that could not be deleted stay in the index: do not retry them in this pass
+            rows = [row for row in rows if row["path"] not in attempted]
+            if not rows:
+                if excess != float("inf"):
+                    logger.warning(
+                        f"Storage over quota by {excess - freed} bytes: remaining artifacts are pinned or in use"
+                    )
+                break
+            for row in rows:
+                attempted.add(row["path"])
+                freed += self.remove(row["path"])
+                evicted += 1
+                if freed >= excess:
+                    break
+        if evicted:
+            logger.info(f"Evicted {evicted} artifacts ({freed} bytes)")
+        return freed
+
+    def expire(self, max_age, kind=TEMP):
+        """Removes unpinned artifacts of `kind` not accessed in `max_age` seconds; returns the bytes freed."""
+        return self._evict(float("inf"), kind=kind, before=time.time() - max_age)
+
+    def cleanup(self, temp_max_age=None):
+        """Periodic pass: expires old temporary artifacts, then enforces the quota."""
+        freed = self.expire(temp_max_age) if temp_max_age is not None else 0
+        return freed + self.enforce_quota()
+
+    def adopt_folder(self, folder, kind=GENERATED):
+        """
+        Indexes the files of `folder` (not recursive) that are not indexed yet, with their mtime as
+        last access. Meant for startup, so files written before the index existed fall under the quota.
+        """
+        if not os.path.isdir(folder):
+            return 0
+        adopted = 0
+        with self._connect() as conn:
+            for entry in os.scandir(folder):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO artifacts (path, size, kind, owner, pinned, created, last_access) "
+                    "VALUES (?, ?, ?, NULL, 0, ?, ?)",
+                    (self._key(entry.path), stat.st_size, kind, stat.st_mtime, stat.st_mtime),
+                )
+                adopted += cursor.rowcount
+        if adopted:
+            logger.info(f"Indexed {adopted} existing files from {folder}")
+            self.enforce_quota()
+        return adopted
+
+    @contextmanager
+    def temp_file(self, suffix=""):
+        """Yields a new path in the temp folder; the file is indexed once the block writes it."""
+        fd, path = tempfile.mkstemp(dir=self.temp_folder, suffix=suffix)
+        os.close(fd)
+        try:
+            yield path
+        except BaseException:
+            os.remove(path)
+            raise
+        self.register(path, kind=TEMP)
+
+
+_manager = None
+
+
+def set_storage_manager(manager):
+    """Sets the process-wide StorageManager used by `temp_artifact`."""
+    global _manager
+    _manager = manager
+
+
+def get_storage_manager():
+    """Returns the process-wide StorageManager, or None if none was set."""
+    return _manager
+
+
+@contextmanager
+def temp_artifact(suffix=""):
+    """
+    Yields a path for a temporary file: indexed by the process-wide StorageManager when one is
+    set, otherwise a plain file in the system temp dir that the caller owns.
+    """
+    if _manager is not None:
+        with _manager.temp_file(suffix) as path:
+            yield path
+        return
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+        path = f.name
+    yield path
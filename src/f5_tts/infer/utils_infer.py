@@ -1,34 +1,48 @@
 # A unified script for inference process
 # Make adjustments inside functions, and consider both gradio and cli scripts if need to change func output format
+import contextvars
 import os
 import sys
 
 sys.path.append(f"../../{os.path.dirname(os.path.abspath(__file__))}/third_party/BigVGAN/")
 
+import difflib
 import hashlib
+import json
+import logging
+import math
+import queue
 import re
+import struct
 import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
 from importlib.resources import files
 
 import matplotlib
-
-matplotlib.use("Agg")
-
-import matplotlib.pylab as plt
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchaudio
 import tqdm
 from pydub import AudioSegment, silence
-from transformers import pipeline
 from vocos import Vocos
 
+from f5_tts.infer.asr import get_asr_registry
+from f5_tts.infer.storage import temp_artifact
+from f5_tts.metrics import cache_event, record_rtf, stage, timed
+from f5_tts.profiling import profiled
 from f5_tts.model import CFM
 from f5_tts.model.utils import (
     get_tokenizer,
     convert_char_to_pinyin,
 )
 
+logger = logging.getLogger(__name__)
+
 _ref_audio_cache = {}
 
 device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
@@ -51,6 +65,10 @@ speed = 1.0
 fix_duration = None
 MIN_ADDITIONAL_SECONDS = 6.0  # duración mínima adicional en segundos
 min_additional_frames = int(MIN_ADDITIONAL_SECONDS * target_sample_rate / hop_length)
+trim_end_silence = True
+eos_silence_db = -40.0  # frames this far below the loudest frame count as silence
+eos_pad_duration = 0.1  # seconds kept after the detected end of speech
+mel_floor = math.log(1e-5)  # log-mel value of silence, used to pad mels for batched vocoding
 
 # -----------------------------------------
 
@@ -58,13 +76,15 @@ min_additional_frames = int(MIN_ADDITIONAL_SECONDS * target_sample_rate / hop_le
 # chunk text into smaller pieces
 
 
-def chunk_text(text, max_chars=135):
+def chunk_text(text, max_chars=135, first_chunk_max_chars=None):
     """
     Splits the input text into chunks, each with a maximum number of characters.
 
     Args:
         text (str): The text to be split.
         max_chars (int): The maximum number of characters per chunk.
+        first_chunk_max_chars (int): Optional smaller limit for the first chunk, e.g. a short lead
+            sentence so streaming can start early.
 
     Returns:
         List[str]: A list of text chunks.
@@ -75,7 +95,8 @@ def chunk_text(text, max_chars=135):
     sentences = re.split(r"(?<=[;:,.!?])\s+|(?<=[；：，。！？])", text)
 
     for sentence in sentences:
-        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= max_chars:
+        limit = first_chunk_max_chars if first_chunk_max_chars and not chunks else max_chars
+        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= limit:
             current_chunk += sentence + " " if sentence and len(sentence[-1].encode("utf-8")) == 1 else sentence
         else:
             if current_chunk:
@@ -116,25 +137,6 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
     return vocoder
 
 
-# load asr pipeline
-
-asr_pipe = None
-
-
-def initialize_asr_pipeline(device=device, dtype=None):
-    if dtype is None:
-        dtype = (
-            torch.float16 if device == "cuda" and torch.cuda.get_device_properties(device).major >= 6 else torch.float32
-        )
-    global asr_pipe
-    asr_pipe = pipeline(
-        "automatic-speech-recognition",
-        model="openai/whisper-large-v2",
-        torch_dtype=dtype,
-        device=device,
-    )
-
-
 # load model checkpoint for inference
 
 
@@ -216,6 +218,11 @@ def load_model(
 
     dtype = torch.float32 if mel_spec_type == "bigvgan" else None
     model = load_checkpoint(model, ckpt_path, device, dtype=dtype, use_ema=use_ema)
+    # identifies the weights in cache keys (see ChunkCache)
+    ckpt_stat = os.stat(ckpt_path)
+    model.checkpoint_id = hashlib.md5(
+        f"{os.path.abspath(ckpt_path)}:{ckpt_stat.st_size}:{ckpt_stat.st_mtime}:{vocab_file}:{use_ema}".encode()
+    ).hexdigest()
 
     return model
 
@@ -236,49 +243,96 @@ def remove_silence_edges(audio, silence_threshold=-42):
     return trimmed_audio
 
 
-# preprocess reference audio and text
+# detect end of speech on a generated mel
 
 
-def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
-    show_info("Converting audio...")
-    # Exportar el audio a un archivo WAV temporal
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
+def detect_mel_end_of_speech(mel, silence_db=eos_silence_db, pad_frames=0):
+    """
+    Finds where speech ends in a generated log-mel spectrogram.
+
+    Args:
+        mel (Tensor): Log-mel spectrogram of shape [n_mels, frames] or [1, n_mels, frames].
+        silence_db (float): Frames quieter than the loudest frame by more than this many dB are silence.
+        pad_frames (int): Number of frames kept after the last voiced frame.
+
+    Returns:
+        int: The number of leading frames to keep.
+    """
+    if mel.ndim == 3:
+        mel = mel[0]
+    num_frames = mel.shape[-1]
+    # log-magnitude mel -> per-frame level in dB
+    frame_db = 20 * torch.log10(mel.float().exp().mean(dim=0).clamp(min=1e-5))
+    voiced = torch.nonzero(frame_db > frame_db.max() + silence_db)
+    if voiced.numel() == 0:
+        return num_frames
+    return min(int(voiced[-1]) + 1 + pad_frames, num_frames)
 
-        if clip_short:
-            # 1. Intentar encontrar silencio largo para recortar
+
+# preprocess reference audio and text
+
+
+def clip_ref_audio(aseg, clip_short=True, show_info=print):
+    """Clips a reference AudioSegment to ~15 s at a silence and trims its edges."""
+    if clip_short:
+        # 1. Intentar encontrar silencio largo para recortar
+        non_silent_segs = silence.split_on_silence(
+            aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
+        )
+        non_silent_wave = AudioSegment.silent(duration=0)
+        for non_silent_seg in non_silent_segs:
+            if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
+                show_info("Audio is over 15s, clipping short. (1)")
+                break
+            non_silent_wave += non_silent_seg
+
+        # 2. Si el audio aún es muy largo, intentar con silencios cortos
+        if len(non_silent_wave) > 15000:
             non_silent_segs = silence.split_on_silence(
-                aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
+                aseg, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
             )
             non_silent_wave = AudioSegment.silent(duration=0)
             for non_silent_seg in non_silent_segs:
                 if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                    show_info("Audio is over 15s, clipping short. (1)")
+                    show_info("Audio is over 15s, clipping short. (2)")
                     break
                 non_silent_wave += non_silent_seg
 
-            # 2. Si el audio aún es muy largo, intentar con silencios cortos
-            if len(non_silent_wave) > 15000:
-                non_silent_segs = silence.split_on_silence(
-                    aseg, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
-                )
-                non_silent_wave = AudioSegment.silent(duration=0)
-                for non_silent_seg in non_silent_segs:
-                    if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                        show_info("Audio is over 15s, clipping short. (2)")
-                        break
-                    non_silent_wave += non_silent_seg
-
-            # 3. Si no se encuentra un silencio adecuado, recortar a 15s
-            if len(non_silent_wave) > 15000:
-                aseg = non_silent_wave[:15000]
-                show_info("Audio is over 15s, clipping short. (3)")
-            else:
-                aseg = non_silent_wave
+        # 3. Si no se encuentra un silencio adecuado, recortar a 15s
+        if len(non_silent_wave) > 15000:
+            aseg = non_silent_wave[:15000]
+            show_info("Audio is over 15s, clipping short. (3)")
+        else:
+            aseg = non_silent_wave
+
+    return remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
+
+
+def transcribe_ref_audio(ref_audio, language=None):
+    """Transcribes a reference file (canonical audio is written to a temporary WAV for the ASR)."""
+    if not is_canonical_audio(ref_audio):
+        return get_asr_registry().transcribe(ref_audio, language=language)
+    audio, sr = load_ref_audio(ref_audio)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        torchaudio.save(f.name, audio, sr)
+    try:
+        return get_asr_registry().transcribe(f.name, language=language)
+    finally:
+        os.remove(f.name)
+
 
-        aseg = remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
-        aseg.export(f.name, format="wav")
-        temp_audio_path = f.name
+def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
+    if is_canonical_audio(ref_audio_orig):
+        # decoded, clipped and trimmed at ingest: nothing to convert
+        temp_audio_path = ref_audio_orig
+        if not ref_text.strip():
+            ref_text = read_canonical_metadata(ref_audio_orig).get("ref_text", "")
+    else:
+        show_info("Converting audio...")
+        # Exportar el audio a un archivo WAV temporal (bajo la cuota del almacenamiento, si hay)
+        with stage("ref_decode"), temp_artifact(".wav") as temp_audio_path:
+            aseg = clip_ref_audio(AudioSegment.from_file(ref_audio_orig), clip_short, show_info)
+            aseg.export(temp_audio_path, format="wav")
 
     # Calcular hash del audio exportado
     with open(temp_audio_path, "rb") as audio_file:
@@ -296,21 +350,13 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_in
         _ref_audio_cache[audio_hash] = final_ref_text
     else:
         # Si no se proporciona texto, se revisa la caché o se transcribe el audio
+        cache_event("ref_text", audio_hash in _ref_audio_cache)
         if audio_hash in _ref_audio_cache:
             show_info("Using cached reference text...")
             final_ref_text = _ref_audio_cache[audio_hash]
         else:
             show_info("No reference text provided, transcribing reference audio...")
-            global asr_pipe
-            if asr_pipe is None:
-                initialize_asr_pipeline(device=device)
-            transcribed = asr_pipe(
-                temp_audio_path,
-                chunk_length_s=30,
-                batch_size=128,
-                generate_kwargs={"task": "transcribe"},
-                return_timestamps=False,
-            )["text"].strip()
+            transcribed = transcribe_ref_audio(temp_audio_path)
             show_info("Finished transcription")
             final_ref_text = transcribed
             _ref_audio_cache[audio_hash] = final_ref_text
@@ -325,6 +371,163 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_in
     return temp_audio_path, final_ref_text
 
 
+# canonical reference audio: decoded once at ingest, memory-mapped afterwards
+
+
+def is_canonical_audio(path):
+    return isinstance(path, str) and path.endswith(".npy")
+
+
+def canonical_metadata_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def read_canonical_metadata(path):
+    try:
+        with open(canonical_metadata_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_canonical_metadata(path, **fields):
+    """Updates the metadata stored next to a canonical audio file."""
+    metadata = {**read_canonical_metadata(path), **fields}
+    tmp_path = canonical_metadata_path(path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, canonical_metadata_path(path))
+    return metadata
+
+
+def canonicalize_ref_audio(ref_audio_orig, output_path, ref_text="", clip_short=True, show_info=print):
+    """
+    Decodes a reference upload once into the canonical form every later request reads.
+
+    The audio is decoded (ffmpeg, through pydub), clipped and trimmed as in
+    preprocess_ref_audio_text, downmixed and resampled to mono float32 at target_sample_rate,
+    and saved as .npy next to a .json with its metadata.
+
+    Args:
+        ref_audio_orig (str): Uploaded file, any format ffmpeg reads.
+        output_path (str): Path of the canonical audio (".npy" is appended if missing).
+        ref_text (str): Transcript, if known; stored in the metadata.
+
+    Returns:
+        str: Path of the canonical audio.
+    """
+    if not is_canonical_audio(output_path):
+        output_path += ".npy"
+    aseg = clip_ref_audio(AudioSegment.from_file(ref_audio_orig), clip_short, show_info)
+    samples = np.array(aseg.get_array_of_samples(), dtype=np.float32) / (1 << (8 * aseg.sample_width - 1))
+    audio = torch.from_numpy(samples.reshape(-1, aseg.channels).T.copy())
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    if aseg.frame_rate != target_sample_rate:
+        audio = torchaudio.transforms.Resample(aseg.frame_rate, target_sample_rate)(audio)
+
+    tmp_path = output_path + ".tmp.npy"
+    np.save(tmp_path, audio[0].numpy().astype(np.float32))
+    os.replace(tmp_path, output_path)
+    write_canonical_metadata(
+        output_path,
+        source=ref_audio_orig,
+        sample_rate=target_sample_rate,
+        duration=audio.shape[-1] / target_sample_rate,
+        ref_text=ref_text.strip(),
+    )
+    return output_path
+
+
+@timed("file_io")
+def load_ref_audio(path):
+    """Returns (waveform [1, samples], sample_rate); canonical audio is read through a memory map."""
+    if is_canonical_audio(path):
+        audio = np.load(path, mmap_mode="r")
+        return torch.from_numpy(np.array(audio, dtype=np.float32)).unsqueeze(0), target_sample_rate
+    return torchaudio.load(path)
+
+
+# compact a long reference into a shorter voice prompt
+
+
+def compact_ref_audio_text(
+    ref_audio_orig,
+    words,
+    target_duration=6.5,
+    min_duration=5.0,
+    max_duration=8.0,
+    min_pause=0.15,
+    output_path=None,
+):
+    """
+    Picks the best contiguous sub-span of a reference recording to use as voice prompt.
+
+    Every chunk is sampled as reference frames + generated frames, so a shorter prompt makes
+    every chunk cheaper. Candidate spans start and end on pauses between words, so cuts land in
+    silence; among those, spans closest to `target_duration` that end on punctuation and sit
+    between long pauses win.
+
+    Args:
+        ref_audio_orig (str): Path of the reference audio.
+        words (List[dict]): Word timestamps with "text", "start" and "end" (seconds).
+        target_duration (float): Preferred prompt length in seconds.
+        min_duration (float): Shortest acceptable prompt length in seconds.
+        max_duration (float): Longest acceptable prompt length in seconds.
+        min_pause (float): Minimum gap between words, in seconds, to cut there.
+        output_path (str): Where to write the compacted audio; defaults to "<ref>_prompt.wav".
+
+    Returns:
+        Tuple[str, str]: Path of the compacted audio and its transcript, or (None, None) if no
+        span fits.
+    """
+    words = [w for w in words if w["text"].strip()]
+    if not words:
+        return None, None
+
+    aseg = AudioSegment.from_file(ref_audio_orig)
+    total = len(aseg) / 1000
+
+    gap_before = [words[0]["start"]] + [words[i]["start"] - words[i - 1]["end"] for i in range(1, len(words))]
+    gap_after = gap_before[1:] + [total - words[-1]["end"]]
+    starts = [i for i in range(len(words)) if i == 0 or gap_before[i] >= min_pause]
+    ends = [j for j in range(len(words)) if j == len(words) - 1 or gap_after[j] >= min_pause]
+
+    best, best_cost = None, None
+    for i in starts:
+        for j in ends:
+            if j < i:
+                continue
+            span = words[j]["end"] - words[i]["start"]
+            if span < min_duration:
+                continue
+            if span > max_duration:
+                break
+            cost = abs(span - target_duration)
+            cost -= min(gap_before[i], 0.5) + min(gap_after[j], 0.5)  # prefer cutting in long pauses
+            if not re.search(r"[.!?;:,。！？；：，]$", words[j]["text"].strip()):
+                cost += 1.0  # avoid ending the prompt mid-sentence
+            if best_cost is None or cost < best_cost:
+                best, best_cost = (i, j), cost
+
+    if best is None:
+        return None, None
+
+    i, j = best
+    # cut in the middle of the surrounding pauses, keeping at most 0.2s of silence on each side
+    cut_start = max(words[i]["start"] - min(gap_before[i] / 2, 0.2), 0)
+    cut_end = min(words[j]["end"] + min(gap_after[j] / 2, 0.2), total)
+    prompt = aseg[int(cut_start * 1000) : int(cut_end * 1000)]
+
+    if output_path is None:
+        output_path = f"{os.path.splitext(ref_audio_orig)[0]}_prompt.wav"
+    prompt.export(output_path, format="wav")
+
+    prompt_text = " ".join(w["text"].strip() for w in words[i : j + 1])
+    logger.info(f"Compacted reference {total:.2f}s -> {len(prompt) / 1000:.2f}s: {prompt_text}")
+    return output_path, prompt_text
+
+
 # infer process: chunk text -> infer batches [i.e. infer_batch_process()]
 
 
@@ -344,10 +547,21 @@ def infer_process(
     sway_sampling_coef=sway_sampling_coef,
     speed=speed,
     fix_duration=fix_duration,
+    trim_end_silence=trim_end_silence,
+    eos_silence_db=eos_silence_db,
+    eos_pad_duration=eos_pad_duration,
+    rolling_context=False,
+    context_duration=3.0,
+    anchor_refresh_every=4,
+    pipeline=True,
+    vocoder_threads=None,
+    seed=None,
+    chunk_cache=None,
+    return_spectrogram=True,
     device=device,
 ):
     # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
+    audio, sr = load_ref_audio(ref_audio)
     max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
     gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
     for i, gen_text in enumerate(gen_text_batches):
@@ -369,136 +583,1510 @@ def infer_process(
         sway_sampling_coef=sway_sampling_coef,
         speed=speed,
         fix_duration=fix_duration,
+        trim_end_silence=trim_end_silence,
+        eos_silence_db=eos_silence_db,
+        eos_pad_duration=eos_pad_duration,
+        rolling_context=rolling_context,
+        context_duration=context_duration,
+        anchor_refresh_every=anchor_refresh_every,
+        pipeline=pipeline,
+        vocoder_threads=vocoder_threads,
+        seed=seed,
+        chunk_cache=chunk_cache,
+        return_spectrogram=return_spectrogram,
         device=device,
     )
 
 
-# infer batches
+# long-form prompting: condition on the tail of the previous chunk
 
-def infer_batch_process(
-    ref_audio,
+
+def rolling_context_prompt(prev_mel, prev_text, context_frames, silence_db=eos_silence_db):
+    """
+    Builds a short prompt from the end of the previously generated chunk.
+
+    The mel tail is cut at the quietest frame near the point where the trailing words of
+    `prev_text` should start, assuming speech is spread evenly over the characters.
+
+    Args:
+        prev_mel (Tensor): Generated mel of the previous chunk, shape [1, frames, n_mels].
+        prev_text (str): Text of the previous chunk.
+        context_frames (int): Approximate prompt length in frames.
+        silence_db (float): Threshold used to drop the silent tail before cutting.
+
+    Returns:
+        Tuple[Tensor, str]: Prompt mel of shape [1, frames, n_mels] and its text.
+    """
+    num_frames = detect_mel_end_of_speech(prev_mel.permute(0, 2, 1), silence_db=silence_db)
+    mel = prev_mel[:, :num_frames, :]
+    words = prev_text.split()
+    if num_frames <= context_frames or len(words) < 2:
+        text = prev_text.strip()
+    else:
+        # take trailing words until they cover roughly the context share of the chunk
+        share = context_frames / num_frames
+        total_chars = len(" ".join(words))
+        n_words = 1
+        while n_words < len(words) and len(" ".join(words[-n_words:])) < share * total_chars:
+            n_words += 1
+        text = " ".join(words[-n_words:])
+        cut = num_frames - int(num_frames * len(text) / total_chars)
+        # snap the cut to the quietest frame nearby, likely the pause before the first kept word
+        lo, hi = max(cut - 8, 1), min(cut + 8, num_frames - 1)
+        frame_energy = mel[0, lo:hi, :].exp().mean(dim=-1)
+        cut = lo + int(torch.argmin(frame_energy))
+        mel = mel[:, cut:, :]
+    if len(text[-1].encode("utf-8")) == 1:
+        text = text + " "
+    return mel, text
+
+
+# prepare reference audio for sampling
+
+
+def prepare_ref_audio(ref_audio, target_rms=target_rms, device=device):
+    """
+    Downmixes, loudness-normalizes and resamples a reference waveform.
+
+    Args:
+        ref_audio (Tuple[Tensor, int]): Waveform [channels, samples] and its sample rate.
+        target_rms (float): RMS the reference is raised to if quieter.
+
+    Returns:
+        Tuple[Tensor, Tensor]: Waveform [1, samples] at target_sample_rate on `device`, and its original RMS.
+    """
+    audio, sr = ref_audio
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+    return audio.to(device), rms
+
+
+class VoicePrompt:
+    """
+    A reference ready for sampling: normalized waveform, its mel spectrogram and transcript.
+
+    Pass it as `ref_audio` to infer_batch_process and friends to skip all reference preprocessing.
+    """
+
+    def __init__(self, audio, rms, mel, ref_text):
+        self.audio = audio  # [1, samples] at target_sample_rate
+        self.rms = rms
+        self.mel = mel  # [1, frames, n_mels]
+        self.ref_text = ref_text
+        self._hash = None
+
+    @property
+    def duration(self):
+        return self.audio.shape[-1] / target_sample_rate
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = voice_prompt_hash(self.audio, self.ref_text)
+        return self._hash
+
+    def save(self, path):
+        """Writes the prepared tensors, so another process can skip preprocessing (see load)."""
+        tmp_path = path + ".tmp"
+        torch.save(
+            {"audio": self.audio.cpu(), "rms": self.rms.cpu(), "mel": self.mel.cpu(), "ref_text": self.ref_text},
+            tmp_path,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, device=device):
+        state = torch.load(path, map_location=device, weights_only=True)
+        return cls(state["audio"], state["rms"], state["mel"], state["ref_text"])
+
+
+def voice_prompt_hash(audio, ref_text):
+    """Content hash of a prepared reference waveform and its transcript."""
+    h = hashlib.sha256(audio.detach().to("cpu", torch.float32).numpy().tobytes())
+    h.update(ref_text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_voice_prompt(ref_audio_orig, ref_text, model_obj, target_rms=target_rms, show_info=print, device=device):
+    """Runs preprocess_ref_audio_text on a reference file and precomputes its mel for model_obj."""
+    ref_file, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info, device=device)
+    audio, rms = prepare_ref_audio(load_ref_audio(ref_file), target_rms=target_rms, device=device)
+    with torch.inference_mode():
+        mel = model_obj.mel_spec(audio).permute(0, 2, 1)
+    return VoicePrompt(audio, rms, mel, ref_text)
+
+
+class VoicePromptCache:
+    """
+    Thread-safe LRU of VoicePrompt objects keyed by voice ID.
+
+    Args:
+        max_size (int): Prompts kept before the least recently used one is evicted.
+    """
+
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self._prompts = {}  # insertion order is recency order
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, voice_id, load=None):
+        """Returns the prompt for `voice_id`, calling `load()` to build it on a miss (None if no loader)."""
+        with self._lock:
+            prompt = self._prompts.pop(voice_id, None)
+            if prompt is not None:
+                self._prompts[voice_id] = prompt
+                self.hits += 1
+                cache_event("voice_prompt", True)
+                return prompt
+            self.misses += 1
+        cache_event("voice_prompt", False)
+        if load is None:
+            return None
+        prompt = load()
+        self.put(voice_id, prompt)
+        return prompt
+
+    def put(self, voice_id, prompt):
+        with self._lock:
+            self._prompts.pop(voice_id, None)
+            self._prompts[voice_id] = prompt
+            while len(self._prompts) > self.max_size:
+                del self._prompts[next(iter(self._prompts))]
+
+    def discard(self, voice_id):
+        with self._lock:
+            self._prompts.pop(voice_id, None)
+
+
+# sample chunks: run the ODE sampler for one text batch at a time
+
+
+def sample_chunks(
+    audio,
     ref_text,
     gen_text_batches,
     model_obj,
-    vocoder,
-    mel_spec_type="vocos",
     progress=tqdm,
-    target_rms=0.1,
-    cross_fade_duration=0.15,
     nfe_step=32,
     cfg_strength=2.0,
     sway_sampling_coef=-1,
     speed=1,
     fix_duration=None,
-    device=None,
+    trim_end_silence=True,
+    eos_silence_db=-40.0,
+    eos_pad_duration=0.1,
+    rolling_context=False,
+    context_duration=3.0,
+    anchor_refresh_every=4,
+    seed=None,
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
+    """
+    Samples the mel spectrogram of each text batch, yielding each as soon as it is done.
 
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    Args:
+        audio (Tensor): Reference waveform as returned by prepare_ref_audio, or its mel [1, frames, n_mels].
 
-    generated_waves = []
-    spectrograms = []
+    Yields:
+        Tensor: float32 mel spectrogram [1, n_mels, frames] of the generated part.
+    """
+    eos_pad_frames = int(eos_pad_duration * target_sample_rate / hop_length)
+    trimmed_frames = 0
 
     if len(ref_text[-1].encode("utf-8")) == 1:
         ref_text = ref_text + " "
+    ref_audio_len = audio.shape[1] if audio.ndim == 3 else audio.shape[-1] // hop_length
+    ref_text_len = len(ref_text.encode("utf-8"))
+    # Evitar división por cero (aunque ref_text no debería estar vacío aquí)
+    frames_per_byte = ref_text_len > 0 and (ref_audio_len / ref_text_len) or 1
+    context_frames = int(context_duration * target_sample_rate / hop_length)
+    prev_mel, prev_text = None, None
+
     for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
+        # Pick the prompt: the original reference, or in long-form mode the tail of the previous chunk
+        refresh_anchor = anchor_refresh_every > 0 and i % anchor_refresh_every == 0
+        if rolling_context and prev_mel is not None and not refresh_anchor:
+            cond, cond_text = rolling_context_prompt(prev_mel, prev_text, context_frames, silence_db=eos_silence_db)
+            cond_audio_len = cond.shape[1]
+        else:
+            cond, cond_text, cond_audio_len = audio, ref_text, ref_audio_len
+
         # Prepare the text
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
+        text_list = [cond_text + gen_text]
+        with stage("tokenize"):
+            final_text_list = convert_char_to_pinyin(text_list)
 
-        ref_audio_len = audio.shape[-1] // hop_length
         if fix_duration is not None:
-            duration = int(fix_duration * target_sample_rate / hop_length)
+            duration = cond_audio_len + max(int(fix_duration * target_sample_rate / hop_length) - ref_audio_len, 1)
         else:
-            ref_text_len = len(ref_text.encode("utf-8"))
             gen_text_len = len(gen_text.encode("utf-8"))
-            # Evitar división por cero (aunque ref_text no debería estar vacío aquí)
-            ratio = ref_text_len > 0 and (ref_audio_len / ref_text_len) or 1
-            additional_duration = int(ratio * gen_text_len / speed)
+            additional_duration = int(frames_per_byte * gen_text_len / speed)
             # Forzar un mínimo de duración adicional
             additional_duration = max(additional_duration, min_additional_frames)
-            duration = ref_audio_len + additional_duration
+            duration = cond_audio_len + additional_duration
         # inference
         with torch.inference_mode():
             generated, _ = model_obj.sample(
-                cond=audio,
+                cond=cond,
                 text=final_text_list,
                 duration=duration,
                 steps=nfe_step,
                 cfg_strength=cfg_strength,
                 sway_sampling_coef=sway_sampling_coef,
+                seed=seed,
             )
 
             generated = generated.to(torch.float32)
-            generated = generated[:, ref_audio_len:, :]
+            generated = generated[:, cond_audio_len:, :]
+            if rolling_context:
+                prev_mel, prev_text = generated, gen_text
             generated_mel_spec = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated_mel_spec)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated_mel_spec)
-            if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
+            if trim_end_silence:
+                # drop the silent tail of the padded duration estimate before vocoding it
+                keep_frames = detect_mel_end_of_speech(
+                    generated_mel_spec, silence_db=eos_silence_db, pad_frames=eos_pad_frames
+                )
+                trimmed_frames += generated_mel_spec.shape[-1] - keep_frames
+                generated_mel_spec = generated_mel_spec[:, :, :keep_frames]
+
+        yield generated_mel_spec
+
+    if trimmed_frames > 0:
+        logger.info(
+            f"End-of-speech trim removed {trimmed_frames} frames "
+            f"({trimmed_frames * hop_length / target_sample_rate:.2f}s) before vocoding"
+        )
+
+
+# vocode a mel spectrogram
+
+
+def vocode(vocoder, mel, mel_spec_type=mel_spec_type):
+    """Decodes a mel spectrogram [b, n_mels, frames] to a waveform [b, samples]."""
+    with stage("vocoder"):
+        return _vocode(vocoder, mel, mel_spec_type)
+
+
+def _vocode(vocoder, mel, mel_spec_type):
+    if isinstance(vocoder, VocoderBatcher):
+        return vocoder.decode(mel)
+    with torch.inference_mode():
+        if mel_spec_type == "vocos":
+            return vocoder.decode(mel)
+        elif mel_spec_type == "bigvgan":
+            return vocoder(mel).squeeze(1)
+        raise ValueError(f"Unknown mel_spec_type: {mel_spec_type}")
+
+
+def vocode_batch(vocoder, mels, mel_spec_type=mel_spec_type):
+    """
+    Decodes several mel spectrograms of different lengths in one vocoder call.
+
+    The mels are right-padded with the log-mel floor (silence), decoded together and the
+    waveforms sliced back to the length each mel gives when decoded alone.
+
+    Args:
+        vocoder: Vocoder returned by load_vocoder.
+        mels (List[Tensor]): Mel spectrograms [n_mels, frames] or [1, n_mels, frames].
+        mel_spec_type (str): "vocos" or "bigvgan".
+
+    Returns:
+        List[Tensor]: One waveform [samples] per mel.
+    """
+    mels = [mel[0] if mel.ndim == 3 else mel for mel in mels]
+    lens = [mel.shape[-1] for mel in mels]
+    max_len = max(lens)
+    padded = torch.full((len(mels), mels[0].shape[0], max_len), mel_floor, device=mels[0].device, dtype=mels[0].dtype)
+    for i, mel in enumerate(mels):
+        padded[i, :, : lens[i]] = mel
+    waves = vocode(vocoder, padded, mel_spec_type)
+    # output length grows by hop_length per frame, whatever the vocoder's edge handling
+    return [waves[i, : waves.shape[-1] - (max_len - n) * hop_length] for i, n in enumerate(lens)]
+
+
+class VocoderBatcher:
+    """
+    Thread-safe vocoder front-end that merges concurrent decode calls into batched ones.
+
+    Calls arriving within `max_wait` seconds of each other (up to `max_batch_size` mels) are
+    padded into a single vocoder call by a worker thread. Pass it wherever a vocoder is expected.
+
+    Args:
+        vocoder: Vocoder returned by load_vocoder.
+        mel_spec_type (str): "vocos" or "bigvgan".
+        max_batch_size (int): Most mels decoded in one call.
+        max_wait (float): Seconds to wait for more calls before decoding.
+    """
+
+    def __init__(self, vocoder, mel_spec_type=mel_spec_type, max_batch_size=8, max_wait=0.005):
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        """Decode calls waiting for the worker (queue depth)."""
+        return self._requests.qsize()
+
+    def decode(self, mel):
+        """Decodes a mel [b, n_mels, frames] to a waveform [b, samples], batched with concurrent calls."""
+        future = Future()
+        self._requests.put((mel, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while sum(mel.shape[0] for mel, _ in batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                waves = vocode_batch(self.vocoder, [row for mel, _ in batch for row in mel], self.mel_spec_type)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            i = 0
+            for mel, future in batch:
+                future.set_result(torch.stack(waves[i : i + mel.shape[0]]))
+                i += mel.shape[0]
+
+
+class StreamingVocoder:
+    """
+    Decodes a mel spectrogram in fixed-size windows so audio comes out incrementally.
+
+    For Vocos, each window runs the backbone with `context_frames` of extra mel on both sides
+    (its receptive field is 27 frames), and the ISTFT frames are overlap-added into a running
+    buffer. Samples are emitted once no later frame can touch them, so the concatenated output
+    matches vocoder.decode up to float rounding. Vocoders without an ISTFT head (BigVGAN) decode
+    each window with the same context and keep the samples of its own frames.
+
+    Args:
+        vocoder: Vocoder returned by load_vocoder.
+        mel_spec_type (str): "vocos" or "bigvgan".
+        block_frames (int): Mel frames per window. Smaller windows give earlier audio at the cost of
+            more calls and more recomputed context.
+        context_frames (int): Extra mel frames decoded on each side of a window.
+    """
+
+    def __init__(self, vocoder, mel_spec_type=mel_spec_type, block_frames=64, context_frames=32):
+        if isinstance(vocoder, VocoderBatcher):
+            vocoder = vocoder.vocoder
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.block_frames = block_frames
+        self.context_frames = context_frames
+
+    def decode(self, mel):
+        """Decodes a whole mel [b, n_mels, frames] through the windowed path, returning [b, samples]."""
+        return torch.cat(list(self.decode_stream(mel)), dim=-1)
+
+    def decode_stream(self, mel):
+        """Yields waveform blocks [b, samples] for a mel spectrogram [b, n_mels, frames]."""
+        head = getattr(self.vocoder, "head", None)
+        istft = getattr(head, "istft", None)
+        with torch.inference_mode():
+            if self.mel_spec_type == "vocos" and istft is not None and istft.win_length == istft.n_fft:
+                yield from self._decode_stream_istft(mel, head, istft)
+            else:
+                yield from self._decode_stream_windowed(mel)
+
+    def _windows(self, num_frames):
+        for start in range(0, num_frames, self.block_frames):
+            end = min(start + self.block_frames, num_frames)
+            yield start, end, max(start - self.context_frames, 0), min(end + self.context_frames, num_frames)
+
+    def _decode_stream_istft(self, mel, head, istft):
+        batch, _, num_frames = mel.shape
+        n_fft, hop, window = istft.n_fft, istft.hop_length, istft.window
+        pad = n_fft // 2 if istft.padding == "center" else (istft.win_length - hop) // 2
+        output_size = (num_frames - 1) * hop + n_fft
+        audio = torch.zeros(batch, output_size, device=mel.device)
+        envelope = torch.zeros(output_size, device=mel.device)
+        emitted = pad
+
+        for start, end, lo, hi in self._windows(num_frames):
+            x = self.vocoder.backbone(mel[:, :, lo:hi])[:, start - lo : end - lo]
+            # ISTFTHead, frame by frame
+            x = head.out(x).transpose(1, 2)
+            mag, p = x.chunk(2, dim=1)
+            mag = torch.clip(torch.exp(mag), max=1e2)
+            spec = mag * (torch.cos(p) + 1j * torch.sin(p))
+            frames = torch.fft.irfft(spec, n_fft, dim=1, norm="backward") * window[None, :, None]
+            # overlap-add this window's frames into the running buffer
+            n = end - start
+            length = (n - 1) * hop + n_fft
+            fold = dict(output_size=(1, length), kernel_size=(1, n_fft), stride=(1, hop))
+            offset = start * hop
+            audio[:, offset : offset + length] += F.fold(frames, **fold)[:, 0, 0]
+            window_sq = window.square().expand(1, n, -1).transpose(1, 2)
+            envelope[offset : offset + length] += F.fold(window_sq, **fold)[0, 0, 0]
+
+            # samples before the next frame's start are final
+            ready = end * hop if end < num_frames else output_size - pad
+            ready = min(ready, output_size - pad)
+            if ready > emitted:
+                yield audio[:, emitted:ready] / envelope[emitted:ready].clamp(min=1e-11)
+                emitted = ready
+
+    def _decode_stream_windowed(self, mel):
+        for start, end, lo, hi in self._windows(mel.shape[-1]):
+            wave = vocode(self.vocoder, mel[:, :, lo:hi], self.mel_spec_type)
+            yield wave[:, (start - lo) * hop_length : (end - lo) * hop_length]
+
+
+# run a generator one step ahead in a worker thread
+
+
+class _PrefetchError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+@contextmanager
+def cpu_threads(num_threads):
+    """
+    Sets the intra-op torch threads of the calling thread for the block, then restores them.
+
+    Only the calling thread is affected: each stage of a pipeline sets its own count.
+    Does nothing when `num_threads` is None.
+    """
+    if num_threads is None:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def prefetch(iterable, queue_size=1, num_threads=None):
+    """
+    Consumes `iterable` in a worker thread, keeping up to `queue_size` items ready.
+
+    Args:
+        iterable (Iterable): Items to produce, e.g. a sample_chunks generator.
+        queue_size (int): Bound of the hand-off queue; the worker blocks when it is full.
+        num_threads (int): Intra-op torch threads for the worker, if set.
+
+    Yields:
+        Items of `iterable`, in order. Exceptions raised by the worker are re-raised here.
+    """
+    items = queue.Queue(maxsize=queue_size)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            with cpu_threads(num_threads):
+                for item in iterable:
+                    if not put(item):
+                        return
+        except Exception as e:
+            put(_PrefetchError(e))
+        finally:
+            put(done)
+
+    # the worker runs in a copy of this context, so its stages land in the caller's trace
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, _PrefetchError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+
+
+# chunk result cache: generated audio keyed by everything that determines it
+
+
+def chunk_cache_key(gen_text, prompt_hash, checkpoint_id, **settings):
+    """
+    Content address of one generated chunk.
+
+    Args:
+        gen_text (str): Chunk text; whitespace is normalized.
+        prompt_hash (str): Hash of the voice prompt (see voice_prompt_hash).
+        checkpoint_id (str): Identifier of the model weights (set by load_model).
+        settings: Every other setting that changes the output (nfe_step, cfg_strength, seed, ...).
+    """
+    key = {"text": " ".join(gen_text.split()), "prompt": prompt_hash, "checkpoint": checkpoint_id, **settings}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ChunkCache:
+    """
+    On-disk cache of generated chunks (waveform and mel), bounded in size with LRU eviction.
+
+    Entries are .npz files named by their key; the access time of each file is its recency,
+    so several processes can share the same directory.
+
+    Args:
+        cache_dir (str): Directory of the entries.
+        max_bytes (int): Total size kept before the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # key -> [size, last access], scanned once; kept up to date by get/put
+        self._index = {}
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                self._index[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+        self._size = sum(size for size, _ in self._index.values())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """Returns (wave np.ndarray, mel Tensor [1, n_mels, frames]) or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                wave, mel = entry["wave"], torch.from_numpy(entry["mel"])
+            now = time.time()
+            os.utime(path, (now, now))
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            cache_event("chunk", False)
+            with self._lock:
+                self.misses += 1
+                entry = self._index.pop(key, None)
+                if entry is not None:
+                    self._size -= entry[0]
+            return None
+        cache_event("chunk", True)
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key][1] = now
+        return wave, mel
+
+    def put(self, key, wave, mel):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, wave=np.asarray(wave, dtype=np.float32), mel=mel.detach().to("cpu", torch.float32).numpy())
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._size -= old[0]
+            self._index[key] = [size, time.time()]
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            del self._index[key]
+            self._size -= size
+
+
+# infer chunks: sample and vocode one text batch at a time
+
+
+def infer_chunks(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type="vocos",
+    progress=tqdm,
+    target_rms=0.1,
+    nfe_step=32,
+    cfg_strength=2.0,
+    sway_sampling_coef=-1,
+    speed=1,
+    fix_duration=None,
+    trim_end_silence=True,
+    eos_silence_db=-40.0,
+    eos_pad_duration=0.1,
+    rolling_context=False,
+    context_duration=3.0,
+    anchor_refresh_every=4,
+    vocoder_block_frames=None,
+    pipeline=True,
+    vocoder_threads=None,
+    vocoder_batch_size=1,
+    seed=None,
+    chunk_cache=None,
+    device=None,
+):
+    """
+    Generates the text batches one by one, yielding each as soon as it is vocoded.
+
+    With `vocoder_batch_size` > 1, that many chunks are vocoded together in one padded call
+    (see vocode_batch) before they are yielded.
+
+    With `pipeline` (and more than one batch), sampling runs in a worker thread one chunk
+    ahead of vocoding, so the vocoder cost of chunk i hides behind sampling chunk i+1.
+    `vocoder_threads` sets the CPU intra-op threads left to the vocoding stage.
+
+    With `vocoder_block_frames`, each chunk's waveform is instead an iterator of blocks decoded
+    by StreamingVocoder, so audio is available before the whole chunk is vocoded.
+
+    `ref_audio` is a (waveform, sample_rate) tuple, or a VoicePrompt whose mel is used as is.
+
+    With a `chunk_cache` and a `seed`, each batch is first looked up in the cache (see
+    chunk_cache_key) and only the misses are sampled; generated chunks are added to it.
+    Rolling-context generation is not cached, as each chunk depends on the previous one.
+
+    Yields:
+        Tuple[np.ndarray | Iterator[np.ndarray], Tensor]: The chunk waveform (or its blocks) and its
+        mel spectrogram [1, n_mels, frames].
+    """
+    if isinstance(ref_audio, VoicePrompt):
+        audio, rms = ref_audio.mel, ref_audio.rms
+    else:
+        audio, rms = prepare_ref_audio(ref_audio, target_rms=target_rms, device=device)
+    gain = rms / target_rms if rms < target_rms else 1.0
+    streaming_vocoder = (
+        StreamingVocoder(vocoder, mel_spec_type, block_frames=vocoder_block_frames) if vocoder_block_frames else None
+    )
+
+    # Look every batch up in the chunk cache; only the misses are generated
+    keys = [None] * len(gen_text_batches)
+    cached = {}
+    checkpoint_id = getattr(model_obj, "checkpoint_id", None)
+    if chunk_cache is not None and seed is not None and checkpoint_id is not None and not rolling_context:
+        prompt_hash = ref_audio.hash if isinstance(ref_audio, VoicePrompt) else voice_prompt_hash(audio, ref_text)
+        for i, gen_text in enumerate(gen_text_batches):
+            keys[i] = chunk_cache_key(
+                gen_text,
+                prompt_hash,
+                checkpoint_id,
+                ref_text=ref_text,
+                mel_spec_type=mel_spec_type,
+                target_rms=target_rms,
+                nfe_step=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+                speed=speed,
+                fix_duration=fix_duration,
+                trim_end_silence=trim_end_silence,
+                eos_silence_db=eos_silence_db,
+                eos_pad_duration=eos_pad_duration,
+                seed=seed,
+            )
+            hit = chunk_cache.get(keys[i])
+            if hit is not None:
+                cached[i] = hit
+        if cached:
+            logger.info(f"Chunk cache: {len(cached)}/{len(gen_text_batches)} chunks reused")
+    missing = [i for i in range(len(gen_text_batches)) if i not in cached]
+
+    mels = sample_chunks(
+        audio,
+        ref_text,
+        [gen_text_batches[i] for i in missing],
+        model_obj,
+        progress=progress,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        fix_duration=fix_duration,
+        trim_end_silence=trim_end_silence,
+        eos_silence_db=eos_silence_db,
+        eos_pad_duration=eos_pad_duration,
+        rolling_context=rolling_context,
+        context_duration=context_duration,
+        anchor_refresh_every=anchor_refresh_every,
+        seed=seed,
+    )
+
+    # Two-stage pipeline: sampling of chunk i+1 runs in a worker while this thread vocodes chunk i.
+    # On CPU the intra-op threads are split between the two stages, each set in its own thread.
+    # A VocoderBatcher vocodes on its own thread, so there is nothing to split.
+    pipelined = pipeline and len(missing) > 1
+    sampling_threads = vocoding_threads = None
+    if pipelined:
+        total_threads = torch.get_num_threads()
+        if audio.device.type == "cpu" and total_threads > 1 and not isinstance(vocoder, VocoderBatcher):
+            vocoding_threads = vocoder_threads or max(total_threads // 4, 1)
+            sampling_threads = max(total_threads - vocoding_threads, 1)
+        mels = prefetch(mels, num_threads=sampling_threads)
+
+    def decode(pending):
+        with cpu_threads(vocoding_threads):
+            if len(pending) > 1:
+                waves = vocode_batch(vocoder, pending, mel_spec_type)
+            else:
+                waves = [vocode(vocoder, pending[0], mel_spec_type)[0]]
+        # wav -> numpy
+        return [(wave * gain).cpu().numpy() for wave in waves]
+
+    def generate():
+        pending = []
+        for generated_mel_spec in mels:
+            if streaming_vocoder is not None:
+                blocks = streaming_vocoder.decode_stream(generated_mel_spec)
+                yield (float(gain) * block.squeeze(0).cpu().numpy() for block in blocks), generated_mel_spec
+                continue
+
+            pending.append(generated_mel_spec)
+            if len(pending) < vocoder_batch_size:
+                continue
+            yield from zip(decode(pending), pending)
+            pending = []
+        if pending:
+            yield from zip(decode(pending), pending)
+
+    def store(key, blocks, mel):
+        # pass the blocks through, caching the whole chunk once it is complete
+        collected = []
+        for block in blocks:
+            collected.append(block)
+            yield block
+        chunk_cache.put(key, np.concatenate(collected), mel)
+
+    try:
+        generated = generate()
+        for i in range(len(gen_text_batches)):
+            if i in cached:
+                yield cached[i]
+                continue
+            generated_wave, generated_mel_spec = next(generated)
+            if keys[i] is not None:
+                if isinstance(generated_wave, np.ndarray):
+                    chunk_cache.put(keys[i], generated_wave, generated_mel_spec)
+                else:
+                    generated_wave = store(keys[i], generated_wave, generated_mel_spec)
+            yield generated_wave, generated_mel_spec
+    finally:
+        mels.close()
+
+
+# cross-fade consecutive chunks
+
+
+def cross_fade_stream(chunks, cross_fade_duration=cross_fade_duration, sample_rate=target_sample_rate):
+    """
+    Joins chunks with linear cross-fades, yielding audio as soon as it is final.
+
+    The last `cross_fade_duration` seconds of each chunk are held back until the next chunk
+    starts, so every yielded block is ready to play.
+
+    Args:
+        chunks (Iterable): Consecutive waveforms (np.ndarray), or iterables of waveform blocks.
+        cross_fade_duration (float): Overlap between consecutive chunks, in seconds.
+        sample_rate (int): Sample rate of the chunks.
+
+    Yields:
+        np.ndarray: float32 audio blocks.
+    """
+    cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+
+    def fade(prev_tail, wave):
+        # Calculate cross-fade samples, ensuring it does not exceed wave lengths
+        overlap = min(len(prev_tail), len(wave))
+        if overlap <= 0:
+            return np.concatenate([prev_tail, wave])
+        fade_out = np.linspace(1, 0, overlap)
+        fade_in = np.linspace(0, 1, overlap)
+        cross_faded_overlap = prev_tail[len(prev_tail) - overlap :] * fade_out + wave[:overlap] * fade_in
+        return np.concatenate([prev_tail[: len(prev_tail) - overlap], cross_faded_overlap, wave[overlap:]])
+
+    tail = None
+    for chunk in chunks:
+        blocks = [chunk] if isinstance(chunk, np.ndarray) else chunk
+        pending = tail  # end of the previous chunk, waiting for this chunk's head
+        wave = np.zeros(0, dtype=np.float32)
+        for block in blocks:
+            wave = np.concatenate([wave, block])
+            if pending is not None:
+                if len(wave) < len(pending):
+                    continue
+                wave = fade(pending, wave)
+                pending = None
+            if len(wave) > cross_fade_samples:
+                yield wave[: len(wave) - cross_fade_samples].astype(np.float32)
+                wave = wave[len(wave) - cross_fade_samples :]
+        if pending is not None:
+            wave = fade(pending, wave)
+        hold = min(cross_fade_samples, len(wave))
+        if len(wave) > hold:
+            yield wave[: len(wave) - hold].astype(np.float32)
+        tail = wave[len(wave) - hold :]
+    if tail is not None and len(tail) > 0:
+        yield tail.astype(np.float32)
+
+
+# infer batches
+
+@profiled("infer_batch_process")
+def infer_batch_process(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type="vocos",
+    progress=tqdm,
+    target_rms=0.1,
+    cross_fade_duration=0.15,
+    nfe_step=32,
+    cfg_strength=2.0,
+    sway_sampling_coef=-1,
+    speed=1,
+    fix_duration=None,
+    trim_end_silence=True,
+    eos_silence_db=-40.0,
+    eos_pad_duration=0.1,
+    rolling_context=False,
+    context_duration=3.0,
+    anchor_refresh_every=4,
+    pipeline=True,
+    vocoder_threads=None,
+    vocoder_batch_size=None,
+    seed=None,
+    chunk_cache=None,
+    return_spectrogram=True,
+    device=None,
+):
+    # Without the pipeline nothing overlaps with vocoding, so decode every chunk in one batched call
+    if vocoder_batch_size is None:
+        vocoder_batch_size = 1 if pipeline and len(gen_text_batches) > 1 else len(gen_text_batches)
 
-            # wav -> numpy
-            generated_wave = generated_wave.squeeze().cpu().numpy()
+    generated_waves = []
+    spectrograms = []
+    start = time.perf_counter()
 
-            generated_waves.append(generated_wave)
+    for generated_wave, generated_mel_spec in infer_chunks(
+        ref_audio,
+        ref_text,
+        gen_text_batches,
+        model_obj,
+        vocoder,
+        mel_spec_type=mel_spec_type,
+        progress=progress,
+        target_rms=target_rms,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        fix_duration=fix_duration,
+        trim_end_silence=trim_end_silence,
+        eos_silence_db=eos_silence_db,
+        eos_pad_duration=eos_pad_duration,
+        rolling_context=rolling_context,
+        context_duration=context_duration,
+        anchor_refresh_every=anchor_refresh_every,
+        pipeline=pipeline,
+        vocoder_threads=vocoder_threads,
+        vocoder_batch_size=vocoder_batch_size,
+        seed=seed,
+        chunk_cache=chunk_cache,
+        device=device,
+    ):
+        generated_waves.append(generated_wave)
+        if return_spectrogram:
             spectrograms.append(generated_mel_spec[0].cpu().numpy())
 
     # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
+    with stage("crossfade"):
+        final_wave = np.concatenate(list(cross_fade_stream(generated_waves, cross_fade_duration)))
+    record_rtf(len(final_wave) / target_sample_rate, time.perf_counter() - start)
+
+    # Create a combined spectrogram (None unless requested: rendering is left to callers that need it)
+    combined_spectrogram = np.concatenate(spectrograms, axis=1) if return_spectrogram else None
+
+    return final_wave, target_sample_rate, combined_spectrogram
+
+
+# streaming: yield audio blocks as each chunk finishes
+
+
+def infer_batch_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    cross_fade_duration=0.15,
+    vocoder_block_frames=None,
+    **kwargs,
+):
+    """
+    Streaming counterpart of infer_batch_process: yields float32 audio blocks as chunks finish.
+
+    Chunk boundaries are cross-faded incrementally, so the concatenated blocks equal the
+    waveform infer_batch_process returns. With `vocoder_block_frames`, each chunk is also
+    vocoded window by window (see StreamingVocoder) and its audio is yielded while the rest
+    of the chunk is still being decoded. Other keyword arguments are passed to infer_chunks.
+
+    Yields:
+        np.ndarray: float32 audio blocks at target_sample_rate.
+    """
+    waves = (
+        generated_wave
+        for generated_wave, _ in infer_chunks(
+            ref_audio,
+            ref_text,
+            gen_text_batches,
+            model_obj,
+            vocoder,
+            vocoder_block_frames=vocoder_block_frames,
+            **kwargs,
+        )
+    )
+    yield from cross_fade_stream(waves, cross_fade_duration)
+
+
+def infer_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model_obj,
+    vocoder,
+    show_info=print,
+    lead_max_chars=40,
+    cross_fade_duration=cross_fade_duration,
+    **kwargs,
+):
+    """
+    Streaming counterpart of infer_process.
+
+    The first batch is capped at `lead_max_chars` (a short lead sentence), so the first
+    audio block is ready after sampling only a few words. Other keyword arguments are passed
+    to infer_chunks.
+
+    Yields:
+        np.ndarray: float32 audio blocks at target_sample_rate.
+    """
+    audio, sr = load_ref_audio(ref_audio)
+    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    gen_text_batches = chunk_text(gen_text, max_chars=max_chars, first_chunk_max_chars=lead_max_chars)
+    for i, gen_text in enumerate(gen_text_batches):
+        print(f"gen_text {i}", gen_text)
+
+    show_info(f"Streaming audio in {len(gen_text_batches)} batches...")
+    yield from infer_batch_process_stream(
+        (audio, sr),
+        ref_text,
+        gen_text_batches,
+        model_obj,
+        vocoder,
+        cross_fade_duration=cross_fade_duration,
+        **kwargs,
+    )
+
+
+# batched sampling: chunks of several segments (and voices) in one CFM.sample call
+
+
+def sample_rows(
+    rows,
+    model_obj,
+    nfe_step=32,
+    cfg_strength=2.0,
+    sway_sampling_coef=-1,
+    speed=1,
+    fix_duration=None,
+    trim_end_silence=True,
+    eos_silence_db=-40.0,
+    eos_pad_duration=0.1,
+    seed=None,
+):
+    """
+    Samples several chunks in one batched CFM.sample call.
+
+    Each row has its own prompt: prompt mels are right-padded to the longest one and `lens`
+    tells the sampler how many frames of each row are conditioning.
+
+    Args:
+        rows (List[Tuple[VoicePrompt, str]]): Prompt and text of each chunk.
+
+    Returns:
+        List[Tensor]: float32 mel spectrogram [1, n_mels, frames] of the generated part of each row.
+    """
+    eos_pad_frames = int(eos_pad_duration * target_sample_rate / hop_length)
+    conds, texts, lens, durations = [], [], [], []
+    for prompt, gen_text in rows:
+        ref_text = prompt.ref_text
+        if len(ref_text[-1].encode("utf-8")) == 1:
+            ref_text = ref_text + " "
+        ref_audio_len = prompt.mel.shape[1]
+        if fix_duration is not None:
+            additional_duration = max(int(fix_duration * target_sample_rate / hop_length) - ref_audio_len, 1)
+        else:
+            frames_per_byte = ref_audio_len / len(ref_text.encode("utf-8"))
+            additional_duration = int(frames_per_byte * len(gen_text.encode("utf-8")) / speed)
+            additional_duration = max(additional_duration, min_additional_frames)
+        conds.append(prompt.mel[0])
+        texts.append(ref_text + gen_text)
+        lens.append(ref_audio_len)
+        durations.append(ref_audio_len + additional_duration)
+
+    cond = torch.nn.utils.rnn.pad_sequence(conds, batch_first=True)
+    with stage("tokenize"):
+        texts = convert_char_to_pinyin(texts)
+    with torch.inference_mode():
+        generated, _ = model_obj.sample(
+            cond=cond,
+            text=texts,
+            duration=torch.tensor(durations, device=cond.device, dtype=torch.long),
+            lens=torch.tensor(lens, device=cond.device, dtype=torch.long),
+            steps=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            seed=seed,
+        )
+        generated = generated.to(torch.float32)
+
+        mels = []
+        for i in range(len(rows)):
+            mel = generated[i : i + 1, lens[i] : durations[i], :].permute(0, 2, 1)
+            if trim_end_silence:
+                keep_frames = detect_mel_end_of_speech(mel, silence_db=eos_silence_db, pad_frames=eos_pad_frames)
+                mel = mel[:, :, :keep_frames]
+            mels.append(mel)
+    return mels
+
+
+def chunk_text_for_prompt(gen_text, prompt):
+    """Splits `gen_text` into chunks that, with the prompt, stay under ~25 s of audio."""
+    max_chars = int(len(prompt.ref_text.encode("utf-8")) / prompt.duration * (25 - prompt.duration))
+    return chunk_text(gen_text, max_chars=max_chars)
+
+
+@profiled("infer_segments")
+def infer_segments(
+    segments,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    trim_end_silence=trim_end_silence,
+    eos_silence_db=eos_silence_db,
+    eos_pad_duration=eos_pad_duration,
+    batch_size=4,
+    seed=None,
+    chunk_cache=None,
+):
+    """
+    Generates a multi-voice script with chunks batched across segments.
+
+    Every segment is split into chunks; the chunks are grouped by voice and sorted by length,
+    then sampled `batch_size` at a time (see sample_rows) and vocoded together. Chunks are
+    cross-faded within their segment and the segments returned in the original order.
+    With a `chunk_cache` and a `seed`, cached chunks are reused as in infer_chunks.
+
+    Args:
+        segments (List[Tuple[VoicePrompt, str]]): Prompt and text of each segment, in script order.
+
+    Returns:
+        List[np.ndarray]: float32 waveform of each segment at target_sample_rate.
+    """
+    start = time.perf_counter()
+    rows = []  # (segment index, chunk index, prompt, text)
+    for i, (prompt, gen_text) in enumerate(segments):
+        for j, chunk in enumerate(chunk_text_for_prompt(gen_text, prompt)):
+            rows.append((i, j, prompt, chunk))
+
+    waves = {}
+    checkpoint_id = getattr(model_obj, "checkpoint_id", None)
+    if chunk_cache is not None and seed is not None and checkpoint_id is not None:
+        settings = dict(
+            mel_spec_type=mel_spec_type,
+            target_rms=target_rms,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            trim_end_silence=trim_end_silence,
+            eos_silence_db=eos_silence_db,
+            eos_pad_duration=eos_pad_duration,
+            seed=seed,
+        )
+        keys = {
+            (i, j): chunk_cache_key(chunk, prompt.hash, checkpoint_id, ref_text=prompt.ref_text, **settings)
+            for i, j, prompt, chunk in rows
+        }
+        for key, cache_key in keys.items():
+            hit = chunk_cache.get(cache_key)
+            if hit is not None:
+                waves[key] = hit[0]
+        rows = [row for row in rows if (row[0], row[1]) not in waves]
     else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
+        keys = {}
+    rows.sort(key=lambda row: (id(row[2]), len(row[3].encode("utf-8"))))
+
+    batches = []
+    for row in rows:
+        if batches and len(batches[-1]) < batch_size and batches[-1][0][2] is row[2]:
+            batches[-1].append(row)
+        else:
+            batches.append([row])
+    show_info(
+        f"Generating {len(rows)} chunks of {len(segments)} segments in {len(batches)} batches "
+        f"({len(waves)} chunks cached)..."
+    )
+
+    for batch in batches:
+        mels = sample_rows(
+            [(prompt, chunk) for _, _, prompt, chunk in batch],
+            model_obj,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            trim_end_silence=trim_end_silence,
+            eos_silence_db=eos_silence_db,
+            eos_pad_duration=eos_pad_duration,
+            seed=seed,
+        )
+        for (i, j, prompt, _), wave, mel in zip(batch, vocode_batch(vocoder, mels, mel_spec_type), mels):
+            gain = prompt.rms / target_rms if prompt.rms < target_rms else 1.0
+            waves[i, j] = (wave * gain).cpu().numpy()
+            if (i, j) in keys:
+                chunk_cache.put(keys[i, j], waves[i, j], mel)
+
+    generated_waves = []
+    with stage("crossfade"):
+        for i in range(len(segments)):
+            chunks = [waves[key] for key in sorted(key for key in waves if key[0] == i)]
+            blocks = list(cross_fade_stream(chunks, cross_fade_duration))
+            generated_waves.append(np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32))
+    record_rtf(sum(len(wave) for wave in generated_waves) / target_sample_rate, time.perf_counter() - start)
+    return generated_waves
+
+
+@timed("crossfade")
+def assemble_chunks(waves, segment_ids, cross_fade_duration=cross_fade_duration, sample_rate=target_sample_rate):
+    """
+    Joins chunk waveforms into one script: cross-faded within a segment, concatenated between segments.
 
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
+    Gives the same audio as infer_segments followed by concatenation, and reports where
+    each chunk landed, so a later edit can rebuild the script from stored chunks.
 
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
+    Args:
+        waves (List[np.ndarray]): Chunk waveforms in script order.
+        segment_ids (List[int]): Segment of each chunk.
+
+    Returns:
+        Tuple[np.ndarray, List[Tuple[int, int]]]: float32 audio and the (start, end) sample span of each
+        chunk (consecutive spans of a segment overlap by the cross-fade).
+    """
+    cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+    waves = [np.asarray(wave, dtype=np.float32) for wave in waves]
+    spans, overlaps, total = [], [], 0
+    for i, wave in enumerate(waves):
+        overlap = 0
+        if i > 0 and segment_ids[i] == segment_ids[i - 1]:
+            overlap = min(cross_fade_samples, len(waves[i - 1]), len(wave))
+        spans.append((total - overlap, total - overlap + len(wave)))
+        overlaps.append(overlap)
+        total += len(wave) - overlap
+
+    audio = np.zeros(total, dtype=np.float32)
+    for wave, (start, end), overlap in zip(waves, spans, overlaps):
+        if overlap > 0:
+            fade_out = np.linspace(1, 0, overlap)
+            fade_in = np.linspace(0, 1, overlap)
+            audio[start : start + overlap] = audio[start : start + overlap] * fade_out + wave[:overlap] * fade_in
+        audio[start + overlap : end] = wave[overlap:]
+    return audio, spans
+
+
+# word timing: align the known text of a generated chunk to its audio
+
+
+def word_timings(wave, text, sample_rate=target_sample_rate, silence_db=-40.0, snap_duration=0.1):
+    """
+    Estimates when each word of a generated chunk is spoken, from its text and frame energy.
+
+    The speech between the first and last voiced frame is shared among the words in
+    proportion to their length (punctuation adds a pause). Each boundary is then moved to the
+    quietest frame within `snap_duration`, where the gap between words usually falls, and
+    the silence on both sides of each word is trimmed. Costs a few milliseconds per chunk.
+
+    Args:
+        wave (np.ndarray): Chunk waveform.
+        text (str): Text the chunk was generated from.
+        silence_db (float): Frames this far below the loudest frame count as silence.
+
+    Returns:
+        List[Tuple[str, float, float]]: (word, start, end) in seconds from the start of `wave`.
+    """
+    words = text.split()
+    if not words:
+        return []
+    wave = np.asarray(wave, dtype=np.float32)
+    n_frames = max(-(-len(wave) // hop_length), 1)
+    frames = np.pad(wave, (0, n_frames * hop_length - len(wave))).reshape(n_frames, hop_length)
+    energy = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    threshold = energy.max() + silence_db
+    voiced = np.flatnonzero(energy > threshold)
+    first, last = (int(voiced[0]), int(voiced[-1]) + 1) if len(voiced) else (0, n_frames)
+
+    weights = [len(word.encode("utf-8")) + 1 + (3 if word[-1] in ",;:.!?" else 0) for word in words]
+    edges = first + (last - first) * np.cumsum(weights) / sum(weights)
+    snap = max(int(snap_duration * sample_rate / hop_length), 1)
+    bounds = [first]
+    for i, edge in enumerate(edges[:-1]):
+        # leave at least one frame for each remaining word
+        lo = max(int(edge) - snap, bounds[-1] + 1)
+        hi = min(int(edge) + snap + 1, last - (len(words) - 1 - i) + 1)
+        bounds.append(lo + int(np.argmin(energy[lo:hi])) if hi > lo else min(bounds[-1] + 1, last))
+    bounds.append(last)
+
+    seconds_per_frame = hop_length / sample_rate
+    timings = []
+    for word, start, end in zip(words, bounds[:-1], bounds[1:]):
+        while end > start + 1 and energy[end - 1] <= threshold:
+            end -= 1
+        while start < end - 1 and energy[start] <= threshold:
+            start += 1
+        timings.append((word, start * seconds_per_frame, end * seconds_per_frame))
+    return timings
+
+
+def script_word_timings(chunks, sample_rate=target_sample_rate):
+    """
+    Timing map of a whole script from its chunks (see word_timings).
 
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
+    Args:
+        chunks (Iterable[Tuple[np.ndarray, str, int]]): Waveform, text and start sample of each chunk
+            in the assembled audio (as returned by assemble_chunks).
 
-            # Combine
-            new_wave = np.concatenate(
-                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+    Returns:
+        List[dict]: {"word", "start_time", "end_time"} of every word, in seconds.
+    """
+    timings = []
+    for wave, text, start in chunks:
+        offset = start / sample_rate
+        for word, word_start, word_end in word_timings(wave, text, sample_rate):
+            timings.append(
+                {"word": word, "start_time": round(offset + word_start, 3), "end_time": round(offset + word_end, 3)}
             )
+    return timings
 
-            final_wave = new_wave
 
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
+# region editing: re-synthesize chosen time spans of an utterance in place
 
-    return final_wave, target_sample_rate, combined_spectrogram
+
+def edit_region_targets(origin_text, target_text, num_spans):
+    """
+    Pairs each edited span with the words it replaces and its new words.
+
+    The word-level diff of origin_text and target_text must have exactly one changed run
+    per span, in the same order as the spans.
+
+    Returns:
+        List[Tuple[str, str]]: (old words, new words) of each span.
+    """
+    origin_words, target_words = origin_text.split(), target_text.split()
+    matcher = difflib.SequenceMatcher(a=origin_words, b=target_words, autojunk=False)
+    changes = [
+        (" ".join(origin_words[i1:i2]), " ".join(target_words[j1:j2]))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+    if len(changes) != num_spans:
+        raise ValueError(
+            f"origin_text and target_text differ in {len(changes)} places but {num_spans} spans were given"
+        )
+    return changes
+
+
+def edit_regions(audio, origin_text, target_text, spans, model_obj, vocoder, **kwargs):
+    """
+    Replaces time spans of an utterance with new speech, keeping the rest of the audio.
+
+    Args:
+        audio (str | Tuple[Tensor | np.ndarray, int]): Audio file, or waveform and its sample rate.
+        origin_text (str): Transcript of `audio`.
+        target_text (str): Transcript after the edit.
+        spans (List[Tuple[float, float] | Tuple[float, float, float]]): (start, end) in seconds of each
+            region to replace, optionally with the duration of its new speech.
+
+    Returns:
+        np.ndarray: float32 edited waveform at target_sample_rate.
+
+    See edit_regions_batch for the other arguments.
+    """
+    return edit_regions_batch([(audio, origin_text, target_text, spans)], model_obj, vocoder, **kwargs)[0]
+
+
+@profiled("edit_regions_batch")
+def edit_regions_batch(
+    rows,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    target_rms=target_rms,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    sway_sampling_coef=sway_sampling_coef,
+    edge_fade_duration=0.02,
+    batch_size=4,
+    seed=None,
+    device=device,
+):
+    """
+    Edits several utterances, each with any number of regions, in batched CFM.sample calls.
+
+    Like speech_edit.py, every region is cut out of the utterance and filled with silence of
+    the new duration; the sampler regenerates the masked frames conditioned on the rest of the
+    utterance and the target text. Only the regenerated frames are taken from the vocoder
+    output: the kept audio is the original signal, cross-faded over `edge_fade_duration` at
+    each region boundary. Each utterance must fit the model's ~30 s window; edit a long
+    script one chunk at a time.
+
+    Args:
+        rows (List[Tuple[audio, str, str, spans]]): Arguments of edit_regions for each utterance.
+        edge_fade_duration (float): Cross-fade in seconds between kept and regenerated audio.
+        batch_size (int): Utterances sampled together.
+
+    Returns:
+        List[np.ndarray]: float32 edited waveform of each utterance at target_sample_rate.
+    """
+    edge_fade = int(edge_fade_duration * target_sample_rate)
+    prepared = []
+    for audio, origin_text, target_text, spans in rows:
+        if isinstance(audio, str):
+            audio = load_ref_audio(audio)
+        wave, sr = audio
+        wave = torch.as_tensor(wave, dtype=torch.float32)
+        if wave.ndim == 1:
+            wave = wave.unsqueeze(0)
+        wave, rms = prepare_ref_audio((wave, sr), target_rms=target_rms, device=device)
+        wave_seconds = wave.shape[-1] / target_sample_rate
+        seconds_per_byte = wave_seconds / max(len(origin_text.encode("utf-8")), 1)
+
+        # rebuild the timeline on the hop grid: kept audio, then silence where each region goes
+        pieces, mask, regions, offset = [], [], [], 0
+        spans = sorted(spans, key=lambda span: span[0])
+        for span, (old, new) in zip(spans, edit_region_targets(origin_text, target_text, len(spans))):
+            start, end = span[0], span[1]
+            if len(span) > 2 and span[2]:
+                new_seconds = span[2]
+            elif old:
+                new_seconds = (end - start) * len(new.encode("utf-8")) / len(old.encode("utf-8"))
+            else:
+                new_seconds = len(new.encode("utf-8")) * seconds_per_byte
+            start_frame = max(round(start * target_sample_rate / hop_length), offset)
+            end_frame = max(round(end * target_sample_rate / hop_length), start_frame)
+            new_frames = max(round(new_seconds * target_sample_rate / hop_length), 1)
+            pieces.append(wave[:, offset * hop_length : start_frame * hop_length])
+            pieces.append(torch.zeros(1, new_frames * hop_length, device=device))
+            kept = sum(piece.shape[-1] for piece in pieces[:-1])
+            regions.append((kept, kept + new_frames * hop_length))
+            mask += [True] * (start_frame - offset) + [False] * new_frames
+            offset = end_frame
+        pieces.append(wave[:, offset * hop_length :])
+        edited = torch.cat(pieces, dim=-1)
+        with torch.inference_mode():
+            mel = model_obj.mel_spec(edited).permute(0, 2, 1)
+        mask = (mask + [True] * mel.shape[1])[: mel.shape[1]]
+        prepared.append((edited, rms, mel[0], torch.tensor(mask, device=device), target_text, regions))
+
+    results = []
+    for i in range(0, len(prepared), batch_size):
+        batch = prepared[i : i + batch_size]
+        lens = [mel.shape[0] for _, _, mel, _, _, _ in batch]
+        cond = torch.nn.utils.rnn.pad_sequence([mel for _, _, mel, _, _, _ in batch], batch_first=True)
+        edit_mask = torch.nn.utils.rnn.pad_sequence(
+            [mask for _, _, _, mask, _, _ in batch], batch_first=True, padding_value=True
+        )
+        texts = [text + " " if len(text[-1].encode("utf-8")) == 1 else text for _, _, _, _, text, _ in batch]
+        with torch.inference_mode():
+            generated, _ = model_obj.sample(
+                cond=cond,
+                text=convert_char_to_pinyin(texts),
+                duration=torch.tensor(lens, device=cond.device, dtype=torch.long),
+                lens=torch.tensor(lens, device=cond.device, dtype=torch.long),
+                steps=nfe_step,
+                cfg_strength=cfg_strength,
+                sway_sampling_coef=sway_sampling_coef,
+                seed=seed,
+                edit_mask=edit_mask,
+            )
+            generated = generated.to(torch.float32)
+        mels = [generated[j, : lens[j], :].T for j in range(len(batch))]
+        for (edited, rms, _, _, _, regions), synthesized in zip(batch, vocode_batch(vocoder, mels, mel_spec_type)):
+            out = edited[0].clone()
+            synthesized = synthesized[: out.shape[-1]]
+            for start, end in regions:
+                lo, hi = max(start - edge_fade, 0), min(end + edge_fade, synthesized.shape[-1])
+                if hi <= lo:
+                    continue
+                weight = torch.ones(hi - lo, device=out.device)
+                weight[: start - lo] = torch.linspace(0, 1, start - lo, device=out.device)
+                weight[weight.shape[0] - (hi - min(end, hi)) :] = torch.linspace(
+                    1, 0, hi - min(end, hi), device=out.device
+                )
+                out[lo:hi] = out[lo:hi] * (1 - weight) + synthesized[lo:hi] * weight
+            if rms < target_rms:
+                out = out * rms / target_rms
+            results.append(out.cpu().numpy())
+    return results
 
 
 # remove silence from generated wav
 
 
+@timed("silence_removal")
 def remove_silence_for_generated_wav(filename):
     aseg = AudioSegment.from_file(filename)
     non_silent_segs = silence.split_on_silence(
@@ -514,9 +2102,42 @@ def remove_silence_for_generated_wav(filename):
 # save spectrogram
 
 
+def mel_spectrogram(wave, sample_rate, model_obj, device=device):
+    """Log-mel spectrogram [n_mels, frames] of a waveform, with the features of model_obj."""
+    audio = torch.as_tensor(np.asarray(wave, dtype=np.float32)).reshape(1, -1)
+    if sample_rate != target_sample_rate:
+        audio = torchaudio.functional.resample(audio, sample_rate, target_sample_rate)
+    with torch.inference_mode():
+        mel = model_obj.mel_spec(audio.to(device))
+    return mel[0].float().cpu().numpy()
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def spectrogram_png(spectrogram, height=400, cmap="viridis"):
+    """
+    Renders a spectrogram [bins, frames] as PNG bytes: low bins at the bottom, one pixel column
+    per frame, rows repeated up to `height`. A colormap lookup plus zlib, without a Matplotlib figure.
+    """
+    spectrogram = np.asarray(spectrogram, dtype=np.float32)
+    low, high = float(spectrogram.min()), float(spectrogram.max())
+    levels = np.clip((spectrogram - low) / max(high - low, 1e-8) * 255, 0, 255).astype(np.uint8)
+    lut = (matplotlib.colormaps[cmap](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+    rgb = lut[np.repeat(levels[::-1], max(height // levels.shape[0], 1), axis=0)]
+
+    rows, width = rgb.shape[:2]
+    # every scanline starts with filter type 0 (none)
+    raw = np.concatenate([np.zeros((rows, 1), dtype=np.uint8), rgb.reshape(rows, width * 3)], axis=1)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, rows, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
 def save_spectrogram(spectrogram, path):
-    plt.figure(figsize=(12, 4))
-    plt.imshow(spectrogram, origin="lower", aspect="auto")
-    plt.colorbar()
-    plt.savefig(path)
-    plt.close()
\ No newline at end of file
+    with open(path, "wb") as f:
+        f.write(spectrogram_png(spectrogram))
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Estados de una voz
+PROCESSING = "processing"
+READY = "ready"
+
+
+def file_hash(path):
+    """sha256 del contenido de un archivo."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class VoiceStore:
+    """
+    Registro de voces en SQLite, compartido por todos los procesos (workers de gunicorn).
+
+    - audios: cada grabación subida, una sola vez por contenido (sha256), con su audio canónico,
+      el prompt compactado y su transcripción.
+    - voices: cada tipo de habla apunta al audio de su prompt, su texto y su estado.
+    - prompts: tensores de prompt ya preparados, guardados en disco por clave.
+
+    Los archivos viven en `folder`, fuera de las carpetas que limpia cleanup_temp_files.
+    """
+
+    def __init__(self, path, folder):
+        self.path = path
+        self.folder = folder
+        os.makedirs(os.path.join(folder, "prompts"), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS audios (
+                    hash TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    canonical TEXT,
+                    duration REAL,
+                    prompt TEXT,
+                    prompt_text TEXT,
+                    created REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS voices (
+                    name TEXT PRIMARY KEY,
+                    audio_hash TEXT,
+                    audio TEXT NOT NULL,
+                    ref_text TEXT NOT NULL DEFAULT '',
+                    status TEXT NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS prompts (
+                    key TEXT PRIMARY KEY,
+                    audio_hash TEXT,
+                    path TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # Modo autocommit: cada sentencia es su propia transacción
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    # audios
+
+    def add_audio(self, upload_path, copy=False):
+        """
+        Guarda una grabación en el registro y devuelve su fila como dict. Si ya existía una con
+        el mismo contenido se reutiliza (con su audio canónico y prompt) y la subida se descarta.
+        """
+        audio_hash = file_hash(upload_path)
+        existing = self.get_audio(audio_hash)
+        if existing is not None and os.path.exists(existing["source"]):
+            logger.info(f"Audio {audio_hash[:12]} ya registrado, se reutiliza")
+            if not copy:
+                os.remove(upload_path)
+            return existing
+
+        source = os.path.join(self.folder, audio_hash + os.path.splitext(upload_path)[1].lower())
+        if copy:
+            shutil.copyfile(upload_path, source)
+        else:
+            os.replace(upload_path, source)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO audios (hash, source, created) VALUES (?, ?, ?)",
+                (audio_hash, source, time.time()),
+            )
+        return self.get_audio(audio_hash)
+
+    def update_audio(self, audio_hash, **fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE audios SET {columns} WHERE hash = ?", (*fields.values(), audio_hash))
+
+    def get_audio(self, audio_hash):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM audios WHERE hash = ?", (audio_hash,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def audio_path(self, audio_hash, suffix):
+        """Ruta de un archivo derivado de una grabación (p. ej. '.npy', '_prompt.wav')."""
+        return os.path.join(self.folder, audio_hash + suffix)
+
+    # voces
+
+    def set_voice(self, name, audio_hash, audio, ref_text="", status=READY):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO voices (name, audio_hash, audio, ref_text, status, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, audio_hash, audio, ref_text, status, time.time()),
+            )
+
+    def update_voice(self, name, audio_hash, **fields):
+        """Actualiza una voz solo si sigue apuntando a `audio_hash`; devuelve si se actualizó."""
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE voices SET {columns}, updated = ? WHERE name = ? AND audio_hash = ?",
+                (*fields.values(), time.time(), name, audio_hash),
+            )
+        return cursor.rowcount > 0
+
+    def get_voice(self, name):
+        """Devuelve la voz como dict ('audio', 'ref_text', 'status', 'audio_hash', ...) o None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT v.*, a.source AS source_audio FROM voices v LEFT JOIN audios a ON a.hash = v.audio_hash "
+                "WHERE v.name = ?",
+                (name,),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_voices(self):
+        with self._connect() as conn:
+            return [row["name"] for row in conn.execute("SELECT name FROM voices ORDER BY name")]
+
+    # prompts
+
+    def get_prompt(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT path FROM prompts WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(row["path"]):
+            return None
+        return row["path"]
+
+    def prompt_path(self, key):
+        return os.path.join(self.folder, "prompts", key + ".pt")
+
+    def put_prompt(self, key, path, audio_hash=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO prompts (key, audio_hash, path, created) VALUES (?, ?, ?, ?)",
+                (key, audio_hash, path, time.time()),
+            )
+
+    # migración
+
+    def import_speech_types(self, json_path):
+        """Importa un speech_types.json antiguo si el registro está vacío (los audios se copian)."""
+        if self.list_voices() or not os.path.exists(json_path):
+            return 0
+        with open(json_path, "r", encoding="utf-8") as f:
+            speech_types = json.load(f)
+        imported = 0
+        for name, entry in speech_types.items():
+            if not os.path.exists(entry.get("audio", "")):
+                logger.warning(f"Tipo de habla {name} sin audio ({entry.get('audio')}), no se importa")
+                continue
+            audio = self.add_audio(entry["audio"], copy=True)
+            self.set_voice(name, audio["hash"], audio["source"], entry.get("ref_text", ""), READY)
+            imported += 1
+        logger.info(f"Importados {imported} tipos de habla desde {json_path}")
+        return imported
@@ -0,0 +1,279 @@
+"""
+Lightweight instrumentation: stage timers, latency histograms, counters and per-request traces.
+
+Code marks its stages with `stage("vocoder")` (or `@timed("prosody")`); each stage feeds the
+`f5tts_stage_seconds` histogram and, when a trace is active in the current context, that trace.
+A trace (`start_trace` / `finish_trace`) aggregates the stages of one request or job and is
+logged as a single JSON line when it finishes.
+
+`registry.render()` returns every metric in the Prometheus text format. Metrics are kept per
+process: behind several gunicorn workers each one reports its own.
+
+Timings are wall-clock on the host. On CUDA, kernels run asynchronously, so a stage shows up
+where its results are first read back (the vocoder, or the copy to NumPy) rather than where it
+was launched.
+"""
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds, as Prometheus exposes them."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, **extra):
+    labels = {**dict(labels), **extra}
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms keyed by name and labels.
+
+    Gauges can also be callbacks, read when the metrics are rendered (e.g. queue depths).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._callbacks = {}
+        self._help = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def gauge_callback(self, name, fn, label=None):
+        """
+        Registers a gauge read at render time. `fn()` returns a number or, with `label`, a dict
+        from label value to number.
+        """
+        with self._lock:
+            self._callbacks[name] = (fn, label)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            callbacks = dict(self._callbacks)
+
+        for name, (fn, label) in callbacks.items():
+            try:
+                value = fn()
+            except Exception as e:
+                logger.warning(f"Gauge {name} failed: {e}")
+                continue
+            if label is None:
+                gauges[(name, ())] = value
+            else:
+                for label_value, v in value.items():
+                    gauges[(name, ((label, label_value),))] = v
+
+        # hit ratio of every cache, from its hit/miss counters
+        caches = {}
+        for (name, labels), value in counters.items():
+            if name == "f5tts_cache_requests_total":
+                labels = dict(labels)
+                caches.setdefault(labels["cache"], {})[labels["result"]] = value
+        for cache, results in caches.items():
+            total = results.get("hit", 0) + results.get("miss", 0)
+            gauges[("f5tts_cache_hit_ratio", (("cache", cache),))] = results.get("hit", 0) / total if total else 0.0
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("f5tts_stage_seconds", "Wall time of each processing stage.")
+registry.describe("f5tts_real_time_factor", "Synthesis time divided by the duration of the audio produced.")
+registry.describe("f5tts_cache_requests_total", "Cache lookups by cache and result.")
+registry.describe("f5tts_cache_hit_ratio", "Hits over lookups of each cache since the process started.")
+
+
+# traces
+
+
+class Trace:
+    """Stages (count and total seconds) and attributes of one request or job."""
+
+    def __init__(self, request_id, **attrs):
+        self.request_id = request_id
+        self.attrs = attrs
+        self.stages = {}
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add(self, name, value):
+        """Adds `value` to a numeric attribute (audio seconds, cache hits...)."""
+        with self._lock:
+            self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            attrs = dict(self.attrs)
+            if attrs.get("audio_seconds"):
+                attrs["rtf"] = round(attrs.get("synthesis_seconds", 0.0) / attrs["audio_seconds"], 4)
+            return {
+                "request_id": self.request_id,
+                **attrs,
+                "total_seconds": round(time.perf_counter() - self.start, 4),
+                "stages": {name: {"count": n, "seconds": round(s, 4)} for name, (n, s) in self.stages.items()},
+            }
+
+
+_current_trace = contextvars.ContextVar("f5tts_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def start_trace(request_id, **attrs):
+    """Starts a trace in the current context; returns the token to pass to finish_trace."""
+    return _current_trace.set(Trace(request_id, **attrs))
+
+
+def finish_trace(token, log=True, **attrs):
+    """Ends the trace started with `token`, logs it as one JSON line (if `log`) and returns it as a dict."""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    trace.attrs.update(attrs)
+    result = trace.to_dict()
+    if log:
+        logger.info("trace " + json.dumps(result, ensure_ascii=False, default=str))
+    return result
+
+
+@contextmanager
+def stage(name):
+    """Times a block as stage `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe("f5tts_stage_seconds", seconds, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+
+
+def timed(name):
+    """Decorator form of `stage`."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def cache_event(cache, hit):
+    """Counts a lookup in `cache` as a hit or a miss."""
+    result = "hit" if hit else "miss"
+    registry.inc("f5tts_cache_requests_total", cache=cache, result=result)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(f"{cache}_cache_{result}", 1)
+
+
+def record_rtf(audio_seconds, compute_seconds):
+    """Records the real-time factor of producing `audio_seconds` of audio in `compute_seconds`."""
+    if audio_seconds <= 0:
+        return
+    registry.observe("f5tts_real_time_factor", compute_seconds / audio_seconds, buckets=RTF_BUCKETS)
+    registry.inc("f5tts_audio_seconds_total", audio_seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("audio_seconds", audio_seconds)
+        trace.add("synthesis_seconds", compute_seconds)
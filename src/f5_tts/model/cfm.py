@@ -18,6 +18,8 @@ from torch import nn
 from torch.nn.utils.rnn import pad_sequence
 from torchdiffeq import odeint
 
+from f5_tts.metrics import stage, timed
+from f5_tts.profiling import profiled
 from f5_tts.model.modules import MelSpec
 from f5_tts.model.utils import (
     default,
@@ -79,6 +81,7 @@ class CFM(nn.Module):
         return next(self.parameters()).device
 
     @torch.no_grad()
+    @profiled("cfm_sample")
     def sample(
         self,
         cond: float["b n d"] | float["b nw"],  # noqa: F722
@@ -114,10 +117,11 @@ class CFM(nn.Module):
         # text
 
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            with stage("tokenize"):
+                if exists(self.vocab_char_map):
+                    text = list_str_to_idx(text, self.vocab_char_map).to(device)
+                else:
+                    text = list_str_to_tensor(text).to(device)
             assert text.shape[0] == batch
 
         if exists(text):
@@ -159,6 +163,7 @@ class CFM(nn.Module):
 
         # neural ode
 
+        @timed("ode_step")
         def fn(t, x):
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
@@ -197,7 +202,8 @@ class CFM(nn.Module):
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+        with stage("ode_sampling"):
+            trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
 
         sampled = trajectory[-1]
         out = sampled
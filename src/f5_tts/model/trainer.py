@@ -197,7 +197,13 @@ class Trainer:
 
     def train(self, train_dataset: Dataset, num_workers=16, resumable_with_seed: int = None):
         if self.log_samples:
-            from f5_tts.infer.utils_infer import cfg_strength, load_vocoder, nfe_step, sway_sampling_coef
+            from f5_tts.infer.utils_infer import (
+                cfg_strength,
+                load_vocoder,
+                nfe_step,
+                sway_sampling_coef,
+                vocode_batch,
+            )
 
             vocoder = load_vocoder(vocoder_name=self.vocoder_name)
             target_sample_rate = self.accelerator.unwrap_model(self.model).mel_spec.target_sample_rate
@@ -324,10 +330,7 @@ class Trainer:
                     self.save_checkpoint(global_step)
 
                     if self.log_samples and self.accelerator.is_local_main_process:
-                        ref_audio, ref_audio_len = vocoder.decode(batch["mel"][0].unsqueeze(0)), mel_lengths[0]
-                        torchaudio.save(
-                            f"{log_samples_path}/step_{global_step}_ref.wav", ref_audio.cpu(), target_sample_rate
-                        )
+                        ref_audio_len = mel_lengths[0]
                         with torch.inference_mode():
                             generated, _ = self.accelerator.unwrap_model(self.model).sample(
                                 cond=mel_spec[0][:ref_audio_len].unsqueeze(0),
@@ -338,11 +341,24 @@ class Trainer:
                                 sway_sampling_coef=sway_sampling_coef,
                             )
                         generated = generated.to(torch.float32)
-                        gen_audio = vocoder.decode(
-                            generated[:, ref_audio_len:, :].permute(0, 2, 1).to(self.accelerator.device)
+                        # decode reference and generated sample in one vocoder call
+                        ref_audio, gen_audio = vocode_batch(
+                            vocoder,
+                            [
+                                batch["mel"][0][:, :ref_audio_len].to(torch.float32),
+                                generated[0, ref_audio_len:, :].permute(1, 0).to(self.accelerator.device),
+                            ],
+                            mel_spec_type=self.vocoder_name,
+                        )
+                        torchaudio.save(
+                            f"{log_samples_path}/step_{global_step}_ref.wav",
+                            ref_audio.unsqueeze(0).cpu(),
+                            target_sample_rate,
                         )
                         torchaudio.save(
-                            f"{log_samples_path}/step_{global_step}_gen.wav", gen_audio.cpu(), target_sample_rate
+                            f"{log_samples_path}/step_{global_step}_gen.wav",
+                            gen_audio.unsqueeze(0).cpu(),
+                            target_sample_rate,
                         )
 
                 if global_step % self.last_per_steps == 0:
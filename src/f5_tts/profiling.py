@@ -0,0 +1,230 @@
+"""
+On-demand profiling of selected requests.
+
+A request is selected by the caller (`activate`, e.g. for an X-Profile header) or by arming the
+profiler for the next N requests (`arm`, shared by all processes through a counter file). While a
+selected request runs, every function decorated with `profiled` is captured with torch.profiler
+and a Python stack sampler, and written to the profile directory:
+
+- `<request>_<name>_<n>.trace.json`: Chrome trace of the torch ops (chrome://tracing, Perfetto).
+- `<request>_<name>_<n>.torch.folded`: torch op stacks in folded format (flamegraph.pl, speedscope).
+- `<request>_<name>_<n>.py.folded`: sampled Python stacks in folded format.
+
+Requests that are not selected only pay a context variable lookup per decorated call. Captures
+nest (the outermost one wins) and run one at a time per process, since torch.profiler is global.
+The directory is kept under `max_bytes` by deleting the oldest captures.
+"""
+
+import contextvars
+import fcntl
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+_profile_request = contextvars.ContextVar("f5tts_profile_request", default=None)
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of the threads running package code every `interval` seconds.
+
+    Stacks are aggregated in folded format: "thread;outer (file:line);...;inner (file:line) count".
+    """
+
+    def __init__(self, interval=0.005, package="f5_tts"):
+        self.interval = interval
+        self.package = os.sep + package + os.sep
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack, ours = [], False
+                while frame is not None:
+                    code = frame.f_code
+                    ours = ours or self.package in code.co_filename
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ours:
+                    stack.append(names.get(ident, str(ident)))
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Captures profiles of selected requests into a bounded directory.
+
+    Args:
+        directory (str): Where profiles are written; created if missing.
+        max_bytes (int): Size kept before the oldest profiles are deleted.
+        sample_interval (float): Seconds between Python stack samples.
+        record_shapes (bool): Record input shapes of torch ops.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024**2, sample_interval=0.005, record_shapes=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sample_interval = sample_interval
+        self.record_shapes = record_shapes
+        self._armed_path = os.path.join(directory, "armed")
+        self._lock = threading.Lock()
+        self._captures = Counter()
+        os.makedirs(directory, exist_ok=True)
+
+    # selection
+
+    def _update_armed(self, update):
+        # the file is rewritten, never deleted, under the lock: an update from another process
+        # cannot fall between the write and a removal. Disarmed, it is left empty.
+        with open(self._armed_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            text = f.read().strip()
+            count = int(text) if text else 0
+            new_count = update(count)
+            f.seek(0)
+            f.truncate()
+            if new_count > 0:
+                f.write(str(new_count))
+        return count
+
+    def arm(self, num_requests):
+        """Profiles the next `num_requests` requests that call `take_armed` (0 disarms)."""
+        self._update_armed(lambda count: max(num_requests, 0))
+
+    def armed(self):
+        try:
+            with open(self._armed_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def take_armed(self):
+        """Consumes one armed request; returns whether this request should be profiled."""
+        try:
+            if os.path.getsize(self._armed_path) == 0:  # the common case: one stat, no lock
+                return False
+        except FileNotFoundError:
+            return False
+        return self._update_armed(lambda count: max(count - 1, 0)) > 0
+
+    def activate(self, request_id):
+        """Selects the current context's request for profiling; returns a token for `deactivate`."""
+        return _profile_request.set(re.sub(r"[^A-Za-z0-9_.-]", "_", str(request_id))[:64])
+
+    def deactivate(self, token):
+        self._captures.pop(_profile_request.get(), None)
+        _profile_request.reset(token)
+
+    # capture
+
+    @contextmanager
+    def capture(self, name):
+        """Profiles the block if the current request is selected and no capture is running."""
+        request_id = _profile_request.get()
+        if request_id is None or not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            import torch
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._captures[request_id] += 1
+            prefix = os.path.join(self.directory, f"{request_id}_{name}_{self._captures[request_id]}")
+            sampler = StackSampler(self.sample_interval)
+            start = time.perf_counter()
+            with torch.profiler.profile(
+                activities=activities, record_shapes=self.record_shapes, with_stack=True
+            ) as prof:
+                sampler.start()
+                try:
+                    yield
+                finally:
+                    sampler.stop()
+            seconds = time.perf_counter() - start
+            prof.export_chrome_trace(prefix + ".trace.json")
+            prof.export_stacks(prefix + ".torch.folded", "self_cpu_time_total")
+            sampler.write_folded(prefix + ".py.folded")
+            logger.info(f"Profile of {name} ({seconds:.2f}s) for request {request_id} written to {prefix}.*")
+        finally:
+            self._lock.release()
+        self._prune()
+
+    def _prune(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name != "armed":
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def list_profiles(self):
+        with os.scandir(self.directory) as entries:
+            return sorted(entry.name for entry in entries if entry.is_file() and entry.name != "armed")
+
+
+_profiler = None
+
+
+def set_profiler(profiler):
+    """Sets the process-wide Profiler used by `profiled`."""
+    global _profiler
+    _profiler = profiler
+
+
+def get_profiler():
+    """Returns the process-wide Profiler, or None if none was set."""
+    return _profiler
+
+
+def profiled(name):
+    """Decorator: captures calls made while the current request is selected for profiling."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None or _profile_request.get() is None:
+                return fn(*args, **kwargs)
+            with _profiler.capture(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
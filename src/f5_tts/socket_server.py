@@ -1,20 +1,67 @@
-import socket
-import struct
-import torch
-import torchaudio
-from threading import Thread
+"""
+Streaming TTS server over TCP.
+
+Every message, in both directions, is a frame: a 9-byte header followed by a payload.
+
+    header = struct "!BII": message type (uint8), request id (uint32), payload length (uint32)
 
+Client -> server
+    MSG_REQUEST  JSON {"text": str, "voice": str | null, "format": "float32" | "int16", "params": {...}}
 
+Server -> client, for each request id
+    MSG_AUDIO    raw little-endian PCM samples at 24 kHz in the requested format
+    MSG_END      JSON {"samples": int, "sample_rate": int}
+    MSG_ERROR    JSON {"error": str}
+
+A connection may carry several requests at once; their frames interleave but never split.
+"""
+
+import asyncio
 import gc
+import json
+import struct
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import torch
 
-from infer.utils_infer import infer_batch_process, preprocess_ref_audio_text, load_vocoder, load_model
+from infer.utils_infer import (
+    VoicePromptCache,
+    chunk_text,
+    infer_batch_process,
+    infer_batch_process_stream,
+    load_model,
+    load_vocoder,
+    load_voice_prompt,
+)
 from model.backbones.dit import DiT
 
 
+HEADER = struct.Struct("!BII")
+MSG_REQUEST = 1
+MSG_AUDIO = 2
+MSG_END = 3
+MSG_ERROR = 4
+
+MAX_PAYLOAD = 1 << 20  # requests are small JSON documents
+AUDIO_FORMATS = ("float32", "int16")
+# generation parameters a client may set per request
+REQUEST_PARAMS = ("nfe_step", "cfg_strength", "sway_sampling_coef", "speed", "cross_fade_duration")
+
+
 class TTSStreamingProcessor:
-    def __init__(self, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32):
+    """
+    Holds the model, the vocoder and an LRU of preprocessed voice prompts.
+
+    Voices are registered by ID (`register_voice`); a request naming a cached voice goes
+    straight to sampling. The voice passed at construction is registered as "default".
+    """
+
+    def __init__(
+        self, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32, max_cached_voices=16
+    ):
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
         # Load the model using the provided checkpoint and vocab files
@@ -35,109 +82,260 @@ class TTSStreamingProcessor:
         # Set sampling rate for streaming
         self.sampling_rate = 24000  # Consistency with client
 
-        # Set reference audio and text
-        self.ref_audio = ref_audio
-        self.ref_text = ref_text
+        # Voice sources by ID, and their preprocessed prompts
+        self.voices = {}
+        self.prompts = VoicePromptCache(max_size=max_cached_voices)
+        self.register_voice("default", ref_audio, ref_text)
 
         # Warm up the model
         self._warm_up()
 
+    def register_voice(self, voice_id, ref_audio, ref_text=""):
+        """Registers (or replaces) a voice; it is preprocessed on first use."""
+        self.voices[voice_id] = (ref_audio, ref_text)
+        self.prompts.discard(voice_id)
+
+    def get_prompt(self, voice=None):
+        voice_id = voice or "default"
+        if voice_id not in self.voices:
+            raise ValueError(f"Unknown voice: {voice_id}")
+        ref_audio, ref_text = self.voices[voice_id]
+        return self.prompts.get(
+            voice_id, lambda: load_voice_prompt(ref_audio, ref_text, self.model, device=self.device)
+        )
+
     def _warm_up(self):
         """Warm up the model with a dummy input to ensure it's ready for real-time processing."""
         print("Warming up the model...")
-        ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
-        audio, sr = torchaudio.load(ref_audio)
+        prompt = self.get_prompt()
         gen_text = "Warm-up text for the model."
 
         # Pass the vocoder as an argument here
-        infer_batch_process((audio, sr), ref_text, [gen_text], self.model, self.vocoder, device=self.device)
+        infer_batch_process(prompt, prompt.ref_text, [gen_text], self.model, self.vocoder, device=self.device)
         print("Warm-up completed.")
 
-    def generate_stream(self, text, play_steps_in_s=0.5):
-        """Generate audio in chunks and yield them in real-time."""
-        # Preprocess the reference audio and text
-        ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
-
-        # Load reference audio
-        audio, sr = torchaudio.load(ref_audio)
+    def generate_stream(self, text, voice=None, **params):
+        """Generate audio for `text` and yield float32 blocks as each chunk finishes."""
+        prompt = self.get_prompt(voice)
+        ref_text = prompt.ref_text
 
-        # Run inference for the input text
-        audio_chunk, final_sample_rate, _ = infer_batch_process(
-            (audio, sr),
+        max_chars = int(len(ref_text.encode("utf-8")) / prompt.duration * (25 - prompt.duration))
+        yield from infer_batch_process_stream(
+            prompt,
             ref_text,
-            [text],
+            chunk_text(text, max_chars=max_chars, first_chunk_max_chars=40),
             self.model,
             self.vocoder,
-            device=self.device,  # Pass vocoder here
+            device=self.device,
+            **params,
         )
 
-        # Break the generated audio into chunks and send them
-        chunk_size = int(final_sample_rate * play_steps_in_s)
 
-        for i in range(0, len(audio_chunk), chunk_size):
-            chunk = audio_chunk[i : i + chunk_size]
+# framing
 
-            # Check if it's the final chunk
-            if i + chunk_size >= len(audio_chunk):
-                chunk = audio_chunk[i:]
 
-            # Avoid sending empty or repeated chunks
-            if len(chunk) == 0:
-                break
+class FrameTooLarge(ValueError):
+    """A frame header announced a payload over the reader's limit; its body was not read."""
 
-            # Pack and send the audio chunk
-            packed_audio = struct.pack(f"{len(chunk)}f", *chunk)
-            yield packed_audio
+    def __init__(self, request_id, length):
+        super().__init__(f"payload of {length} bytes exceeds the limit")
+        self.request_id = request_id
 
-        # Ensure that no final word is repeated by not resending partial chunks
-        if len(audio_chunk) % chunk_size != 0:
-            remaining_chunk = audio_chunk[-(len(audio_chunk) % chunk_size) :]
-            packed_audio = struct.pack(f"{len(remaining_chunk)}f", *remaining_chunk)
-            yield packed_audio
 
+async def read_frame(reader, max_length=None):
+    """
+    Reads one frame; returns (msg_type, request_id, payload), or None when the peer closed.
 
-def handle_client(client_socket, processor):
+    Raises FrameTooLarge, before reading the body, if the payload is longer than `max_length`.
+    """
     try:
-        while True:
-            # Receive data from the client
-            data = client_socket.recv(1024).decode("utf-8")
-            if not data:
-                break
-
-            try:
-                # The client sends the text input
-                text = data.strip()
-
-                # Generate and stream audio chunks
-                for audio_chunk in processor.generate_stream(text):
-                    client_socket.sendall(audio_chunk)
-
-                # Send end-of-audio signal
-                client_socket.sendall(b"END_OF_AUDIO")
-
-            except Exception as inner_e:
-                print(f"Error during processing: {inner_e}")
-                traceback.print_exc()  # Print the full traceback to diagnose the issue
-                break
-
-    except Exception as e:
-        print(f"Error handling client: {e}")
-        traceback.print_exc()
-    finally:
-        client_socket.close()
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    msg_type, request_id, length = HEADER.unpack(header)
+    if max_length is not None and length > max_length:
+        raise FrameTooLarge(request_id, length)
+    payload = await reader.readexactly(length) if length else b""
+    return msg_type, request_id, payload
+
+
+def write_frame(writer, msg_type, request_id, payload=b""):
+    """Queues one frame on `writer`; header and payload are written back to back, so frames never interleave."""
+    writer.write(HEADER.pack(msg_type, request_id, len(payload)))
+    if len(payload):
+        writer.write(payload)
+
+
+def encode_audio(block, audio_format):
+    """Returns a buffer over the PCM bytes of `block` without copying float32 data."""
+    if audio_format == "int16":
+        block = (np.clip(block, -1.0, 1.0) * 32767).astype("<i2")
+    else:
+        block = np.ascontiguousarray(block, dtype="<f4")
+    return memoryview(block).cast("B")
+
+
+# server
+
+
+class TTSServer:
+    """
+    asyncio front-end that routes requests to a single model worker thread.
+
+    Generation is serialized on the worker (the model is not thread-safe). Each request streams
+    through a bounded queue: when a client reads slowly, its queue fills and the worker waits,
+    so memory stays bounded. A client that disconnects cancels its pending requests.
+
+    Args:
+        processor (TTSStreamingProcessor): The loaded model.
+        max_pending_blocks (int): Audio blocks buffered per request before the worker waits.
+    """
+
+    def __init__(self, processor, max_pending_blocks=8):
+        self.processor = processor
+        self.max_pending_blocks = max_pending_blocks
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-model")
+
+    def _generate(self, loop, blocks, cancelled, text, voice, params):
+        """Runs on the model worker; pushes blocks into the request's asyncio queue."""
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(blocks.put(item), loop).result()
+
+        if cancelled.is_set():  # the client left while this request was waiting for the worker
+            put(None)
+            return
+        try:
+            for block in self.processor.generate_stream(text, voice=voice, **params):
+                if cancelled.is_set():
+                    return
+                put(block)
+        except Exception as e:
+            traceback.print_exc()
+            put(e)
+        finally:
+            put(None)
+
+    async def _serve_request(self, writer, request_id, request, cancelled):
+        loop = asyncio.get_running_loop()
+        blocks = asyncio.Queue(maxsize=self.max_pending_blocks)
+        audio_format = request.get("format", "float32")
+        params = {k: v for k, v in request.get("params", {}).items() if k in REQUEST_PARAMS}
+        job = loop.run_in_executor(
+            self.worker, self._generate, loop, blocks, cancelled, request["text"], request.get("voice"), params
+        )
+
+        samples = 0
+        try:
+            while True:
+                block = await blocks.get()
+                if block is None:
+                    break
+                if isinstance(block, Exception):
+                    write_frame(writer, MSG_ERROR, request_id, json.dumps({"error": str(block)}).encode("utf-8"))
+                    await writer.drain()
+                    return
+                write_frame(writer, MSG_AUDIO, request_id, encode_audio(block, audio_format))
+                samples += len(block)
+                await writer.drain()
+            end = {"samples": samples, "sample_rate": self.processor.sampling_rate}
+            write_frame(writer, MSG_END, request_id, json.dumps(end).encode("utf-8"))
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            cancelled.set()
+            # let the worker finish its current put and stop
+            while not job.done():
+                try:
+                    blocks.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+            raise
+
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        print(f"Accepted connection from {peer}")
+        cancelled = threading.Event()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader, max_length=MAX_PAYLOAD)
+                except FrameTooLarge as e:
+                    # the body was not read, so the stream cannot be resynchronized: reply and close
+                    write_frame(writer, MSG_ERROR, e.request_id, json.dumps({"error": str(e)}).encode("utf-8"))
+                    await writer.drain()
+                    break
+                if frame is None:
+                    break
+                msg_type, request_id, payload = frame
+                if msg_type != MSG_REQUEST:
+                    write_frame(writer, MSG_ERROR, request_id, b'{"error": "invalid frame"}')
+                    await writer.drain()
+                    continue
+                try:
+                    request = json.loads(payload)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    if not isinstance(request.get("text"), str) or not request["text"].strip():
+                        raise ValueError("text is required")
+                    if not isinstance(request.get("params", {}), dict):
+                        raise ValueError("params must be a JSON object")
+                    if request.get("voice") is not None and not isinstance(request["voice"], str):
+                        raise ValueError("voice must be a string")
+                    if request.get("format", "float32") not in AUDIO_FORMATS:
+                        raise ValueError(f"format must be one of: {', '.join(AUDIO_FORMATS)}")
+                except ValueError as e:
+                    write_frame(writer, MSG_ERROR, request_id, json.dumps({"error": str(e)}).encode("utf-8"))
+                    await writer.drain()
+                    continue
+                task = asyncio.create_task(self._serve_request(writer, request_id, request, cancelled))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # the client finished sending; wait for its responses
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError as e:
+            print(f"Error handling client {peer}: {e}")
+        finally:
+            cancelled.set()
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Server listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
 
 
 def start_server(host, port, processor):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((host, port))
-    server.listen(5)
-    print(f"Server listening on {host}:{port}")
-
-    while True:
-        client_socket, addr = server.accept()
-        print(f"Accepted connection from {addr}")
-        client_handler = Thread(target=handle_client, args=(client_socket, processor))
-        client_handler.start()
+    asyncio.run(TTSServer(processor).serve(host, port))
+
+
+# client
+
+
+async def synthesize(host, port, text, voice=None, audio_format="float32", request_id=1, **params):
+    """Example client: sends one request and yields audio blocks as numpy arrays."""
+    reader, writer = await asyncio.open_connection(host, port)
+    request = {"text": text, "voice": voice, "format": audio_format, "params": params}
+    write_frame(writer, MSG_REQUEST, request_id, json.dumps(request).encode("utf-8"))
+    await writer.drain()
+    dtype = "<i2" if audio_format == "int16" else "<f4"
+    try:
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                raise ConnectionError("Server closed the connection")
+            msg_type, _, payload = frame
+            if msg_type == MSG_AUDIO:
+                yield np.frombuffer(payload, dtype=dtype)
+            elif msg_type == MSG_END:
+                return
+            elif msg_type == MSG_ERROR:
+                raise RuntimeError(json.loads(payload)["error"])
+    finally:
+        writer.close()
 
 
 if __name__ == "__main__":